@@ -1,5 +1,4 @@
-from librosa.core import stft, istft                    # Librosa Version 0.6.0
-from librosa.decompose import hpss
+from MedianSeparate import median_separate              # Median filtering separator (librosa)
 import essentia.standard as es
 from essentia import array
 
@@ -40,12 +39,8 @@ for i in range(nFiles):
         monoLoader = es.MonoLoader(filename=mixFile, sampleRate=44100)
         x = monoLoader()[:nSeconds*44100]
 
-        _stft = stft(x, n_fft=fftSize, hop_length=hopSize, win_length=frameSize, window=winType)
-
-        X_H, X_P = hpss(_stft, kernel_size=150)                     # Get harmonic and percussive stfts
-
-        x_h = istft(X_H, hop_length=hopSize, win_length=frameSize)  # Convert stfts to time domain signals
-        x_p = istft(X_P, hop_length=hopSize, win_length=frameSize)
+        x_p, x_h = median_separate(x, frameSize=frameSize, hopSize=hopSize, fftSize=fftSize, winType=winType,
+                                   kernel_size=150)
 
         MonoWriter = es.MonoWriter(sampleRate=44100, format="mp3")  # Write to file
         MonoWriter.configure(filename=saveFolderLoc+filename+"_median_percussive.mp3")
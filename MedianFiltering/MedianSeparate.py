@@ -0,0 +1,31 @@
+from librosa.core import stft, istft                    # Librosa Version 0.6.0
+from librosa.decompose import hpss
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SparsenessSmoothness"))
+from STFTCache import default_stft_cache                # Spectrograms shared with the other separators/canvases
+
+
+# Harmonic + Percussive separation by median filtering of the spectrogram (librosa.decompose.hpss)
+
+
+def median_separate(x, frameSize=2048, hopSize=1024, fftSize=2048, winType="hann", kernel_size=150,
+                    stft_cache=default_stft_cache):
+    #
+    #   x (1-D Array )      :   Time-domain mono audio signal
+    #   frameSize, hopSize, fftSize, winType    :   stft/istft parameters
+    #   kernel_size (int)   :   size of the median filters (see librosa.decompose.hpss)
+    #   stft_cache          :   STFTCache used for the stft of x (None: the stft is always calculated)
+    #
+    #   returns the percussive and harmonic time-domain signals (x_p, x_h)
+    if stft_cache is not None:
+        _stft = stft_cache.stft(x, fftSize=fftSize, frameSize=frameSize, hopSize=hopSize, winType=winType)
+    else:
+        _stft = stft(x, n_fft=fftSize, hop_length=hopSize, win_length=frameSize, window=winType)
+
+    X_H, X_P = hpss(_stft, kernel_size=kernel_size)             # Get harmonic and percussive stfts
+
+    x_h = istft(X_H, hop_length=hopSize, win_length=frameSize)  # Convert stfts to time domain signals
+    x_p = istft(X_P, hop_length=hopSize, win_length=frameSize)
+
+    return x_p, x_h
@@ -0,0 +1,110 @@
+from DecomposeSmoothSparse import HPSS           # Import SmoothSparse NMF separator (developed by me)
+import essentia.standard as es
+import numpy as np
+
+import glob, json, time
+
+# Compares the separations obtained with a candidate configuration of HPSS against a reference configuration on the
+# clips of the dataset, and reports how much the masks and the separated signals differ.
+#
+# Both configurations start from the same random initialization (the numpy seed is reset before each separation),
+# so the differences only come from the options that differ between the reference and the candidate.
+
+dataSetLocation = "../dataset/"                 # Location of dataset (entries are in separate folders)
+
+clipPattern = "*/*.wav"                         # clips to be separated (relative to dataSetLocation)
+
+nSeconds = 30                                   # number of seconds to analyze
+
+reportFile = "accuracy_report.json"             # machine readable report (set to "" to disable)
+
+frameSize = 2048                                # frame size for stft calculation
+hopSize = 1024                                  # hop size for stft calculation
+fftSize = 2048                                  # fft size for stft calculation
+
+common_options = dict(
+    beta=1.5,                                   # beta divergence coefficient
+    frameSize=frameSize,
+    hopSize=hopSize,
+    fftSize=fftSize,
+    Rp=150,                                     # Number of percussive bases
+    Rh=150,                                     # Number of harmonic bases
+    maxIter=100,                                # Number of iterations to update the har/per masks
+    K_SSM=.2,                                   # Percussive Spectral Smoothness weight on cost function
+    K_TSP=.1,                                   # Percussive Temporal Sparseness weight on cost function
+    K_SSP=.1,                                   # Harmonic Spectral Sparseness weight on cost function
+    K_TSM=.2,                                   # Harmonic Temporal Smoothness weight on cost function
+)
+
+# configurations to compare: (name, options of the reference, options of the candidate)
+comparisons = [
+    ("float32", dict(dtype="float64"), dict(dtype="float32")),
+    ("coarse", dict(), dict(coarseIter=70)),     # 70 coarse + 30 full resolution iterations
+]
+
+
+def run_separation(x, options, seed=0):
+    # separates x and returns the separator and the wall time of the separation (in seconds)
+    np.random.seed(seed)
+    time1 = time.time()
+    hpss = HPSS(x, **options)
+    hpss.separate()
+    return hpss, time.time() - time1
+
+
+def snr(reference, estimate):
+    # signal to (difference) noise ratio in dB
+    length = min(len(reference), len(estimate))
+    reference = np.asarray(reference[:length], dtype=np.float64)
+    noise = reference - np.asarray(estimate[:length], dtype=np.float64)
+    return 10 * np.log10(np.sum(np.square(reference)) / max(np.sum(np.square(noise)), np.finfo(float).tiny))
+
+
+def compare(reference, candidate):
+    # returns the differences between two separations of the same signal
+    final_cost_reference = float(reference.cost_history[-1][1]) if reference.cost_history else float("nan")
+    final_cost_candidate = float(candidate.cost_history[-1][1]) if candidate.cost_history else float("nan")
+    return {
+        "mask_max_abs_error": float(np.max(np.abs(reference.M_P - candidate.M_P))),
+        "mask_mean_abs_error": float(np.mean(np.abs(reference.M_P - candidate.M_P))),
+        "percussive_snr_db": float(snr(reference.x_p, candidate.x_p)),
+        "harmonic_snr_db": float(snr(reference.x_h, candidate.x_h)),
+        "final_cost_reference": final_cost_reference,
+        "final_cost_candidate": final_cost_candidate,
+        "iterations_reference": reference.n_iter,
+        "iterations_candidate": candidate.n_iter,
+    }
+
+
+if __name__ == "__main__":
+    report = []
+
+    for clip in sorted(glob.glob(dataSetLocation + clipPattern)):
+        x = es.MonoLoader(filename=clip, sampleRate=44100)()[:nSeconds*44100]
+
+        for name, reference_options, candidate_options in comparisons:
+            print("Comparing", name, "on", clip)
+            options = dict(common_options, **reference_options)
+            reference, reference_time = run_separation(x, options)
+            options = dict(common_options, **candidate_options)
+            candidate, candidate_time = run_separation(x, options)
+
+            result = compare(reference, candidate)
+            result.update({"clip": clip, "comparison": name,
+                           "time_reference_s": reference_time, "time_candidate_s": candidate_time})
+            report.append(result)
+
+    print("\n%-10s %-50s %12s %12s %12s %12s %8s" % ("comparison", "clip", "mask max err", "mask mean err",
+                                                    "perc SNR dB", "harm SNR dB", "speedup"))
+    for result in report:
+        print("%-10s %-50s %12.2e %12.2e %12.1f %12.1f %8.2f" % (result["comparison"], result["clip"][-50:],
+                                                                 result["mask_max_abs_error"],
+                                                                 result["mask_mean_abs_error"],
+                                                                 result["percussive_snr_db"],
+                                                                 result["harmonic_snr_db"],
+                                                                 result["time_reference_s"] /
+                                                                 result["time_candidate_s"]))
+
+    if reportFile:
+        with open(reportFile, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,195 @@
+import argparse, glob, json, multiprocessing, os, sys, time, traceback
+
+# Batch harmonic/percussive separation of all the entries of a dataset on a process pool
+#
+# Dataset layout (same as MainCode.py and MainCodeLibrosa.py):
+#       <dataset>/<entry>/mix/<track>.mp3            files to be separated
+#       <dataset>/<entry>/separated/                  separated files
+#                   <track>_smsp_percussive.mp3, <track>_smsp_harmonic.mp3          (SMSP, DecomposeSmoothSparse.py)
+#                   <track>_median_percussive.mp3, <track>_median_harmonic.mp3      (median filtering)
+#
+# Tracks whose separated files are newer than the mix are skipped (unless --force), and a line with the status and
+# timings of each track is appended to the manifest (JSON lines).
+#
+# exp: python BatchSeparate.py --dataset ../audio/ --methods smsp median --workers 8 --blas-threads 1
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "MedianFiltering"))
+
+BLAS_THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS",
+                         "NUMEXPR_NUM_THREADS")
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Separates the harmonic and percussive parts of all the tracks in a "
+                                                 "dataset")
+    parser.add_argument("--dataset", default="../audio/", help="location of the dataset (default: ../audio/)")
+    parser.add_argument("--mix-pattern", default="*/mix/*.mp3",
+                        help="pattern of the files to separate, relative to the dataset (default: */mix/*.mp3)")
+    parser.add_argument("--save-folder", default="separated",
+                        help="folder (next to the mix folder) where the separated files are saved (default: separated)")
+    parser.add_argument("--methods", nargs="+", choices=("smsp", "median"), default=["smsp"],
+                        help="separation methods (default: smsp)")
+    parser.add_argument("--format", default="mp3", help="format of the separated files (default: mp3)")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="number of worker processes (default: number of cpus)")
+    parser.add_argument("--blas-threads", type=int, default=1,
+                        help="number of BLAS threads in each worker (default: 1)")
+    parser.add_argument("--seconds", type=float, default=None,
+                        help="number of seconds to analyze (default: whole track)")
+    parser.add_argument("--force", action="store_true", help="separate the tracks even if they are up to date")
+    parser.add_argument("--manifest", default="separation_manifest.jsonl",
+                        help="file where the status of each track is appended (default: separation_manifest.jsonl)")
+
+    parser.add_argument("--frame-size", type=int, default=2048, help="frame size for stft calculation")
+    parser.add_argument("--hop-size", type=int, default=1024, help="hop size for stft calculation")
+    parser.add_argument("--fft-size", type=int, default=2048, help="fft size for stft calculation")
+
+    parser.add_argument("--beta", type=float, default=1.5, help="SMSP: beta divergence coefficient")
+    parser.add_argument("--rp", type=int, default=150, help="SMSP: number of percussive bases")
+    parser.add_argument("--rh", type=int, default=150, help="SMSP: number of harmonic bases")
+    parser.add_argument("--max-iter", type=int, default=200, help="SMSP: maximum number of iterations")
+    parser.add_argument("--tol", type=float, default=1e-3, help="SMSP: relative cost decrease to stop iterating")
+    parser.add_argument("--k", type=float, nargs=4, default=[1, 1, 1, 1], metavar=("K_SSM", "K_TSP", "K_SSP", "K_TSM"),
+                        help="SMSP: smoothness/sparseness weights")
+    parser.add_argument("--block-seconds", type=float, default=30,
+                        help="SMSP: length of the segments separated one at a time")
+    parser.add_argument("--overlap-seconds", type=float, default=2,
+                        help="SMSP: overlap between consecutive segments")
+    parser.add_argument("--dtype", default="float64", choices=("float32", "float64"), help="SMSP: precision")
+
+    parser.add_argument("--kernel-size", type=int, default=150, help="median: size of the median filters")
+    return parser.parse_args(argv)
+
+
+def output_files(mix_file, method, args):
+    # Returns the percussive and harmonic files of a separated track
+    entry_folder = os.path.dirname(os.path.dirname(os.path.abspath(mix_file)))
+    filename = os.path.splitext(os.path.basename(mix_file))[0] + "_" + method
+    save_folder = os.path.join(entry_folder, args.save_folder)
+    return (os.path.join(save_folder, filename + "_percussive." + args.format),
+            os.path.join(save_folder, filename + "_harmonic." + args.format))
+
+
+def is_up_to_date(mix_file, outputs):
+    # True if all the outputs exist and are newer than the mix file
+    mix_time = os.path.getmtime(mix_file)
+    return all(os.path.isfile(output) and os.path.getmtime(output) >= mix_time for output in outputs)
+
+
+def find_jobs(args):
+    # Returns the (mix file, method) pairs to separate and the ones that are already up to date
+    jobs, skipped = [], []
+    for mix_file in sorted(glob.glob(os.path.join(args.dataset, args.mix_pattern))):
+        for method in args.methods:
+            if not args.force and is_up_to_date(mix_file, output_files(mix_file, method, args)):
+                skipped.append((mix_file, method))
+            else:
+                jobs.append((mix_file, method))
+    return jobs, skipped
+
+
+def init_worker(blas_threads):
+    # Pins the number of BLAS threads of the worker (the environment variables are already set by the parent process
+    # before the workers are spawned, threadpoolctl also limits the libraries loaded in the meantime)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=blas_threads, user_api="blas")
+    except ImportError:
+        pass
+
+
+def separate_track(job):
+    # Separates a single track (runs in a worker process)
+    # returns the manifest record of the track
+    mix_file, method, args = job
+    record = {"mix": mix_file, "method": method, "pid": os.getpid()}
+    try:
+        import essentia.standard as es
+        from essentia import array
+
+        time1 = time.time()
+        x = es.MonoLoader(filename=mix_file, sampleRate=44100)()
+        if args.seconds is not None:
+            x = x[:int(args.seconds*44100)]
+        time2 = time.time()
+
+        if method == "smsp":
+            from DecomposeSmoothSparse import BlockHPSS
+            hpss = BlockHPSS(
+                x,
+                blockSize=int(args.block_seconds*44100),
+                overlapSize=int(args.overlap_seconds*44100),
+                beta=args.beta,
+                frameSize=args.frame_size,
+                hopSize=args.hop_size,
+                fftSize=args.fft_size,
+                Rp=args.rp,
+                Rh=args.rh,
+                maxIter=args.max_iter,
+                tol=args.tol,
+                K_SSM=args.k[0],
+                K_TSP=args.k[1],
+                K_SSP=args.k[2],
+                K_TSM=args.k[3],
+                dtype=args.dtype,
+                blas_threads=args.blas_threads,
+            )
+            hpss.separate()
+            x_p, x_h = hpss.x_p, hpss.x_h
+        else:
+            from MedianSeparate import median_separate
+            x_p, x_h = median_separate(x, frameSize=args.frame_size, hopSize=args.hop_size, fftSize=args.fft_size,
+                                       kernel_size=args.kernel_size)
+        time3 = time.time()
+
+        percussive_file, harmonic_file = output_files(mix_file, method, args)
+        if not os.path.isdir(os.path.dirname(percussive_file)):
+            os.makedirs(os.path.dirname(percussive_file), exist_ok=True)
+        # written as .part files and renamed once complete, so an interrupted write never leaves a truncated output
+        # that would be considered up to date
+        for output, values in ((percussive_file, x_p), (harmonic_file, x_h)):
+            es.MonoWriter(filename=output + ".part", sampleRate=44100, format=args.format)(array(values))
+        for output in (percussive_file, harmonic_file):
+            os.replace(output + ".part", output)
+        time4 = time.time()
+
+        record.update({"status": "done", "seconds": len(x)/44100.0, "load_s": time2-time1,
+                       "separate_s": time3-time2, "write_s": time4-time3,
+                       "outputs": [percussive_file, harmonic_file]})
+    except Exception as error:
+        record.update({"status": "failed", "error": repr(error), "traceback": traceback.format_exc()})
+    return record
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+
+    jobs, skipped = find_jobs(args)
+    print("%i separations to run, %i up to date" % (len(jobs), len(skipped)))
+
+    with open(args.manifest, "a") as manifest:
+        for mix_file, method in skipped:
+            manifest.write(json.dumps({"mix": mix_file, "method": method, "status": "up to date"}) + "\n")
+
+        if not jobs:
+            return
+
+        # workers inherit the environment when they are spawned (before they import numpy)
+        for variable in BLAS_THREAD_VARIABLES:
+            os.environ[variable] = str(args.blas_threads)
+
+        context = multiprocessing.get_context("spawn")
+        pool = context.Pool(processes=max(min(args.workers, len(jobs)), 1), initializer=init_worker,
+                            initargs=(args.blas_threads,), maxtasksperchild=1)
+        try:
+            for ix, record in enumerate(pool.imap_unordered(separate_track, [job + (args,) for job in jobs])):
+                print("[%i/%i] %s %s: %s" % (ix+1, len(jobs), record["method"], record["mix"], record["status"]))
+                manifest.write(json.dumps(record) + "\n")
+                manifest.flush()
+        finally:
+            pool.close()
+            pool.join()
+
+
+if __name__ == "__main__":
+    main()
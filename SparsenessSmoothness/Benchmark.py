@@ -0,0 +1,188 @@
+import numpy as np
+
+import argparse, glob, itertools, json, multiprocessing, os, platform, sys, time
+
+# Benchmark of the harmonic/percussive separation engines
+#
+# Separates synthetic signals (reproducible, generated from a seed) and/or the clips of the dataset with every
+# combination of fftSize, hopSize, number of components (Rp = Rh) and track length, and reports:
+#       smsp    :   setup time (stft, normalization, allocations), time per iteration, time spent in each update
+#                   term (eqXX, fused products, common factors, cost), masks + istft time, real time factor, peak RSS
+#       median  :   separation time, real time factor, peak RSS
+#
+# Each configuration runs in a new process, so that the peak RSS (resource.getrusage) only includes that run.
+# The results are written as JSON (one record per configuration) for tracking regressions between versions.
+#
+# exp: python Benchmark.py --fft-sizes 1024 2048 --hop-sizes 256 512 --components 50 150 --seconds 10 30
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "MedianFiltering"))
+
+TIMED_METHODS = ["calc_common_factors", "calc_fused_products", "calc_cost"] + \
+                ["eq%i" % eq for eq in range(19, 35)]        # methods of HPSS timed at each call
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the SMSP and median filtering separators")
+    parser.add_argument("--methods", nargs="+", choices=("smsp", "median"), default=["smsp", "median"])
+    parser.add_argument("--signals", nargs="+", choices=("synthetic", "dataset"), default=["synthetic"])
+    parser.add_argument("--dataset", default="../dataset/", help="location of the dataset (default: ../dataset/)")
+    parser.add_argument("--clip-pattern", default="*/*.wav", help="clips of the dataset (default: */*.wav)")
+    parser.add_argument("--fft-sizes", type=int, nargs="+", default=[2048], help="fft (and frame) sizes")
+    parser.add_argument("--hop-sizes", type=int, nargs="+", default=[512], help="hop sizes")
+    parser.add_argument("--components", type=int, nargs="+", default=[150], help="number of components Rp = Rh")
+    parser.add_argument("--seconds", type=float, nargs="+", default=[10], help="track lengths (in seconds)")
+    parser.add_argument("--iterations", type=int, default=20, help="number of SMSP iterations (default: 20)")
+    parser.add_argument("--repeat", type=int, default=1, help="number of runs of each configuration (default: 1)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic signals and initializations")
+    parser.add_argument("--option", nargs=2, action="append", default=[], metavar=("NAME", "VALUE"),
+                        help="extra HPSS option (value parsed as json if possible), exp: --option dtype float32")
+    parser.add_argument("--output", default="benchmark.json", help="json file with the results")
+    return parser.parse_args(argv)
+
+
+def synthetic_signal(seconds, seed=0, fs=44100):
+    # Harmonic part (slowly modulated tones) + percussive part (exponentially decaying noise bursts every 0.5 s)
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(seconds * fs)) / float(fs)
+    harmonic = .3 * np.sin(2 * np.pi * 110 * t) * (1 + .5 * np.sin(2 * np.pi * .25 * t)) + \
+               .2 * np.sin(2 * np.pi * 220 * t + np.sin(3 * t)) + .1 * np.sin(2 * np.pi * 330 * t)
+    percussive = rng.randn(len(t)) * np.exp(-np.mod(t, .5) * 60)
+    return (harmonic + percussive).astype(np.float32)
+
+
+def load_signal(signal, seconds, seed):
+    # signal is "synthetic" or the filename of a clip
+    if signal == "synthetic":
+        return synthetic_signal(seconds, seed)
+    import essentia.standard as es
+    return es.MonoLoader(filename=signal, sampleRate=44100)()[:int(seconds * 44100)]
+
+
+def peak_rss_mb():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024.0 ** 2 if sys.platform == "darwin" else rss / 1024.0     # bytes on macOS, kilobytes on linux
+
+
+def timed(method, times):
+    # wraps a bound method, appending the duration of each call to times
+    def wrap(*args, **kwargs):
+        time1 = time.perf_counter()
+        ret = method(*args, **kwargs)
+        times.append(time.perf_counter() - time1)
+        return ret
+    return wrap
+
+
+def run_configuration(config):
+    # Runs a single configuration (in a new process) and returns its record
+    x = load_signal(config["signal"], config["seconds"], config["seed"])
+    duration = len(x) / 44100.0
+    rss_before = peak_rss_mb()
+    record = dict(config, duration_s=duration)
+
+    if config["method"] == "smsp":
+        from DecomposeSmoothSparse import HPSS
+        np.random.seed(config["seed"])
+        time1 = time.perf_counter()
+        hpss = HPSS(x, fftSize=config["fftSize"], frameSize=config["fftSize"], hopSize=config["hopSize"],
+                    Rp=config["components"], Rh=config["components"], maxIter=config["iterations"], stft_cache=None,
+                    **config["options"])
+        time2 = time.perf_counter()
+
+        method_times = {name: [] for name in TIMED_METHODS}
+        for name in TIMED_METHODS:
+            setattr(hpss, name, timed(getattr(hpss, name), method_times[name]))
+
+        iteration_times = []
+        with hpss.blas_thread_limit():
+            for i in range(config["iterations"]):
+                time3 = time.perf_counter()
+                hpss.next_iteration()
+                iteration_times.append(time.perf_counter() - time3)
+        time4 = time.perf_counter()
+
+        hpss.create_masks()
+        hpss.spectral_to_temporal_using_masks()
+        time5 = time.perf_counter()
+
+        record.update({
+            "setup_s": time2 - time1,
+            "iteration_s": {"mean": float(np.mean(iteration_times)), "median": float(np.median(iteration_times)),
+                            "min": float(np.min(iteration_times)), "max": float(np.max(iteration_times))},
+            "methods_s": {name: {"calls": len(times), "total": float(np.sum(times))}
+                          for name, times in method_times.items() if times},
+            "resynthesis_s": time5 - time4,
+            "total_s": time5 - time1,
+            "F": hpss.F,
+            "T": hpss.T,
+        })
+    else:
+        from MedianSeparate import median_separate
+        time1 = time.perf_counter()
+        median_separate(x, frameSize=config["fftSize"], hopSize=config["hopSize"], fftSize=config["fftSize"],
+                        stft_cache=None)
+        record["total_s"] = time.perf_counter() - time1
+
+    record["rtf"] = record["total_s"] / duration            # real time factor (< 1: faster than real time)
+    record["peak_rss_mb"] = peak_rss_mb()
+    record["rss_increase_mb"] = record["peak_rss_mb"] - rss_before
+    return record
+
+
+def configurations(args):
+    signals = []
+    if "synthetic" in args.signals:
+        signals.append("synthetic")
+    if "dataset" in args.signals:
+        signals += sorted(glob.glob(os.path.join(args.dataset, args.clip_pattern)))
+
+    options = {}
+    for name, value in args.option:
+        try:
+            options[name] = json.loads(value)
+        except ValueError:
+            options[name] = value
+
+    for method, signal, seconds, fftSize, hopSize, components, run in itertools.product(
+            args.methods, signals, args.seconds, args.fft_sizes, args.hop_sizes, args.components, range(args.repeat)):
+        if method == "median" and components != args.components[0]:
+            continue                                            # the median separation does not use components
+        yield {"method": method, "signal": signal, "seconds": seconds, "fftSize": fftSize, "hopSize": hopSize,
+               "components": components if method == "smsp" else None, "iterations": args.iterations,
+               "seed": args.seed, "run": run, "options": options if method == "smsp" else {}}
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    context = multiprocessing.get_context("spawn")
+
+    records = []
+    for config in configurations(args):
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            try:
+                record = pool.apply(run_configuration, (config,))
+            except Exception as error:
+                record = dict(config, error=repr(error))
+        records.append(record)
+
+        if "error" in record:
+            print("%(method)-6s %(signal)s: failed (%(error)s)" % record)
+        elif record["method"] == "smsp":
+            print("%-6s %-30s %5.0fs fft %5i hop %5i R %4i: %7.1f ms/iteration, rtf %6.3f, peak rss %7.1f MB" %
+                  (record["method"], record["signal"][-30:], record["seconds"], record["fftSize"], record["hopSize"],
+                   record["components"], 1000 * record["iteration_s"]["median"], record["rtf"],
+                   record["peak_rss_mb"]))
+        else:
+            print("%-6s %-30s %5.0fs fft %5i hop %5i        : %7.1f ms total,     rtf %6.3f, peak rss %7.1f MB" %
+                  (record["method"], record["signal"][-30:], record["seconds"], record["fftSize"], record["hopSize"],
+                   1000 * record["total_s"], record["rtf"], record["peak_rss_mb"]))
+
+    with open(args.output, "w") as f:
+        json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                   "processor": platform.processor(), "cpus": multiprocessing.cpu_count(),
+                   "arguments": vars(args), "results": records}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
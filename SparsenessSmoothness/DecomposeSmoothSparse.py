@@ -5,21 +5,37 @@ import os, sys
 from librosa.core import stft, istft                    # Librosa Version 0.6.0
 from essentia import Pool, array                        # Essentia Version 2.1-dev
 import time
-
-# --------------------------------------- Utility Function: Timer --------------------------------------#
-# Used for Calculating Execution Times of different functions in algorithm
-
-
-def timing(f, timer_enabled=False):       # set timer_enabled True to time functions or set False to disable timer
-    def wrap(*args):
-        if timer_enabled:
-            time1 = time.time()
-        ret = f(*args)
-        if timer_enabled:
-            time2 = time.time()
-            print('%s function took %0.3f ms' % (f.__name__, (time2-time1)*1000.0))
-        return ret
-    return wrap
+import multiprocessing
+from contextlib import contextmanager
+from STFTCache import default_stft_cache                # Spectrograms shared with the other separators/canvases
+from SeparationArtifacts import save_artifacts          # On-disk store of masks, spectrograms and factors
+from Resynthesis import masks_from_spectrograms, batch_istft    # Masks and batched istft of the separated parts
+from Instrumentation import span                        # Latency of the stages (no cost if instrumentation is off)
+
+try:
+    from threadpoolctl import threadpool_limits         # Optional, used for setting the number of BLAS threads
+except ImportError:
+    threadpool_limits = None
+
+# --------------------------------------- Utility Functions: Bases files --------------------------------#
+# Used for reusing the bases learnt on a track to initialize the separation of other tracks
+
+
+def save_bases(filename, W_P, W_H, **parameters):
+    # Saves the percussive/harmonic bases (and the stft/cost parameters they were learnt with) to a compressed
+    # .npz file
+    np.savez_compressed(filename, W_P=W_P, W_H=W_H, **parameters)
+
+
+def load_bases(filename):
+    # Loads a bases file saved by save_bases
+    # returns a dictionary with the bases (W_P, W_H) and the saved parameters
+    with np.load(filename) as bases_file:
+        bases = {key: bases_file[key] for key in bases_file.files}
+    for key in bases:
+        if key not in ("W_P", "W_H"):
+            bases[key] = bases[key].item()
+    return bases
 # ------------------------------------------------------------------------------------------------------#
 
 
@@ -61,11 +77,62 @@ class HPSS:
         #       winType (str)   :   Type of window applied to each frame for stft/istft calculations
         #                           (based on window types in scipy.signal.get_window)
         #       maxIter (int)   :   Maximum number of iterations to update basis vectors and activations (default = 100)
+        #       tol (float)     :   Stop iterating when the relative decrease of the cost between two evaluations
+        #                           falls below tol (default = 0, i.e. always run maxIter iterations)
+        #       cost_interval (int) :   Number of iterations between two evaluations of the cost, rounded up to an
+        #                               even number (default = 10)
         #       K_SSM (float)   :   Spectral smoothness weight  (default = .1)
         #       K_SSP (float)   :   Spectral sparseness weight  (default = .1)
         #       K_TSM (float)   :   Temporal smoothness weight  (default = .1)
         #       K_TSP (float)   :   Temporal sparseness weight  (default = .1)
         #       StatusBar       :   pyQt status bar for outputing messages (optional)
+        #       regularizer_backend (str)   :   implementation of the smoothness/sparseness terms (eq21, eq22, eq25,
+        #                                       eq26, eq29, eq30, eq33 and eq34)
+        #                                       "vectorized": all components are computed at once (default)
+        #                                       "loop": loops over the components (reference implementation)
+        #       fused_updates (bool)    :   if True, the percussive and harmonic factors are stored in single blocks
+        #                                   [W_P | W_H] and [H_P; H_H] so that each side of the update only needs
+        #                                   two matrix products (with A1 and A2) per iteration (default = True)
+        #       blas_threads (int)      :   number of threads used by BLAS while iterating (requires threadpoolctl)
+        #                                   (default = None, i.e. BLAS default)
+        #       dtype (str)     :   precision of the spectrograms, factors, workspaces and masks
+        #                           "float64" (default) or "float32" (half the memory and memory bandwidth)
+        #       W_P (2-D Array) :   initial percussive basis vectors <FxRp> (default = random initialization)
+        #       W_H (2-D Array) :   initial harmonic basis vectors <FxRh> (default = random initialization)
+        #                           (used for warm starting from the bases learnt on another signal, see BlockHPSS)
+        #       bases_file (str):   file saved by save_bases, used for initializing W_P and W_H (Rp and Rh are set to
+        #                           the number of saved bases)
+        #       freeze_bases (bool) :   if True, the bases are kept fixed and only the activations are updated
+        #                               (default = False)
+        #       seed (int)      :   seed of the random initialization of the factors, for reproducible separations
+        #                           (default = None, i.e. numpy global random state)
+        #       stft_cache      :   STFTCache used for the stft of the signal (default = STFTCache.default_stft_cache)
+        #                           (None: the stft is always calculated)
+        #       artifacts (bool):   if True, save_separated_audiofiles also saves the masks, spectrograms and factors
+        #                           (see save_artifacts) (default = False)
+        #       mask_power (float)  :   exponent of the soft masks (default = 2, i.e. Wiener masks as in [1])
+        #       binary_mask (bool)  :   if True, binary masks are used instead of soft masks (default = False)
+        #       spectrogram (2-D Array) :   magnitude spectrogram <FxT> to decompose instead of the stft of x (x is then
+        #                                   not used, and the masks cannot be applied, see from_spectrogram)
+        #       coarseIter (int)    :   number of iterations (out of maxIter) done on a coarse version of the
+        #                               spectrogram before iterating at full resolution (default = 0, i.e. disabled)
+        #       coarseFreq (int)    :   number of frequency bins averaged in each bin of the coarse spectrogram
+        #                               (default = 4)
+        #       coarseTime (int)    :   number of frames averaged in each frame of the coarse spectrogram
+        #                               (default = 4)
+        #       coarseComponents (float)    :   fraction of Rp and Rh used for the coarse decomposition (default = .5)
+        #       normalized (bool)   :   if True, spectrogram is already normalized (used as X_nBeta without copy)
+        #                               (default = False)
+        #       n_restarts (int)    :   number of random initializations tried in parallel processes, the one with the
+        #                               lowest cost after restartIter iterations is kept (default = 1, i.e. disabled)
+        #                               (not used with coarseIter > 0)
+        #       restartIter (int)   :   number of iterations (out of maxIter) done for each initialization
+        #                               (default = 10)
+        #       restart_workers (int)   :   number of worker processes for the restarts (default = min(n_restarts,
+        #                                   number of cpus))
+        #       iteration_callback  :   function called as iteration_callback(hpss, iteration) after each full
+        #                               resolution iteration of separate() (exp: to report the progress of a gui job)
+        #                               (default = None)
 
         #   Initialize object parameters
         self.directory = ""                     # Directory for writing the separated audio files
@@ -94,12 +161,38 @@ class HPSS:
         self.Rp = 150                           # Number of percussive components
         self.Rh = 150                           # Number of harmonic components (Remember that (Rp+Rh) < min(F, T)) [2]
         self.maxIter = 100.0                    # Number of iterations for updating basis and activation matrices
+        self.tol = 0.0                          # Relative cost decrease below which the iterations are stopped
+        self.cost_interval = 10                 # Number of iterations between two evaluations of the cost
 
         self.K_SSM = .1                         # Spectral smoothness weight in cost function
         self.K_SSP = .1                         # Spectral sparseness weight in cost function
         self.K_TSM = .1                         # Temporal smoothness weight in cost function
         self.K_TSP = .1                         # Temporal sparseness weight in cost function
 
+        self.regularizer_backend = "vectorized"     # "vectorized" or "loop" (per component reference implementation)
+        self.fused_updates = True               # Stack percussive and harmonic factors to share the matrix products
+        self.blas_threads = None                # Number of BLAS threads (None: BLAS default)
+        self.dtype = np.dtype("float64")        # Precision used for the iterations (float64 or float32)
+        self.W_P_init = None                    # Initial percussive bases (None: random initialization)
+        self.W_H_init = None                    # Initial harmonic bases (None: random initialization)
+        self.bases_file = None                  # File with the initial bases (see save_bases)
+        self.freeze_bases = False               # Only update the activations if True
+        self.random = np.random                 # Random number generator used for initializing the factors
+        self.stft_cache = default_stft_cache    # Cache of the spectrograms (None: no caching)
+        self.artifacts = False                  # Save the artifacts of the separation with the separated files
+        self.mask_power = 2.0                   # Exponent of the soft masks
+        self.binary_mask = False                # Use binary masks instead of soft masks
+        self.spectrogram = None                 # Magnitude spectrogram to decompose (None: stft of x)
+        self.coarseIter = 0                     # Number of iterations done at the coarse resolution
+        self.coarseFreq = 4                     # Frequency decimation factor of the coarse resolution
+        self.coarseTime = 4                     # Time decimation factor of the coarse resolution
+        self.coarseComponents = .5              # Fraction of the components used at the coarse resolution
+        self.normalized = False                 # spectrogram is already normalized
+        self.n_restarts = 1                     # Number of random initializations tried in parallel
+        self.restartIter = 10                   # Number of iterations done for each initialization
+        self.restart_workers = None             # Number of worker processes for the restarts
+        self.iteration_callback = None          # Called after each iteration of separate()
+
         # pyqt status bar for outputing messages
         self.StatusBar = None
 
@@ -135,8 +228,8 @@ class HPSS:
                 self.hopSizeIsSpecified = "True"
 
             if option == "winType":
-                self.hopSize = str(options.get(option))
-                self.hopSizeIsSpecified = "True"
+                self.winType = str(options.get(option))
+                self.winTypeIsSpecified = "True"
 
             if option == "beta":
                 self.beta = np.float(options.get(option))
@@ -150,6 +243,14 @@ class HPSS:
             if option == "maxIter":
                 self.maxIter = np.int(options.get(option))
 
+            if option == "tol":
+                self.tol = float(options.get(option))
+
+            if option == "cost_interval":
+                # W and H are updated simultaneously, which makes the cost alternate between consecutive
+                # iterations. Costs are therefore only compared after an even number of iterations
+                self.cost_interval = 2 * max(int(np.ceil(options.get(option) / 2.0)), 1)
+
             if option == "K_SSM":
                 self.K_SSM = np.float(options.get(option))
 
@@ -165,116 +266,336 @@ class HPSS:
             if option == "StatusBar":
                 self.StatusBar = options.get(option)
 
+            if option == "regularizer_backend":
+                self.regularizer_backend = str(options.get(option))
+                if self.regularizer_backend not in ("vectorized", "loop"):
+                    raise ValueError("regularizer_backend should be either 'vectorized' or 'loop', got '%s'"
+                                     % self.regularizer_backend)
+
+            if option == "fused_updates":
+                self.fused_updates = bool(options.get(option))
+
+            if option == "dtype":
+                self.dtype = np.dtype(options.get(option))
+                if self.dtype not in (np.float32, np.float64):
+                    raise ValueError("dtype should be either 'float32' or 'float64', got '%s'" % self.dtype)
+
+            if option == "W_P":
+                self.W_P_init = options.get(option)
+
+            if option == "W_H":
+                self.W_H_init = options.get(option)
+
+            if option == "bases_file":
+                self.bases_file = options.get(option)
+
+            if option == "freeze_bases":
+                self.freeze_bases = bool(options.get(option))
+
+            if option == "seed":
+                if options.get(option) is not None:
+                    self.random = np.random.RandomState(options.get(option))
+
+            if option == "spectrogram":
+                self.spectrogram = options.get(option)
+
+            if option == "coarseIter":
+                self.coarseIter = int(options.get(option))
+
+            if option == "coarseFreq":
+                self.coarseFreq = max(int(options.get(option)), 1)
+
+            if option == "coarseTime":
+                self.coarseTime = max(int(options.get(option)), 1)
+
+            if option == "coarseComponents":
+                self.coarseComponents = float(options.get(option))
+
+            if option == "normalized":
+                self.normalized = bool(options.get(option))
+
+            if option == "n_restarts":
+                self.n_restarts = max(int(options.get(option)), 1)
+
+            if option == "restartIter":
+                self.restartIter = int(options.get(option))
+
+            if option == "restart_workers":
+                self.restart_workers = options.get(option)
+                if self.restart_workers is not None:
+                    self.restart_workers = max(int(self.restart_workers), 1)
+
+            if option == "mask_power":
+                self.mask_power = float(options.get(option))
+
+            if option == "binary_mask":
+                self.binary_mask = bool(options.get(option))
+
+            if option == "artifacts":
+                self.artifacts = bool(options.get(option))
+
+            if option == "stft_cache":
+                self.stft_cache = options.get(option)
+
+            if option == "iteration_callback":
+                self.iteration_callback = options.get(option)
+
+            if option == "blas_threads":
+                self.blas_threads = options.get(option)
+                if self.blas_threads is not None:
+                    self.blas_threads = int(self.blas_threads)
+
+        if self.bases_file is not None:
+            bases = load_bases(self.bases_file)
+            if self.W_P_init is None:
+                self.W_P_init = bases["W_P"]
+            if self.W_H_init is None:
+                self.W_H_init = bases["W_H"]
+            self.Rp = np.shape(self.W_P_init)[1]
+            self.Rh = np.shape(self.W_H_init)[1]
+
+        if self.freeze_bases and (self.W_P_init is None or self.W_H_init is None):
+            raise ValueError("freeze_bases requires initial bases (W_P and W_H, or bases_file)")
+
         #   Initialize separator object matrices and vectors
 
+        self.eps = np.finfo(self.dtype).eps     # Small value added to avoid divisions by zero
+
         self.xOriginal = x                      # Original time series signal
+        self.length = None if x is None else len(x)     # Number of samples of x (None: only a spectrogram is given)
 
-        self.Xc = self.stft(self.xOriginal)     # complex spectrogram of xOriginal/ Xc  <F(freq bins)xT(Time frames)>
+        if self.spectrogram is None:
+            self.Xc = self.stft(self.xOriginal)     # complex spectrogram of xOriginal/ Xc  <F(freq bins)xT(Time frames)>
 
-        self.Spec = np.abs(self.Xc)             # magnitude spectrogram of xOriginal    <F(freq bins)xT(Time frames)>
+            self.Spec = np.abs(self.Xc).astype(self.dtype, copy=False)     # magnitude spectrogram of xOriginal    <F(freq bins)xT(Time frames)>
+        else:
+            self.Xc = None                      # only the magnitude spectrogram is known
 
-        self.F = np.size(self.Xc, 0)            # number of frequency bins
-        self.T = np.size(self.Xc, 1)            # number of time frames
+            self.Spec = np.asarray(self.spectrogram, dtype=self.dtype)
 
-        self.X_nBeta = self.beta_normalize()    # magnitude normalized spectrogram
+        self.F = np.size(self.Spec, 0)          # number of frequency bins
+        self.T = np.size(self.Spec, 1)          # number of time frames
 
-        self.W_P = np.ones([self.F, self.Rp])           # Percussive basis vectors (numpy matrix)           <FxRp>
-        self.W_P = np.random.rand(self.F, self.Rp)      # Percussive basis vectors (numpy matrix)
-        self.W_P = np.matrix(self.W_P)
+        if self.normalized:
+            self.X_nBeta = self.Spec            # magnitude normalized spectrogram (given)
+        else:
+            self.X_nBeta = self.beta_normalize()    # magnitude normalized spectrogram
+        self.X_nBeta_powered_sum = None         # sum(X_nBeta^beta), constant term of the beta divergence
 
-        self.H_P = np.ones([self.Rp, self.T])           # Percussive temporal activations (numpy matrix)    <RpxT>
-        self.H_P = np.random.rand(self.Rp, self.T)      # Percussive temporal activations (numpy matrix)
-        self.H_P = np.matrix(self.H_P)
+        self.W = np.empty([self.F, self.Rp+self.Rh], dtype=self.dtype)  # Bases [W_P | W_H] (W_P and W_H are views of W)    <Fx(Rp+Rh)>
+        self.H = np.empty([self.Rp+self.Rh, self.T], dtype=self.dtype)  # Activations [H_P; H_H] (views of H)               <(Rp+Rh)xT>
 
-        self.W_H = np.ones([self.F, self.Rh])           # Harmonic basis vectors (numpy matrix)             <FxRh>
-        self.W_H = np.random.rand(self.F, self.Rh)      # Harmonic basis vectors (numpy matrix)
-        self.W_H = np.matrix(self.W_H)
+        self.W_P = self.W[:, :self.Rp]                  # Percussive basis vectors (numpy array)            <FxRp>
+        self.H_P = self.H[:self.Rp, :]                  # Percussive temporal activations (numpy array)     <RpxT>
+        self.W_H = self.W[:, self.Rp:]                  # Harmonic basis vectors (numpy array)              <FxRh>
+        self.H_H = self.H[self.Rp:, :]                  # Harmonic temporal activations (numpy array)       <RhxT>
 
-        self.H_H = np.ones([self.Rh, self.T])           # Harmonic temporal activations (numpy matrix)      <RhxT>
-        self.H_H = np.random.rand(self.Rh, self.T)      # Harmonic temporal activations (numpy matrix)
-        self.H_H = np.matrix(self.H_H)
+        self.init_factor("W_P", self.W_P_init)
+        self.init_factor("H_P", None)
+        self.init_factor("W_H", self.W_H_init)
+        self.init_factor("H_H", None)
 
-        self.A = []                                     # $W_{P}H_{P}+W_{H}H_{H}$                       (numpy matrix)
+        self.A = []                                     # $W_{P}H_{P}+W_{H}H_{H}$                       (numpy array)
         self.A1 = []                                    # $(W_{P}H_{P}+W_{H}H_{H})^(\beta-1)$
         self.A2 = []                                    # $(W_{P}H_{P}+W_{H}H_{H})^{(\beta-2)}\odot{X_{n\beta}}$
 
-        self.M_P = []                                   # Percussive mask (numpy matrix)                    <FxT>
-        self.M_H = []                                   # Harmonic mask   (numpy matrix)                    <FxT>
+        self.M_P = []                                   # Percussive mask (numpy array)                     <FxT>
+        self.M_H = []                                   # Harmonic mask   (numpy array)                     <FxT>
 
-        self.X_P = []                                   # Percussive Spectrogram (numpy matrix)             <FxT>
-        self.X_H = []                                   # Harmonic Spectrogram   (numpy matrix)             <FxT>
+        self.X_P = []                                   # Percussive Spectrogram (numpy array)              <FxT>
+        self.X_H = []                                   # Harmonic Spectrogram   (numpy array)              <FxT>
+
+        self.allocate_workspaces()                      # Preallocated matrices reused in every iteration
 
         self.x_p = []                                   # Percussive signal time domain (numpy array)
         self.x_h = []                                   # Harmonic signal time domain   (numpy array)
 
-    @timing
+        self.n_iter = 0                                 # Number of iterations done so far
+        self.cost_history = []                          # List of (iteration, cost) evaluated every cost_interval
+        self.converged = False                          # Set to True when the relative cost decrease is below tol
+
+    @classmethod
+    def from_spectrogram(cls, spectrogram, **options):
+        # Separator decomposing a magnitude spectrogram <FxT> (exp: a coarse version of the spectrogram of a signal)
+        return cls(None, spectrogram=spectrogram, **options)
+
+    def init_factor(self, factor, initial=None):
+        # Initializes a factor with the given values, or with random values if initial is None
+        M = getattr(self, factor)
+        if initial is None:
+            M[:] = self.random.rand(*M.shape)
+        else:
+            if np.shape(initial) != M.shape:
+                raise ValueError("Initial %s should be of shape %s, got %s" % (factor, M.shape, np.shape(initial)))
+            M[:] = initial
+
+    def save_bases(self, filename):
+        # Saves the current bases W_P and W_H to filename (.npz), to initialize other separations (option bases_file)
+        save_bases(filename, self.W_P, self.W_H, fftSize=self.fftSize, frameSize=self.frameSize,
+                   hopSize=self.hopSize, beta=self.beta)
+
     def beta_normalize(self):
         #   Following function normalizes the magnitude spectrogram
         #   returns magnitude normalized spectrogram X_nBeta
         #   refer to equation (2) in reference
-        SpecPowered = np.power(self.Spec, self.beta)
-        denom = np.sum(np.sum(SpecPowered, 0))
-        denom = denom/(float(self.F*self.T))
-        denom = np.power(denom, 1.0/self.beta)
-        X_nBeta = SpecPowered / denom
-        return X_nBeta
-
-    @timing
+        if self.beta == 0:
+            # X^0 = 1: the normalization of equation (2) is not defined for the Itakura-Saito divergence
+            raise ValueError("beta = 0 (Itakura-Saito) requires a spectrogram given with normalized=True")
+        with span("hpss.beta_normalize"):
+            SpecPowered = np.power(self.Spec, self.beta)
+            denom = np.sum(SpecPowered, dtype=np.float64)
+            denom = denom/(float(self.F*self.T))
+            denom = np.power(denom, 1.0/self.beta)
+            X_nBeta = np.ascontiguousarray(SpecPowered / denom, dtype=self.dtype)
+            return X_nBeta
+
+    def allocate_workspaces(self):
+        #   Allocates the matrices that are overwritten in every iteration, so that no FxT (or FxR/RxT) matrix is
+        #   allocated while updating the bases and activations
+        #
+        #   A, A1, A2               :   <FxT> common factors (see calc_common_factors)
+        #   num_XX, den_XX          :   numerator and denominator of the multiplicative update rule of factor XX
+        #   reg_XX                  :   scratch matrix for the regularization terms of factor XX
+        #
+        #   With fused_updates, the workspaces of the percussive and harmonic factors are views of the blocks
+        #   num_W, den_W, reg_W <Fx(Rp+Rh)> and num_H, den_H, reg_H <(Rp+Rh)xT>
+        self.A = np.empty([self.F, self.T], dtype=self.dtype)
+        self.A1 = np.empty([self.F, self.T], dtype=self.dtype)
+        self.A2 = np.empty([self.F, self.T], dtype=self.dtype)
+
+        self.workspaces = dict()
+        if self.fused_updates:
+            for term in ("num_", "den_", "reg_"):
+                W_block = np.empty_like(self.W)
+                H_block = np.empty_like(self.H)
+                self.workspaces[term+"W"] = W_block
+                self.workspaces[term+"H"] = H_block
+                self.workspaces[term+"W_P"] = W_block[:, :self.Rp]
+                self.workspaces[term+"W_H"] = W_block[:, self.Rp:]
+                self.workspaces[term+"H_P"] = H_block[:self.Rp, :]
+                self.workspaces[term+"H_H"] = H_block[self.Rp:, :]
+        else:
+            for factor in ("W_P", "H_P", "W_H", "H_H"):
+                shape = getattr(self, factor).shape
+                self.workspaces["num_"+factor] = np.empty(shape, dtype=self.dtype)
+                self.workspaces["den_"+factor] = np.empty(shape, dtype=self.dtype)
+                self.workspaces["reg_"+factor] = np.empty(shape, dtype=self.dtype)
+
     def update_bases_and_activations(self):
         #   This function updates the basis vectors W_P, H_P, W_H, and H_H for a single step of iteration
-
-        self.calc_common_factors()    # calculate commonly used matrices
-
-        next_W_P = np.multiply(self.W_P, (self.eq19()+self.K_SSM*self.eq21())/(self.eq20()+self.K_SSM*self.eq22()))
-        next_H_P = np.multiply(self.H_P, (self.eq23()+self.K_TSP*self.eq25())/(self.eq24()+self.K_TSP*self.eq26()))
-        next_W_H = np.multiply(self.W_H, (self.eq27()+self.K_SSP*self.eq29())/(self.eq28()+self.K_SSP*self.eq30()))
-        next_H_H = np.multiply(self.H_H, (self.eq31()+self.K_TSM*self.eq33())/(self.eq32()+self.K_TSM*self.eq34()))
-
-        self.W_P = next_W_P
-        self.H_P = next_H_P
-        self.W_H = next_W_H
-        self.H_H = next_H_H
-
-    @timing
-    def create_masks(self):
-        #   This function creates the masks M_P, M_H
-        self.X_P = self.W_P*self.H_P
-        self.X_H = self.W_H*self.H_H
-
-        self.M_P = np.power(self.X_P, 2)/(np.power(self.X_P, 2)+np.power(self.X_H, 2))  #Equation 15 in reference
-        self.M_H = np.power(self.X_H, 2)/(np.power(self.X_P, 2)+np.power(self.X_H, 2))  #Equation 16 in reference
-
-    @timing
-    def stft(self, audio=[]):
+        #   All the update terms are calculated from the current factors before updating the factors (in place)
+        #   With freeze_bases, only the activations H_P and H_H are updated
+        with span("hpss.update", iteration=self.n_iter):
+            self.calc_common_factors()    # calculate commonly used matrices
+
+            if self.n_iter % self.cost_interval == 0:
+                self.cost_history.append((self.n_iter, self.calc_cost()))   # cost of the factors before this update
+
+            if self.fused_updates:
+                self.calc_fused_products()  # eq19/eq27, eq20/eq28, eq23/eq31 and eq24/eq32 as four matrix products
+
+            if not self.freeze_bases:
+                self.calc_update_terms("W_P", self.eq19, self.eq21, self.eq20, self.eq22, self.K_SSM)
+            self.calc_update_terms("H_P", self.eq23, self.eq25, self.eq24, self.eq26, self.K_TSP)
+            if not self.freeze_bases:
+                self.calc_update_terms("W_H", self.eq27, self.eq29, self.eq28, self.eq30, self.K_SSP)
+            self.calc_update_terms("H_H", self.eq31, self.eq33, self.eq32, self.eq34, self.K_TSM)
+
+            for factor in self.updated_factors():
+                num = self.workspaces["num_"+factor]
+                np.divide(num, self.workspaces["den_"+factor], out=num)
+                np.multiply(getattr(self, factor), num, out=getattr(self, factor))
+
+    def updated_factors(self):
+        # Names of the factors updated in every iteration
+        if self.freeze_bases:
+            return "H_P", "H_H"
+        return "W_P", "H_P", "W_H", "H_H"
+
+    def calc_update_terms(self, factor, eq_num, eq_reg_num, eq_den, eq_reg_den, K):
+        #   Calculates the numerator and denominator of the update rule of a factor in its workspaces:
+        #       num_factor = eq_num + K * eq_reg_num
+        #       den_factor = eq_den + K * eq_reg_den
+        #   With fused_updates, eq_num and eq_den are already in the workspaces (see calc_fused_products)
+        with span("hpss.update_terms." + factor):
+            num = self.workspaces["num_"+factor]
+            den = self.workspaces["den_"+factor]
+            reg = self.workspaces["reg_"+factor]
+
+            if not self.fused_updates:
+                eq_num(out=num)
+            eq_reg_num(out=reg)
+            reg *= K
+            num += reg
+
+            if not self.fused_updates:
+                eq_den(out=den)
+            eq_reg_den(out=reg)
+            reg *= K
+            den += reg
+
+    def calc_fused_products(self):
+        #   Calculates the matrix products of the update rules of the stacked factors W = [W_P | W_H], H = [H_P; H_H]
+        #       num_W = A2 H^T = [eq19 | eq27]          den_W = A1 H^T = [eq20 | eq28]
+        #       num_H = W^T A2 = [eq23; eq31]           den_H = W^T A1 = [eq24; eq32]
+        #   (the products of the bases are skipped with freeze_bases)
+        with span("hpss.fused_products"):
+            if not self.freeze_bases:
+                np.dot(self.A2, self.H.T, out=self.workspaces["num_W"])
+                np.dot(self.A1, self.H.T, out=self.workspaces["den_W"])
+            np.dot(self.W.T, self.A2, out=self.workspaces["num_H"])
+            np.dot(self.W.T, self.A1, out=self.workspaces["den_H"])
+
+    def create_masks(self, power=None, binary=None):
+        #   This function creates the masks M_P, M_H (Equations 15 and 16 in reference for power = 2)
+        #   power, binary   :   exponent of the soft masks and binary masks flag (default = mask_power, binary_mask)
+        with span("hpss.masks"):
+            if power is None:
+                power = self.mask_power
+            if binary is None:
+                binary = self.binary_mask
+
+            self.X_P = np.dot(self.W_P, self.H_P)
+            self.X_H = np.dot(self.W_H, self.H_H)
+
+            self.M_P, self.M_H = masks_from_spectrograms(self.X_P, self.X_H, power=power, binary=binary)
+
+    def stft(self, audio=None):
         # This function takes the stft of an input signal
         # Messages to be output
-        if self.fftSizeIsSpecified == "False":
-            print("fft size is not specified for STFT calculation. Assumed frameSize is " + str(self.fftSize))
+        with span("hpss.stft"):
+            if self.fftSizeIsSpecified == "False":
+                print("fft size is not specified for STFT calculation. Assumed frameSize is " + str(self.fftSize))
 
-        if self.frameSizeIsSpecified == "False":
-            print("frameSize is not specified for STFT calculation. Assumed frameSize is " + str(self.frameSize))
+            if self.frameSizeIsSpecified == "False":
+                print("frameSize is not specified for STFT calculation. Assumed frameSize is " + str(self.frameSize))
 
-        if self.hopSizeIsSpecified == "False":
-            print("hopSize is not specified for STFT calculation. Assumed hopSize is " + str(self.hopSize))
+            if self.hopSizeIsSpecified == "False":
+                print("hopSize is not specified for STFT calculation. Assumed hopSize is " + str(self.hopSize))
 
-        if self.winTypeIsSpecified == "False":
-            print("Window type is not specified for STFT calculation. Assumed hopSize is " + str(self.winType))
+            if self.winTypeIsSpecified == "False":
+                print("Window type is not specified for STFT calculation. Assumed window type is " + str(self.winType))
 
-        # Take the stft using Librosa.core.stft
-        if audio == []:
-            _x = self.xOriginal     # if an array is not specified use xOriginal
-        else:
-            _x = audio              # otherwise, use the specified signal
+            # Take the stft using Librosa.core.stft
+            if audio is None:
+                _x = self.xOriginal     # if an array is not specified use xOriginal
+            else:
+                _x = audio              # otherwise, use the specified signal
 
-        _stft = stft(_x, n_fft=self.fftSize, hop_length=self.hopSize, win_length=self.frameSize, window=self.winType)
+            if self.stft_cache is not None:
+                # (read-only) spectrogram shared with the other users of the cache
+                _stft = self.stft_cache.stft(_x, fftSize=self.fftSize, frameSize=self.frameSize, hopSize=self.hopSize,
+                                             winType=self.winType)
+            else:
+                _stft = stft(_x, n_fft=self.fftSize, hop_length=self.hopSize, win_length=self.frameSize,
+                             window=self.winType)
 
-        return _stft
+            return _stft
 
-    @timing
-    def istft(self, _stft=[]):
+    def istft(self, _stft=None):
         # Take the stft using Librosa.core.stft
         # returns numpy array
-        if _stft == []:
+        if _stft is None:
             X = self.Xc            # if an array is not specified use Xc (stft of xOriginal)
         else:
             X = _stft              # otherwise, use the specified signal
@@ -283,77 +604,304 @@ class HPSS:
 
         return _x
 
-    @timing
     def spectral_to_temporal_using_masks(self, normalize=False):
-        self.x_p = self.istft(np.asarray(np.multiply(self.M_P, self.Xc)))
-        self.x_h = self.istft(np.asarray(np.multiply(self.M_H, self.Xc)))
-        if normalize:
-            gain = np.max([np.max(np.abs(self.x_p)), np.max(np.abs(self.x_h))])
-            self.x_p = self.x_p / gain
-            self.x_h = self.x_h / gain
-
-    @timing
+        # both masked spectrograms are converted to time domain in a single (batched) istft
+        with span("hpss.istft"):
+            masked = np.empty((2,) + self.Xc.shape, dtype=np.result_type(self.Xc, self.M_P))
+            np.multiply(self.M_P, self.Xc, out=masked[0])
+            np.multiply(self.M_H, self.Xc, out=masked[1])
+            self.x_p, self.x_h = batch_istft(masked, self.hopSize, self.frameSize, winType=self.winType,
+                                             length=self.length)
+            if normalize:
+                gain = np.max([np.max(np.abs(self.x_p)), np.max(np.abs(self.x_h))])
+                self.x_p = self.x_p / gain
+                self.x_h = self.x_h / gain
+
     def separate(self):
         # Separates harmonic / percussive signals by iteration - Steps 3 to 10 in Algorithm 1 detailed in reference
-        for i in range(int(self.maxIter)):
-            print("Iteration %i out of %i" % (i+1, self.maxIter))
-            self.next_iteration()
-
-        self.create_masks()
-        self.spectral_to_temporal_using_masks()
+        with span("hpss.separate", F=self.F, T=self.T, Rp=self.Rp, Rh=self.Rh):
+            with self.blas_thread_limit():
+                initial_iterations = 0
+                if self.coarseIter > 0:
+                    self.coarse_initialize()
+                    initial_iterations = self.coarseIter
+                elif self.n_restarts > 1:
+                    self.select_best_restart()
+                    initial_iterations = self.restartIter
+                for i in range(int(self.maxIter) - initial_iterations):
+                    print("Iteration %i out of %i" % (i+1+initial_iterations, self.maxIter))
+                    self.next_iteration()
+                    if self.iteration_callback is not None:
+                        self.iteration_callback(self, i+1+initial_iterations)
+                    if self.converged:
+                        print("Converged after %i iterations (cost = %f)" % (self.n_iter, self.cost_history[-1][1]))
+                        break
+
+            self.create_masks()
+            self.spectral_to_temporal_using_masks()
+
+    def resynthesize(self, power=None, binary=None, normalize=False):
+        # Re-creates the masks and the separated signals from the current factors (without iterating)
+        #   power, binary   :   exponent of the soft masks and binary masks flag (default = mask_power, binary_mask)
+        self.create_masks(power=power, binary=binary)
+        self.spectral_to_temporal_using_masks(normalize=normalize)
+        return self.x_p, self.x_h
+
+    def coarse_initialize(self):
+        # Coarse to fine initialization: the first coarseIter iterations are done on a spectrogram with coarseFreq
+        # times fewer bins and coarseTime times fewer frames, using a fraction (coarseComponents) of the components.
+        # The coarse factors are then upsampled (repeated) to initialize the factors of the full resolution
+        #
+        # With initial bases (W_P/W_H, bases_file or freeze_bases), the coarse decomposition uses all the components
+        # and starts from the downsampled initial bases (kept fixed if both are given). The initial bases of the full
+        # resolution are left unchanged: only the coarse activations (and the coarse bases that were not given) are
+        # upsampled
+        with span("hpss.coarse_initialize"):
+            initial_bases = (self.W_P_init, self.W_H_init)
+            given_bases = any(W_init is not None for W_init in initial_bases)
+
+            spectrogram = self.downsample(self.downsample(self.Spec, self.coarseFreq, axis=0), self.coarseTime, axis=1)
+            options = self.factorization_options()
+            options.update(maxIter=self.coarseIter, seed=self.random.randint(2**31 - 1))
+            if given_bases:
+                W_P, W_H = [None if W_init is None else self.downsample(np.asarray(W_init), self.coarseFreq, axis=0)
+                            for W_init in initial_bases]
+                options.update(W_P=W_P, W_H=W_H, freeze_bases=all(W_init is not None for W_init in initial_bases))
+            else:
+                options.update(Rp=max(int(round(self.Rp * self.coarseComponents)), 1),
+                               Rh=max(int(round(self.Rh * self.coarseComponents)), 1))
+            coarse = HPSS.from_spectrogram(spectrogram, **options)
+
+            for i in range(self.coarseIter):
+                print("Coarse iteration %i out of %i" % (i+1, self.coarseIter))
+                coarse.next_iteration()
+                if coarse.converged:
+                    break
+            self.coarse_cost_history = coarse.cost_history
+
+            if given_bases:
+                self.H[:] = np.repeat(coarse.H, self.coarseTime, axis=1)[:, :self.T]
+                for W, W_coarse, W_init in ((self.W_P, coarse.W_P, self.W_P_init),
+                                            (self.W_H, coarse.W_H, self.W_H_init)):
+                    if W_init is None:
+                        W[:] = np.repeat(W_coarse, self.coarseFreq, axis=0)[:self.F]
+            else:
+                # the coarse components are repeated (and slightly perturbed, so that repeated components can diverge)
+                # to obtain Rp and Rh components. The activations are divided by the number of repetitions to keep
+                # W H unchanged
+                for W, H, W_coarse, H_coarse in ((self.W_P, self.H_P, coarse.W_P, coarse.H_P),
+                                                 (self.W_H, self.H_H, coarse.W_H, coarse.H_H)):
+                    components = np.arange(W.shape[1]) % W_coarse.shape[1]
+                    repetitions = np.bincount(components)[components]
+                    W[:] = np.repeat(W_coarse, self.coarseFreq, axis=0)[:self.F, components]
+                    H[:] = np.repeat(H_coarse, self.coarseTime, axis=1)[components, :self.T] / \
+                        repetitions[:, np.newaxis]
+                    W *= .9 + .2 * self.random.rand(*W.shape)
+                    H *= .9 + .2 * self.random.rand(*H.shape)
+
+            # the coarse spectrogram is normalized (beta_normalize) with a slightly different scale: the activations are
+            # rescaled so that sum(W H) = sum(X_nBeta)
+            approximation_sum = np.dot(self.W.sum(axis=0), self.H.sum(axis=1))
+            self.H *= np.sum(self.X_nBeta, dtype=np.float64) / approximation_sum
+
+    def factorization_options(self):
+        # Options of the decomposition (cost, update rules and initial/frozen bases), used for creating the
+        # coarse/restart separators (their activations are initialized randomly)
+        options = dict(beta=self.beta, Rp=self.Rp, Rh=self.Rh, tol=self.tol, cost_interval=self.cost_interval,
+                       K_SSM=self.K_SSM, K_SSP=self.K_SSP, K_TSM=self.K_TSM, K_TSP=self.K_TSP,
+                       regularizer_backend=self.regularizer_backend, fused_updates=self.fused_updates, dtype=self.dtype)
+        options.update(W_P=self.W_P_init, W_H=self.W_H_init, freeze_bases=self.freeze_bases)
+        return options
+
+    def select_best_restart(self):
+        # Runs restartIter iterations from n_restarts random initializations in parallel worker processes and keeps
+        # the factors with the lowest cost (the workers share X_nBeta with this process, see restart_worker)
+        # With initial bases, all the restarts start from these bases (only the activations are random)
+        with span("hpss.restarts", n_restarts=self.n_restarts):
+            seeds = [int(seed) for seed in self.random.randint(2**31 - 1, size=self.n_restarts)]
+            n_workers = self.restart_workers or min(self.n_restarts, multiprocessing.cpu_count())
+            n_workers = min(n_workers, self.n_restarts)
+            blas_threads = self.blas_threads or max(multiprocessing.cpu_count() // n_workers, 1)
+
+            shared = multiprocessing.RawArray("f" if self.dtype == np.float32 else "d", self.X_nBeta.size)
+            X_nBeta = np.frombuffer(shared, dtype=self.dtype).reshape(self.X_nBeta.shape)
+            X_nBeta[:] = self.X_nBeta
+            self.X_nBeta = X_nBeta                  # the separator also uses the shared copy (no duplicate in memory)
+
+            options = self.factorization_options()
+            options.update(maxIter=self.restartIter, tol=0.0)
+
+            print("Trying %i initializations (%i iterations each) in %i processes" % (self.n_restarts, self.restartIter,
+                                                                                     n_workers))
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(n_workers, initializer=init_restart_worker,
+                              initargs=(shared, self.X_nBeta.shape, blas_threads)) as pool:
+                results = pool.map(restart_worker, [(seed, options) for seed in seeds])
+
+            self.restart_costs = [cost for cost, W, H in results]
+            best = int(np.argmin(self.restart_costs))
+            print("Restart costs: %s, continuing with initialization %i" %
+                  (", ".join("%.4g" % cost for cost in self.restart_costs), best+1))
+            self.W[:] = results[best][1]
+            self.H[:] = results[best][2]
+            self.n_iter = self.restartIter
+
+    @staticmethod
+    def downsample(M, factor, axis):
+        # Averages groups of factor consecutive rows (axis = 0) or columns (axis = 1) of M (the last group may be
+        # smaller)
+        if factor == 1:
+            return M
+        starts = np.arange(0, M.shape[axis], factor)
+        sizes = np.diff(np.append(starts, M.shape[axis]))
+        sums = np.add.reduceat(M, starts, axis=axis)
+        return sums / (sizes[:, np.newaxis] if axis == 0 else sizes[np.newaxis, :])
 
     def next_iteration(self):
+        n_costs = len(self.cost_history)
         self.update_bases_and_activations()
+        self.n_iter += 1
+
+        # check convergence whenever a new cost is evaluated
+        if self.tol > 0 and n_costs > 0 and len(self.cost_history) > n_costs:
+            previous_cost = self.cost_history[-2][1]
+            current_cost = self.cost_history[-1][1]
+            self.converged = 0 <= (previous_cost - current_cost) < self.tol * abs(previous_cost)
+
+    def calc_cost(self):
+        # Cost function minimized by the update rules: beta divergence between X_nBeta and W_P H_P + W_H H_H plus the
+        # weighted smoothness/sparseness terms (see [1])
+        # Uses A and A1, so it should be called right after calc_common_factors
+        with span("hpss.cost"):
+            cost = self.beta_divergence()
+            cost += self.K_SSM * self.smoothness(self.W_P, axis=0)     # Percussive spectral smoothness
+            cost += self.K_TSP * self.sparseness(self.H_P, axis=1)     # Percussive temporal sparseness
+            cost += self.K_SSP * self.sparseness(self.W_H, axis=0)     # Harmonic spectral sparseness
+            cost += self.K_TSM * self.smoothness(self.H_H, axis=1)     # Harmonic temporal smoothness
+            return float(cost)
+
+    def beta_divergence(self):
+        # Beta divergence between X_nBeta and A (= W_P H_P + W_H H_H), calculated from A and A1 (= A^(beta-1))
+        if self.beta == 1:      # Kullback-Leibler
+            X = self.X_nBeta
+            return np.sum(X * np.log((X + self.eps) / self.A) - X + self.A)
+
+        if self.beta == 0:      # Itakura-Saito
+            ratio = (self.X_nBeta + self.eps) / self.A
+            return np.sum(ratio - np.log(ratio) - 1)
+
+        if self.X_nBeta_powered_sum is None:
+            self.X_nBeta_powered_sum = np.sum(np.power(self.X_nBeta, self.beta))
+        # sum(X^beta + (beta-1) A^beta - beta X A^(beta-1)) / (beta (beta-1)), with A^beta = A * A1
+        return (self.X_nBeta_powered_sum + (self.beta-1)*np.vdot(self.A, self.A1) -
+                self.beta*np.vdot(self.X_nBeta, self.A1)) / (self.beta*(self.beta-1))
+
+    @staticmethod
+    def smoothness(M, axis):
+        # Smoothness cost of the components (columns if axis = 0, rows if axis = 1) of M
+        #   N * sum((M[n]-M[n-1])^2) / sum(M[n]^2), summed over the components (N: length of the components)
+        N = M.shape[axis]
+        return N * np.sum(np.sum(np.square(np.diff(M, axis=axis)), axis=axis) / np.sum(np.square(M), axis=axis))
+
+    @staticmethod
+    def sparseness(M, axis):
+        # Sparseness cost of the components (columns if axis = 0, rows if axis = 1) of M
+        #   sqrt(N) * sum(M[n]) / sqrt(sum(M[n]^2)), summed over the components (N: length of the components)
+        N = M.shape[axis]
+        return N**.5 * np.sum(np.sum(M, axis=axis) / np.sum(np.square(M), axis=axis)**.5)
+
+    @contextmanager
+    def blas_thread_limit(self):
+        # Limits the number of BLAS threads to self.blas_threads within the context
+        # (use as "with hpss.blas_thread_limit():" when calling next_iteration() directly)
+        if self.blas_threads is None:
+            yield
+        elif threadpool_limits is None:
+            print("threadpoolctl is not installed. Using the default number of BLAS threads")
+            yield
+        else:
+            with threadpool_limits(limits=self.blas_threads, user_api="blas"):
+                yield
 
 
-    @timing
     def save_separated_audiofiles(self):
         # check and see if directory exists
-        if self.directory != "" and ("/" in self.directory):
-            directoryLevels = self.directory.split("/")
-            for ixLevel, directoryLevel in enumerate(directoryLevels):
-                if ixLevel == 0:
-                    LevelPath = directoryLevel
-                else:
-                    LevelPath += "/" + directoryLevel
-                if not os.path.isdir(LevelPath):
-                    os.mkdir(LevelPath)
-
-        # Create audio writer object
-        if self.fsIsSpecified == "False":   # Notify user if sampling rate not specified
-            print("Sample Rate not specified for writing the audio files. Assumed Fs (Hz) is " + str(self.fs))
-
-        if self.formatIsSpecified == "False":   # Notify user if format not specified
-            print("File format not specified for writing the audio files. Assumed format is " + str(self.format))
-
-        MonoWriter = es.MonoWriter(sampleRate=self.fs, format=self.format)
-        MonoWriter.configure(filename=self.directory+self.filename+"_percussive."+self.format)
-        MonoWriter(array(self.x_p))
-
-        MonoWriter = es.MonoWriter(sampleRate=self.fs, format=self.format)
-        MonoWriter.configure(filename=self.directory + self.filename + "_harmonic." + self.format)
-        MonoWriter(array(self.x_h))
+        with span("hpss.save_audio"):
+            if self.directory != "" and ("/" in self.directory):
+                directoryLevels = self.directory.split("/")
+                for ixLevel, directoryLevel in enumerate(directoryLevels):
+                    if ixLevel == 0:
+                        LevelPath = directoryLevel
+                    else:
+                        LevelPath += "/" + directoryLevel
+                    if not os.path.isdir(LevelPath):
+                        os.mkdir(LevelPath)
+
+            # Create audio writer object
+            if self.fsIsSpecified == "False":   # Notify user if sampling rate not specified
+                print("Sample Rate not specified for writing the audio files. Assumed Fs (Hz) is " + str(self.fs))
+
+            if self.formatIsSpecified == "False":   # Notify user if format not specified
+                print("File format not specified for writing the audio files. Assumed format is " + str(self.format))
+
+            MonoWriter = es.MonoWriter(sampleRate=self.fs, format=self.format)
+            MonoWriter.configure(filename=self.directory+self.filename+"_percussive."+self.format)
+            MonoWriter(array(self.x_p))
+
+            MonoWriter = es.MonoWriter(sampleRate=self.fs, format=self.format)
+            MonoWriter.configure(filename=self.directory + self.filename + "_harmonic." + self.format)
+            MonoWriter(array(self.x_h))
+
+            if self.artifacts:
+                self.save_artifacts()
+
+    def save_artifacts(self, directory=None):
+        # Saves the masks, spectrograms, factors and complex spectrogram of the separation as memory mappable .npy
+        # files (see SeparationArtifacts.py), by default in <directory><filename>_artifacts/
+        # Should be called after create_masks
+        # (separators created from a spectrogram have no complex spectrogram: Xc is not saved and length is None)
+        with span("hpss.save_artifacts"):
+            if directory is None:
+                directory = self.directory + self.filename + "_artifacts"
+
+            arrays = {"M_P": self.M_P, "M_H": self.M_H, "X_P": self.X_P, "X_H": self.X_H,
+                      "W_P": self.W_P, "H_P": self.H_P, "W_H": self.W_H, "H_H": self.H_H}
+            if self.Xc is not None:
+                arrays["Xc"] = self.Xc
+            save_artifacts(directory, arrays, fs=float(self.fs), fftSize=self.fftSize, frameSize=self.frameSize,
+                           hopSize=self.hopSize, winType=self.winType, beta=self.beta, Rp=self.Rp, Rh=self.Rh,
+                           K_SSM=self.K_SSM, K_SSP=self.K_SSP, K_TSM=self.K_TSM, K_TSP=self.K_TSP,
+                           n_iter=self.n_iter, cost_history=self.cost_history, length=self.length)
+            return directory
 
     #   Functions to calculate EqXX in appendix section of reference (EqXX refers to Equation XX in appendix)
-    @timing
     def calc_common_factors(self):
         # Calculates and stores the matrix operations repeatedly used in the following equations
-        # Stores the results in self.A, self.A1 and self.A2
-        self.A = self.W_P*self.H_P+self.W_H*self.H_H+np.finfo(float).eps
-        self.A1 = np.power(self.A, self.beta-1)
-        self.A2 = np.multiply(np.power(self.A, self.beta-2), self.X_nBeta)
-
-    @timing
-    def eq19(self):
-        Eq19 = self.A2 * self.H_P.transpose()
-        return Eq19
-
-    @timing
-    def eq20(self):
-        return self.A1 * self.H_P.transpose()
-
-    @timing
-    def eq21(self):
+        # Stores the results (in place) in self.A, self.A1 and self.A2
+        with span("hpss.common_factors"):
+            if self.fused_updates:
+                np.dot(self.W, self.H, out=self.A)
+            else:
+                np.dot(self.W_P, self.H_P, out=self.A)
+                np.dot(self.W_H, self.H_H, out=self.A1)     # A1 is used as scratch before being calculated
+                self.A += self.A1
+            self.A += self.eps
+            np.power(self.A, self.beta-1, out=self.A1)
+            np.power(self.A, self.beta-2, out=self.A2)
+            self.A2 *= self.X_nBeta
+
+    def eq19(self, out=None):
+        return np.dot(self.A2, self.H_P.T, out=out)
+
+    def eq20(self, out=None):
+        return np.dot(self.A1, self.H_P.T, out=out)
+
+    def eq21(self, out=None):
+        if self.regularizer_backend == "loop":
+            return self.store(self.eq21_loop(), out)
+        return self.eq21_vectorized(out=out)
+
+    def eq21_loop(self):
         Eq21 = np.zeros_like(self.W_P)
         for rp in range(self.Rp):
             termA = np.sum(np.power(self.W_P[1:, rp]-self.W_P[:-1, rp], 2))
@@ -361,8 +909,8 @@ class HPSS:
             termC = termB**2
             termA_divBy_C = termA / termC
 
-            W_P_minus1 = np.append(np.array([[self.W_P[0, rp]]]), self.W_P[:-1, rp], axis=0)
-            W_P_plus1 = np.append(self.W_P[1:, rp], np.array([[self.W_P[-1, rp]]]), axis=0)
+            W_P_minus1 = np.append(self.W_P[0, rp], self.W_P[:-1, rp])
+            W_P_plus1 = np.append(self.W_P[1:, rp], self.W_P[-1, rp])
 
             term1 = 2 * self.F / termB * (W_P_minus1+W_P_plus1)
             term2 = 2 * self.F * self.W_P[:, rp] * termA_divBy_C
@@ -384,24 +932,29 @@ class HPSS:
             '''
         return Eq21
 
-    @timing
-    def eq22(self):
-        Eq22 = np.matrix(np.zeros_like(self.W_P))
+    def eq22(self, out=None):
+        if self.regularizer_backend == "loop":
+            return self.store(self.eq22_loop(), out)
+        return self.eq22_vectorized(out=out)
+
+    def eq22_loop(self):
+        Eq22 = np.zeros_like(self.W_P)
         for rp in range(self.Rp):
             Eq22[:, rp] = 4*self.F*self.W_P[:, rp]/np.sum(np.power(self.W_P[:, rp], 2))
         return Eq22
 
-    @timing
-    def eq23(self):
-        Eq23 = self.W_P.transpose() * self.A2
-        return Eq23
+    def eq23(self, out=None):
+        return np.dot(self.W_P.T, self.A2, out=out)
 
-    @timing
-    def eq24(self):
-        return self.W_P.transpose() * self.A1
+    def eq24(self, out=None):
+        return np.dot(self.W_P.T, self.A1, out=out)
 
-    @timing
-    def eq25(self):
+    def eq25(self, out=None):
+        if self.regularizer_backend == "loop":
+            return self.store(self.eq25_loop(), out)
+        return self.eq25_vectorized(out=out)
+
+    def eq25_loop(self):
         Eq25 = np.zeros_like(self.H_P)
         for rp in range(self.Rp):
             sum1 = np.sum(self.H_P[rp, :])
@@ -415,8 +968,12 @@ class HPSS:
             '''
         return Eq25
 
-    @timing
-    def eq26(self):
+    def eq26(self, out=None):
+        if self.regularizer_backend == "loop":
+            return self.store(self.eq26_loop(), out)
+        return self.eq26_vectorized(out=out)
+
+    def eq26_loop(self):
         Eq26 = np.zeros_like(self.H_P)
         for rp in range(self.Rp):
             sum1 = np.sum(np.power(self.H_P[rp, :], 2))/np.float(self.T)
@@ -428,18 +985,18 @@ class HPSS:
             '''
         return Eq26
 
-    @timing
-    def eq27(self):
-        Eq27 = self.A2 * (self.H_H.transpose())
-        return Eq27
+    def eq27(self, out=None):
+        return np.dot(self.A2, self.H_H.T, out=out)
 
-    @timing
-    def eq28(self):
-        Eq28 = self.A1 * self.H_H.transpose()
-        return Eq28
+    def eq28(self, out=None):
+        return np.dot(self.A1, self.H_H.T, out=out)
 
-    @timing
-    def eq29(self):
+    def eq29(self, out=None):
+        if self.regularizer_backend == "loop":
+            return self.store(self.eq29_loop(), out)
+        return self.eq29_vectorized(out=out)
+
+    def eq29_loop(self):
         Eq29 = np.zeros_like(self.W_H)
         for rh in range(self.Rh):
             sum1 = np.sum(self.W_H[:, rh])
@@ -452,8 +1009,12 @@ class HPSS:
             '''
         return Eq29
 
-    @timing
-    def eq30(self):
+    def eq30(self, out=None):
+        if self.regularizer_backend == "loop":
+            return self.store(self.eq30_loop(), out)
+        return self.eq30_vectorized(out=out)
+
+    def eq30_loop(self):
         Eq30 = np.zeros_like(self.W_H)
         for rh in range(self.Rh):
             sum1 = (np.sum(np.power(self.W_H[:, rh], 2))/np.float(self.F)) ** 0.5
@@ -466,24 +1027,25 @@ class HPSS:
             '''
         return Eq30
 
-    @timing
-    def eq31(self):
-        Eq31 = (self.W_H.transpose()) * self.A2
-        return Eq31
+    def eq31(self, out=None):
+        return np.dot(self.W_H.T, self.A2, out=out)
 
-    @timing
-    def eq32(self):
-        return self.W_H.transpose() * self.A1
+    def eq32(self, out=None):
+        return np.dot(self.W_H.T, self.A1, out=out)
 
-    @timing
-    def eq33(self):
+    def eq33(self, out=None):
+        if self.regularizer_backend == "loop":
+            return self.store(self.eq33_loop(), out)
+        return self.eq33_vectorized(out=out)
+
+    def eq33_loop(self):
         Eq33 = np.zeros_like(self.H_H)
         for rh in range(self.Rh):
             sum1 = np.sum(np.power(self.H_H[rh, :], 2))
             sum2 = np.sum(np.power(self.H_H[rh, 1:]-self.H_H[rh, :-1], 2))
 
-            H_H_minus1 = np.append(np.array([[self.H_H[rh, 0]]]), self.H_H[rh, :-1])
-            H_H_plus1 = np.append(self.H_H[rh, 1:], np.array([[self.H_H[rh, -1]]]), axis=1)
+            H_H_minus1 = np.append(self.H_H[rh, 0], self.H_H[rh, :-1])
+            H_H_plus1 = np.append(self.H_H[rh, 1:], self.H_H[rh, -1])
 
             Eq33[rh, :] = 2 * self.T * ((H_H_minus1+H_H_plus1) / sum1) + \
                           (2 * self.T * self.H_H[rh, :] * sum2) / sum1 ** 2
@@ -504,8 +1066,12 @@ class HPSS:
             '''
         return Eq33
 
-    @timing
-    def eq34(self):
+    def eq34(self, out=None):
+        if self.regularizer_backend == "loop":
+            return self.store(self.eq34_loop(), out)
+        return self.eq34_vectorized(out=out)
+
+    def eq34_loop(self):
         Eq34 = np.zeros_like(self.H_H)
         for rh in range(self.Rh):
             sum1 = np.sum(np.power(self.H_H[rh, :], 2))
@@ -517,6 +1083,262 @@ class HPSS:
             '''
         return Eq34
 
+    #   Vectorized versions of the regularization terms above (regularizer_backend = "vectorized")
+    #   Each term is computed for all the components at once using column (W) or row (H) reductions, and the
+    #   neighbouring values (f-1, f+1 or t-1, t+1) are read through shifted views of the factor matrices
+    #   If out is provided, the result is written to out (no FxR or RxT matrix is allocated)
+    def eq21_vectorized(self, out=None):
+        W = self.W_P
+        out = np.empty_like(W) if out is None else out
+        np.subtract(W[1:, :], W[:-1, :], out=out[:-1, :])                  # out is used as scratch
+        termA = np.einsum("fr,fr->r", out[:-1, :], out[:-1, :])             # spectral smoothness     <Rp>
+        termB = np.einsum("fr,fr->r", W, W)                                 # energy of components    <Rp>
+        np.multiply(W, termA / termB, out=out)
+        self.add_shifted_neighbours(W, out, axis=0)
+        out *= 2 * self.F / termB
+        return out
+
+    def eq22_vectorized(self, out=None):
+        W = self.W_P
+        return np.multiply(W, 4 * self.F / np.einsum("fr,fr->r", W, W), out=out)
+
+    def eq25_vectorized(self, out=None):
+        H = self.H_P
+        sum1 = np.sum(H, axis=1, keepdims=True)
+        sum2 = np.einsum("rt,rt->r", H, H)[:, np.newaxis]
+        return np.multiply(H, self.T**.5 * sum1 / sum2**1.5, out=out)
+
+    def eq26_vectorized(self, out=None):
+        H = self.H_P
+        sum1 = np.einsum("rt,rt->r", H, H)[:, np.newaxis] / float(self.T)
+        return self.store(1.0 / sum1**.5, out, H.shape)
+
+    def eq29_vectorized(self, out=None):
+        W = self.W_H
+        sum1 = np.sum(W, axis=0)
+        sum2 = np.einsum("fr,fr->r", W, W)**1.5
+        return np.multiply(W, self.F**.5 * sum1 / sum2, out=out)
+
+    def eq30_vectorized(self, out=None):
+        W = self.W_H
+        sum1 = (np.einsum("fr,fr->r", W, W) / float(self.F))**.5
+        return self.store(1.0 / sum1, out, W.shape)
+
+    def eq33_vectorized(self, out=None):
+        H = self.H_H
+        out = np.empty_like(H) if out is None else out
+        np.subtract(H[:, 1:], H[:, :-1], out=out[:, :-1])                  # out is used as scratch
+        sum2 = np.einsum("rt,rt->r", out[:, :-1], out[:, :-1])[:, np.newaxis]   # temporal smoothness  <Rhx1>
+        sum1 = np.einsum("rt,rt->r", H, H)[:, np.newaxis]                   # energy of components       <Rhx1>
+        np.multiply(H, sum2 / sum1, out=out)
+        self.add_shifted_neighbours(H, out, axis=1)
+        out *= 2 * self.T / sum1
+        return out
+
+    def eq34_vectorized(self, out=None):
+        H = self.H_H
+        return np.multiply(H, 4.0 * self.T / np.einsum("rt,rt->r", H, H)[:, np.newaxis], out=out)
+
+    @staticmethod
+    def add_shifted_neighbours(M, out, axis):
+        # Adds M[i-1]+M[i+1] along the given axis (0: rows, 1: columns) to out, repeating the edge values at the
+        # borders (i.e. M[-1] is replaced by M[0] and M[N] is replaced by M[N-1], as in the loop versions of eq21 and
+        # eq33)
+        if axis == 1:
+            M = M.T
+            out = out.T
+        out[1:] += M[:-1]
+        out[0] += M[0]
+        out[:-1] += M[1:]
+        out[-1] += M[-1]
+        return out
+
+    @staticmethod
+    def store(values, out=None, shape=None):
+        # Writes values (broadcast to shape, if given) to out and returns out
+        # If out is not provided, values is returned as a new array
+        if out is None:
+            shape = np.shape(values) if shape is None else shape
+            out = np.empty(shape, dtype=np.result_type(values))
+        out[...] = values
+        return out
+
+# ------------------------------------------------------------------------------------------------------#
+
+
+# ------------------------------------- Restart workers (see HPSS.select_best_restart) -----------------#
+# Functions run in the worker processes, the normalized spectrogram is shared (not copied) between the processes
+
+restart_spectrogram = None                              # X_nBeta shared with the parent process
+
+
+def init_restart_worker(shared, shape, blas_threads):
+    global restart_spectrogram
+    dtype = np.float32 if shared._type_._type_ == "f" else np.float64
+    restart_spectrogram = np.frombuffer(shared, dtype=dtype).reshape(shape)
+    if threadpool_limits is not None:
+        threadpool_limits(limits=blas_threads, user_api="blas")
+
+
+def restart_worker(job):
+    # Iterates from a random initialization (of the activations only, if options has initial bases), returns the
+    # cost and the factors W and H after the iterations
+    seed, options = job
+    hpss = HPSS.from_spectrogram(restart_spectrogram, normalized=True, seed=seed, **options)
+    for i in range(int(hpss.maxIter)):
+        hpss.next_iteration()
+    hpss.calc_common_factors()
+    return hpss.calc_cost(), hpss.W, hpss.H
+# ------------------------------------------------------------------------------------------------------#
+
+
+# ------------------------------------- Class definition: Block Separator ------------------------------#
+
+class BlockHPSS:
+
+    # Block-wise version of HPSS for long recordings (exp: full DJ mixes)
+    #
+    # The signal is split into overlapping segments that are separated one after the other by HPSS. The bases learnt
+    # on a segment are used as the initial bases of the next segment (warm start), and the separated signals of
+    # consecutive segments are cross-faded (complementary linear ramps) in the overlapping regions.
+    # Only one segment is decomposed at a time, so the memory used by the spectrograms, factors and masks depends
+    # on the block length, not on the length of the track.
+
+    def __init__(self, x, **options):
+        #
+        #   x (1-D Array )      :   Time-domain mono audio signal (can be a memory mapped array)
+        #
+        #   Options:
+        #       blockSize (int)     :   number of samples in each segment (default = 30 * fs)
+        #       overlapSize (int)   :   number of samples shared by consecutive segments (default = 2 * fs)
+        #       warmStart (bool)    :   if True, the bases of each segment are initialized with the bases learnt on
+        #                               the previous segment (default = True)
+        #
+        #       All the other options are passed to the HPSS separator of each segment (see HPSS)
+
+        self.xOriginal = x                      # Original time series signal
+
+        self.fs = 44100                         # Sample rate of x (also used for saving the separated files)
+        if "fs" in options:
+            self.fs = int(options.get("fs"))
+
+        self.blockSize = 30 * self.fs           # Number of samples in each segment
+        self.overlapSize = 2 * self.fs          # Number of samples shared by consecutive segments
+        self.warmStart = True                   # Initialize the bases of each segment with the previous bases
+
+        self.options = dict()                   # Options passed to the separator of each segment
+
+        for option in options:
+
+            if option == "blockSize":
+                self.blockSize = int(options.get(option))
+
+            elif option == "overlapSize":
+                self.overlapSize = int(options.get(option))
+
+            elif option == "warmStart":
+                self.warmStart = bool(options.get(option))
+
+            else:
+                self.options[option] = options.get(option)
+
+        if not 0 <= self.overlapSize < self.blockSize:
+            raise ValueError("overlapSize should be smaller than blockSize, got overlapSize = %i and blockSize = %i"
+                             % (self.overlapSize, self.blockSize))
+
+        self.W_P = None                                 # Percussive bases learnt on the last separated segment
+        self.W_H = None                                 # Harmonic bases learnt on the last separated segment
+
+        self.x_p = []                                   # Percussive signal time domain (numpy array)
+        self.x_h = []                                   # Harmonic signal time domain   (numpy array)
+
+    def segment_starts(self):
+        # Returns the first sample of each segment
+        step = self.blockSize - self.overlapSize
+        n_segments = 1 + max(int(np.ceil((len(self.xOriginal) - self.blockSize) / float(step))), 0)
+        return [i * step for i in range(n_segments)]
+
+    def separate_segment(self, segment):
+        # Separates a segment with HPSS and returns its percussive and harmonic signals (of the same length as segment)
+        with span("block_hpss.segment", length=len(segment)):
+            options = dict(self.options)
+            options.setdefault("stft_cache", None)      # segments are only transformed once, do not fill the cache
+            if self.warmStart and self.W_P is not None:
+                options["W_P"] = self.W_P
+                options["W_H"] = self.W_H
+
+            hpss = HPSS(segment, **options)
+            hpss.separate()
+
+            self.W_P = hpss.W_P.copy()
+            self.W_H = hpss.W_H.copy()
+
+            return self.fit_length(hpss.x_p, len(segment)), self.fit_length(hpss.x_h, len(segment))
+
+    def separated_blocks(self):
+        # Generator separating the segments one after the other
+        # yields (first sample, percussive block, harmonic block) for consecutive non-overlapping blocks of the
+        # separated signals, i.e. the blocks can be written to a file (or played) as soon as they are yielded
+        starts = self.segment_starts()
+        fade_in = np.linspace(0, 1, self.overlapSize + 2)[1:-1]     # complementary ramps (fade_in + fade_out = 1)
+        fade_out = 1 - fade_in
+        tail_p = tail_h = None                                      # overlapping tail of the previous segment
+
+        for ix, start in enumerate(starts):
+            print("Separating segment %i out of %i" % (ix+1, len(starts)))
+            x_p, x_h = self.separate_segment(self.xOriginal[start:start+self.blockSize])
+
+            if tail_p is not None:
+                overlap = len(tail_p)
+                x_p[:overlap] = tail_p * fade_out[:overlap] + x_p[:overlap] * fade_in[:overlap]
+                x_h[:overlap] = tail_h * fade_out[:overlap] + x_h[:overlap] * fade_in[:overlap]
+
+            if ix == len(starts) - 1:
+                yield start, x_p, x_h
+            else:
+                tail_p = x_p[-self.overlapSize:] if self.overlapSize > 0 else None
+                tail_h = x_h[-self.overlapSize:] if self.overlapSize > 0 else None
+                yield start, x_p[:len(x_p)-self.overlapSize], x_h[:len(x_h)-self.overlapSize]
+
+    def separate(self):
+        # Separates the whole signal block by block and stores the results in x_p and x_h
+        self.x_p = np.zeros(len(self.xOriginal), dtype=np.float32)
+        self.x_h = np.zeros(len(self.xOriginal), dtype=np.float32)
+        for start, x_p, x_h in self.separated_blocks():
+            self.x_p[start:start+len(x_p)] = x_p
+            self.x_h[start:start+len(x_h)] = x_h
+
+    def save_bases(self, filename):
+        # Saves the bases learnt on the last separated segment (see HPSS.save_bases)
+        save_bases(filename, self.W_P, self.W_H, **{key: self.options[key] for key in
+                                                    ("fftSize", "frameSize", "hopSize", "beta") if key in self.options})
+
+    @staticmethod
+    def fit_length(x, length):
+        # Truncates or zero pads x to the given length (istft may return a few samples less than the segment)
+        if len(x) >= length:
+            return np.array(x[:length])
+        return np.concatenate([x, np.zeros(length - len(x), dtype=np.result_type(x))])
+
+    def save_separated_audiofiles(self):
+        with span("block_hpss.save_audio"):
+            directory = str(self.options.get("directory", ""))
+            if directory != "" and directory[-1] != "/":
+                directory += "/"
+            if directory != "" and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            filename = str(self.options.get("filename", ""))
+            format = str(self.options.get("format", "wav"))
+
+            MonoWriter = es.MonoWriter(sampleRate=self.fs, format=format)
+            MonoWriter.configure(filename=directory+filename+"_percussive."+format)
+            MonoWriter(array(self.x_p))
+
+            MonoWriter = es.MonoWriter(sampleRate=self.fs, format=format)
+            MonoWriter.configure(filename=directory+filename+"_harmonic."+format)
+            MonoWriter(array(self.x_h))
+
 '''
 filename = "data/tracks/Mr.FingersMysteryofLove.mp3"
 
@@ -0,0 +1,193 @@
+#   Import Libraries
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+# --------------------------------------- Instrumentation ----------------------------------------------#
+# Spans measuring the latency of the stages of the separators, transcribers and gui actions
+#
+# exp:
+#       from Instrumentation import span
+#       with span("hpss.iteration", iteration=i):
+#           ...
+#
+#       @timed("drum_transcriber.get_onsets")           # span around each call of a function
+#       def get_onsets(self, ...):
+#
+# Spans are only measured when a sink is enabled. Otherwise span() returns a shared object whose __enter__ and
+# __exit__ do nothing, so instrumented code does not pay for the measurements when instrumentation is off.
+#
+# Sinks (receive the name, start time, duration and tags of each finished span):
+#       AggregatorSink      :   in memory count/total/min/max and latency histogram of each span name
+#       JSONLinesSink       :   appends one json line per span to a file
+#       CallbackSink        :   calls a function with each span
+#
+# Instrumentation can also be enabled with the environment variable HPSS_INSTRUMENTATION=<file.jsonl>, which writes
+# the spans of the process to a JSON lines file
+
+
+class NullSpan:
+    # span used when instrumentation is off
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class Span:
+
+    __slots__ = ("sink", "name", "tags", "start")
+
+    def __init__(self, sink, name, tags):
+        self.sink = sink
+        self.name = name
+        self.tags = tags
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.tags["error"] = exc_type.__name__
+        self.sink.record(self.name, self.start, duration, self.tags)
+        return False
+
+
+null_span = NullSpan()
+active_sink = None                                      # sink receiving the spans (None: instrumentation is off)
+
+
+def span(name, **tags):
+    # context manager measuring the duration of its block
+    if active_sink is None:
+        return null_span
+    return Span(active_sink, name, tags)
+
+
+def timed(name, **tags):
+    # decorator measuring the duration of each call of the function. The function is returned undecorated when
+    # instrumentation is off at decoration time (no call overhead), so enable it before importing the instrumented
+    # modules (exp: with HPSS_INSTRUMENTATION) to measure them
+    def decorator(function):
+        if active_sink is None:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, **tags):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enable(sink):
+    # sends the spans to sink (replaces the previous sink), returns sink
+    global active_sink
+    active_sink = sink
+    return sink
+
+
+def disable():
+    # turns instrumentation off, returns the previous sink
+    global active_sink
+    sink, active_sink = active_sink, None
+    return sink
+
+
+def is_enabled():
+    return active_sink is not None
+
+
+class AggregatorSink:
+
+    # Aggregates the spans in memory: count, total, min and max duration of each span name, and a histogram of the
+    # durations with buckets growing by a factor 2 (bucket k holds the durations in [2^(k-1), 2^k) microseconds)
+
+    def __init__(self):
+        self.stats = dict()
+        self.lock = threading.Lock()
+
+    def record(self, name, start, duration, tags):
+        bucket = max(int(math.ceil(math.log(max(duration * 1e6, 1.0), 2))), 0)
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = {"count": 0, "total_s": 0.0, "min_s": duration, "max_s": duration,
+                                            "histogram": dict()}
+            stats["count"] += 1
+            stats["total_s"] += duration
+            stats["min_s"] = min(stats["min_s"], duration)
+            stats["max_s"] = max(stats["max_s"], duration)
+            stats["histogram"][bucket] = stats["histogram"].get(bucket, 0) + 1
+
+    def percentile(self, name, q):
+        # upper bound of the q-th percentile (0 < q <= 100) of the durations of a span name (in seconds)
+        stats = self.stats[name]
+        rank = q / 100.0 * stats["count"]
+        seen = 0
+        for bucket in sorted(stats["histogram"]):
+            seen += stats["histogram"][bucket]
+            if seen >= rank:
+                return min(2 ** bucket * 1e-6, stats["max_s"])
+        return stats["max_s"]
+
+    def summary(self):
+        # returns {span name: {count, total_s, mean_s, min_s, max_s, p50_s, p90_s, p99_s, histogram}}
+        with self.lock:
+            summary = dict()
+            for name, stats in self.stats.items():
+                summary[name] = dict(stats, mean_s=stats["total_s"] / stats["count"],
+                                     p50_s=self.percentile(name, 50), p90_s=self.percentile(name, 90),
+                                     p99_s=self.percentile(name, 99),
+                                     histogram={"<%ius" % 2 ** bucket: count
+                                                for bucket, count in sorted(stats["histogram"].items())})
+            return summary
+
+    def reset(self):
+        with self.lock:
+            self.stats = dict()
+
+
+class JSONLinesSink:
+
+    # Appends a json line {"name", "start", "duration_s", "pid", "thread", tags...} per span to a file
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "a")
+        self.lock = threading.Lock()
+
+    def record(self, name, start, duration, tags):
+        line = dict(tags, name=name, start=start, duration_s=duration, pid=os.getpid(),
+                    thread=threading.current_thread().name)
+        line = json.dumps(line, default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class CallbackSink:
+
+    # Calls callback(name, start, duration, tags) for each span (exp: to forward the spans to a monitoring system)
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def record(self, name, start, duration, tags):
+        self.callback(name, start, duration, tags)
+
+
+if os.environ.get("HPSS_INSTRUMENTATION"):
+    enable(JSONLinesSink(os.environ["HPSS_INSTRUMENTATION"]))
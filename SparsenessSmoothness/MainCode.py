@@ -1,4 +1,4 @@
-from DecomposeSmoothSparse import HPSS           # Import SmoothSparse NMF separator (developed by me)
+from DecomposeSmoothSparse import BlockHPSS      # Import SmoothSparse NMF separator (developed by me)
 import essentia.standard as es
 
 import os, glob
@@ -11,7 +11,10 @@ mixFolder = "/mix/"                          # folder containing the file to be
 
 saveFolder = "/separated/"                   # Subdirectory in each entry to save the results
 
-nSeconds = 30                               # number of seconds to analyze
+nSeconds = None                             # number of seconds to analyze (None: whole track)
+
+blockSeconds = 30                           # length of the segments separated one at a time (in seconds)
+overlapSeconds = 2                          # overlap between consecutive segments (in seconds)
 
 
 frameSize = 2048                                           # frame size for stft calculation
@@ -36,10 +39,12 @@ for i in range(nFiles):
             os.makedirs(saveFolderLoc)
 
         monoLoader = es.MonoLoader(filename=mixFile, sampleRate=44100)
-        x = monoLoader()[:nSeconds*44100]
+        x = monoLoader()[:nSeconds*44100 if nSeconds else None]
 
-        hpss = HPSS(
+        hpss = BlockHPSS(
             x,
+            blockSize=blockSeconds*44100,                       # Number of samples separated at a time
+            overlapSize=overlapSeconds*44100,                   # Number of samples cross-faded between segments
             directory=saveFolderLoc,                            # Directory to save separated files
             filename=filename+"_smsp",                          # Filename used as a prefix to save the separated parts
             format="mp3",                                       # Format to save the separated files
@@ -49,7 +54,8 @@ for i in range(nFiles):
             fftSize=fftSize,
             Rp=150,                                             # Number of percussive bases
             Rh=150,                                             # Number of harmonic bases
-            maxIter=200.0,                                      # Number of iterations to update the har/per masks
+            maxIter=200.0,                                      # Maximum number of iterations to update the masks
+            tol=1e-3,                                           # Stop when the relative cost decrease is below tol
             K_SSM=1,                                           # Percussive Spectral Smoothness weight on cost function
             K_TSP=1,                                           # Percussive Temporal Smoothness weight on cost function
             K_SSP=1,                                           # Harmonic Spectral Smoothness weight on cost function
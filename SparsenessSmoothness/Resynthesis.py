@@ -0,0 +1,89 @@
+#   Import Libraries
+import numpy as np
+from scipy.signal import get_window
+
+# --------------------------------------- Masks and re-synthesis ---------------------------------------#
+# Used for creating the separation masks from the percussive/harmonic spectrograms and converting the masked
+# spectrograms back to time domain signals, without running the decomposition again (see SeparationArtifacts.py)
+
+
+def masks_from_spectrograms(X_P, X_H, power=2.0, binary=False):
+    #
+    #   X_P, X_H (2-D Arrays)   :   percussive and harmonic (magnitude) spectrograms <FxT>
+    #   power (float)           :   exponent of the soft masks (2: Wiener masks, equations 15 and 16 in [1] of HPSS)
+    #                               M_P = X_P^power / (X_P^power + X_H^power)
+    #   binary (bool)           :   if True, each bin is assigned to the largest spectrogram (M_P = X_P > X_H)
+    #
+    #   returns the percussive and harmonic masks (M_P, M_H), with M_P + M_H = 1
+    X_P = np.asarray(X_P)
+    X_H = np.asarray(X_H)
+    dtype = np.result_type(X_P, X_H, np.float32)
+
+    if binary:
+        M_P = np.greater(X_P, X_H).astype(dtype)
+    else:
+        M_P = np.power(X_P, power, dtype=dtype)
+        denom = np.power(X_H, power, dtype=dtype)
+        denom += M_P
+        denom[denom == 0] = 1                       # empty bins are assigned to the harmonic part
+        M_P /= denom
+
+    M_H = 1 - M_P
+    return M_P, M_H
+
+
+def batch_istft(stfts, hopSize, frameSize=None, winType="hann", length=None, frames_per_chunk=2048):
+    #
+    #   Inverse stft of several spectrograms at once, equivalent to calling librosa.core.istft (center = True) on each
+    #   spectrogram, exp: x_p, x_h = batch_istft(np.stack([X_P, X_H]), hopSize, frameSize)
+    #
+    #   stfts (3-D Array)       :   complex spectrograms <Nx(1+n_fft/2)xT>
+    #   hopSize, frameSize (int), winType (str) :   istft parameters (frameSize defaults to n_fft)
+    #   length (int)            :   number of samples of the signals (default = as many as the frames cover)
+    #   frames_per_chunk (int)  :   number of frames transformed at once (bounds the size of the scratch matrices)
+    #
+    #   returns the time domain signals <Nxlength> (float32)
+    stfts = np.asarray(stfts)
+    N, F, T = stfts.shape
+    n_fft = 2 * (F - 1)
+    if frameSize is None:
+        frameSize = n_fft
+
+    window = get_window(winType, frameSize, fftbins=True)
+    offset = (n_fft - frameSize) // 2                  # the window is centered in the fft frame
+    window = np.pad(window, (offset, n_fft - frameSize - offset), mode="constant")
+
+    # frames are split into R blocks of hopSize samples, so that the overlap-add is R vectorized additions
+    R = int(np.ceil(n_fft / float(hopSize)))
+    padded_window = np.zeros(R * hopSize)
+    padded_window[:n_fft] = window
+
+    y = np.zeros((N, T + R - 1, hopSize))
+    window_sum = np.zeros((T + R - 1, hopSize))
+    for r in range(R):
+        window_sum[r:r+T] += np.square(padded_window[r*hopSize:(r+1)*hopSize])
+
+    frames = np.zeros((N, T if T < frames_per_chunk else frames_per_chunk, R * hopSize))
+    for t0 in range(0, T, frames_per_chunk):
+        t1 = min(t0 + frames_per_chunk, T)
+        chunk = frames[:, :t1-t0]
+        chunk[..., :n_fft] = np.fft.irfft(stfts[:, :, t0:t1], n=n_fft, axis=1).transpose(0, 2, 1)
+        chunk *= padded_window
+        chunk = chunk.reshape(N, t1-t0, R, hopSize)
+        for r in range(R):
+            y[:, t0+r:t1+r] += chunk[:, :, r]
+
+    y = y.reshape(N, -1)
+    window_sum = window_sum.reshape(-1)
+    nonzero = window_sum > np.finfo(window_sum.dtype).tiny
+    y[:, nonzero] /= window_sum[nonzero]
+
+    # remove the padding added by the centered stft
+    y = y[:, n_fft // 2:n_fft + hopSize * (T - 1) - n_fft // 2] if length is None else y[:, n_fft // 2:]
+    if length is not None:
+        if y.shape[1] >= length:
+            y = y[:, :length]
+        else:
+            y = np.pad(y, ((0, 0), (0, length - y.shape[1])), mode="constant")
+
+    return y.astype(np.float32)
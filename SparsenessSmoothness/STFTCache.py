@@ -0,0 +1,131 @@
+#   Import Libraries
+import numpy as np
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from librosa.core import stft as librosa_stft           # Librosa Version 0.6.0
+
+# --------------------------------------- Class definition: STFT Cache ---------------------------------#
+
+
+class STFTCache:
+
+    # Content addressed cache of complex spectrograms
+    #
+    # The spectrograms are keyed by (hash of the audio samples, fftSize, frameSize, hopSize, winType), so separating or
+    # displaying the same signal with the same stft parameters only computes the transform once, whichever object
+    # asks for it (HPSS, median filtering separation, spectrogram canvases).
+    #
+    # The cached arrays are read-only (they are shared between all the users of the cache).
+    # The least recently used spectrograms are removed from memory when the cache holds more than max_bytes, and are
+    # saved to spill_directory as .npy files (if specified), from which they are loaded as memory mapped arrays.
+
+    def __init__(self, max_bytes=512*1024**2, spill_directory=None):
+        #
+        #   max_bytes (int)         :   maximum number of bytes of the spectrograms kept in memory
+        #   spill_directory (str)   :   directory where the spectrograms removed from memory are saved
+        #                               (default = None, i.e. removed spectrograms are discarded)
+        self.max_bytes = int(max_bytes)
+        self.spill_directory = spill_directory
+
+        self.entries = OrderedDict()            # key -> spectrogram (least recently used first)
+        self.n_bytes = 0                        # number of bytes of the spectrograms in memory
+        self.hits = 0                           # number of spectrograms found in the cache
+        self.misses = 0                         # number of spectrograms calculated
+
+        self.lock = threading.RLock()           # the cache is shared by the gui and the separation threads
+
+    @staticmethod
+    def audio_hash(audio):
+        # sha1 digest of the samples (and of their type, so that float32/float64 copies of a signal have different keys)
+        audio = np.ascontiguousarray(audio)
+        digest = hashlib.sha1(str(audio.dtype).encode())
+        digest.update(memoryview(audio).cast("B"))
+        return digest.hexdigest()
+
+    def key(self, audio, fftSize, frameSize, hopSize, winType):
+        return "%s_%i_%i_%i_%s" % (self.audio_hash(audio), fftSize, frameSize, hopSize, winType)
+
+    def get(self, key):
+        # returns the cached spectrogram of key (or None if not cached)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+            spill_file = self.spill_file(key)
+            if spill_file is not None and os.path.isfile(spill_file):
+                return np.load(spill_file, mmap_mode="r")
+
+        return None
+
+    def put(self, key, spectrogram):
+        # stores a (read-only) spectrogram in the cache and returns it
+        spectrogram.setflags(write=False)
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key]
+
+            if spectrogram.nbytes > self.max_bytes:
+                self.spill(key, spectrogram)
+                return spectrogram
+
+            self.entries[key] = spectrogram
+            self.n_bytes += spectrogram.nbytes
+            while self.n_bytes > self.max_bytes:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                self.n_bytes -= evicted.nbytes
+                self.spill(evicted_key, evicted)
+        return spectrogram
+
+    def spill_file(self, key):
+        if self.spill_directory is None:
+            return None
+        return os.path.join(self.spill_directory, key + ".npy")
+
+    def spill(self, key, spectrogram):
+        # saves a spectrogram removed from memory to the spill directory
+        spill_file = self.spill_file(key)
+        if spill_file is None or os.path.isfile(spill_file):
+            return
+        if not os.path.isdir(self.spill_directory):
+            os.makedirs(self.spill_directory, exist_ok=True)
+        part_file = spill_file + ".%i.part" % os.getpid()
+        with open(part_file, "wb") as f:    # (np.save would append .npy to the name)
+            np.save(f, spectrogram)
+        os.replace(part_file, spill_file)   # other processes never see partially written files
+
+    def flush(self):
+        # saves the spectrograms in memory to the spill directory (exp: to share them with other processes)
+        with self.lock:
+            for key, spectrogram in self.entries.items():
+                self.spill(key, spectrogram)
+
+    def stft(self, audio, fftSize=2048, frameSize=2048, hopSize=512, winType="hann"):
+        # returns the (read-only) complex spectrogram of audio <F(freq bins)xT(Time frames)>, as calculated by
+        # librosa.core.stft
+        key = self.key(audio, fftSize, frameSize, hopSize, winType)
+        with self.lock:
+            spectrogram = self.get(key)
+            if spectrogram is not None:
+                self.hits += 1
+                return spectrogram
+            self.misses += 1
+
+        # (calculated outside the lock, so other threads can use the cache meanwhile)
+        spectrogram = librosa_stft(audio, n_fft=fftSize, hop_length=hopSize, win_length=frameSize, window=winType)
+        return self.put(key, spectrogram)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.n_bytes = 0
+
+
+default_stft_cache = STFTCache()                # cache shared by the separators and canvases of a process
+
+
+def cached_stft(audio, fftSize=2048, frameSize=2048, hopSize=512, winType="hann"):
+    # complex spectrogram of audio from the shared cache
+    return default_stft_cache.stft(audio, fftSize=fftSize, frameSize=frameSize, hopSize=hopSize, winType=winType)
@@ -0,0 +1,95 @@
+#   Import Libraries
+import numpy as np
+import os
+import json
+from Resynthesis import masks_from_spectrograms, batch_istft
+
+# --------------------------------------- Separation artifacts store -----------------------------------#
+# Masks, spectrograms and factors of a separation saved next to the separated files, so that later steps (remixing,
+# re-synthesis, plots) can use them without running the decomposition again
+#
+# Layout of a store (one .npy file per array and a json file describing the separation):
+#       <directory>/meta.json
+#       <directory>/M_P.npy, M_H.npy, X_P.npy, X_H.npy, W_P.npy, H_P.npy, W_H.npy, H_H.npy, Xc.npy
+#
+# meta.json is written last, so a store without it is incomplete (exp: interrupted while saving) and is not opened
+
+
+def save_artifacts(directory, arrays, **meta):
+    #
+    #   directory (str)     :   directory of the store (created if needed, existing arrays are overwritten)
+    #   arrays (dict)       :   name -> numpy array
+    #   meta                :   json serializable parameters of the separation (exp: fftSize, hopSize, beta)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    meta_file = os.path.join(directory, "meta.json")
+    if os.path.isfile(meta_file):
+        os.remove(meta_file)                    # the store is incomplete until all the arrays are saved
+
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, name + ".npy"), values)
+
+    meta = dict(meta)
+    meta["arrays"] = {name: {"shape": list(np.shape(values)), "dtype": str(np.result_type(values))}
+                      for name, values in arrays.items()}
+    with open(meta_file, "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+class SeparationArtifacts:
+
+    # Lazily opened store of separation artifacts
+    #
+    # The arrays are memory mapped (read-only) the first time they are accessed as attributes
+    # exp:
+    #       artifacts = SeparationArtifacts("data/separated/track_artifacts")
+    #       artifacts.M_P[:, 100:200]           # only reads the requested frames from disk
+    #       artifacts.meta["hopSize"]
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        meta_file = os.path.join(directory, "meta.json")
+        if not os.path.isfile(meta_file):
+            raise IOError("No (complete) separation artifacts in %s" % directory)
+
+        with open(meta_file) as f:
+            self.meta = json.load(f)
+
+    def keys(self):
+        # names of the stored arrays
+        return list(self.meta["arrays"].keys())
+
+    def __contains__(self, name):
+        return name in self.meta["arrays"]
+
+    def __getattr__(self, name):
+        # only called for attributes that are not already set, i.e. arrays that are not opened yet
+        if name in ("meta", "directory") or name not in self.meta["arrays"]:
+            raise AttributeError(name)
+        values = np.load(os.path.join(self.directory, name + ".npy"), mmap_mode="r")
+        setattr(self, name, values)
+        return values
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def masks(self, power=2.0, binary=False):
+        # percussive and harmonic masks for any exponent (or binary masks) from the stored X_P and X_H
+        return masks_from_spectrograms(self.X_P, self.X_H, power=power, binary=binary)
+
+    def resynthesize(self, power=2.0, binary=False):
+        # returns the percussive and harmonic signals (x_p, x_h) obtained with the given masks
+        if "Xc" not in self:
+            raise ValueError("The separation of %s was done on a magnitude spectrogram, it cannot be re-synthesized"
+                             % self.directory)
+        M_P, M_H = self.masks(power=power, binary=binary)
+        masked = np.empty((2,) + self.Xc.shape, dtype=np.result_type(self.Xc, M_P))
+        np.multiply(M_P, self.Xc, out=masked[0])
+        np.multiply(M_H, self.Xc, out=masked[1])
+        x_p, x_h = batch_istft(masked, self.meta["hopSize"], self.meta["frameSize"], winType=self.meta["winType"],
+                               length=self.meta["length"])
+        return x_p, x_h
@@ -0,0 +1,176 @@
+#   Tests of the SMSP separator (run with: python -m pytest SparsenessSmoothness)
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("essentia")
+pytest.importorskip("librosa")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from DecomposeSmoothSparse import HPSS
+
+
+REGULARIZERS = ("eq21", "eq22", "eq25", "eq26", "eq29", "eq30", "eq33", "eq34")
+
+
+def random_spectrogram(F=64, T=80, seed=0):
+    return np.random.RandomState(seed).rand(F, T) + .01
+
+
+def separator(**options):
+    options = dict(dict(Rp=6, Rh=5, maxIter=10, seed=1, stft_cache=None), **options)
+    return HPSS.from_spectrogram(random_spectrogram(), **options)
+
+
+def test_vectorized_regularizers_match_loop_reference():
+    # the vectorized smoothness/sparseness terms give the same values as the per component reference
+    loop = separator(regularizer_backend="loop")
+    vectorized = separator(regularizer_backend="vectorized")
+    for eq in REGULARIZERS:
+        np.testing.assert_allclose(getattr(vectorized, eq)(), getattr(loop, eq)(), rtol=1e-10, err_msg=eq)
+
+
+def test_vectorized_iterations_match_loop_reference():
+    # and so do the factors after a few iterations
+    loop = separator(regularizer_backend="loop")
+    vectorized = separator(regularizer_backend="vectorized")
+    for i in range(5):
+        loop.next_iteration()
+        vectorized.next_iteration()
+    np.testing.assert_allclose(vectorized.W, loop.W, rtol=1e-10)
+    np.testing.assert_allclose(vectorized.H, loop.H, rtol=1e-10)
+
+
+@pytest.mark.parametrize("beta", [0, .5, 1, 1.5, 2])
+def test_beta_divergence(beta):
+    # beta divergence of the separator (calculated from A and A1) against its elementwise definition
+    hpss = separator(beta=beta, normalized=(beta == 0))    # (beta_normalize is not defined for beta = 0)
+    hpss.calc_common_factors()
+    X, A = hpss.X_nBeta, hpss.A
+    if beta == 0:
+        expected = np.sum(X / A - np.log(X / A) - 1)
+    elif beta == 1:
+        expected = np.sum(X * np.log(X / A) - X + A)
+    else:
+        expected = np.sum(X**beta + (beta-1) * A**beta - beta * X * A**(beta-1)) / (beta * (beta-1))
+    assert np.isfinite(hpss.beta_divergence())
+    np.testing.assert_allclose(hpss.beta_divergence(), expected, rtol=1e-8)
+
+
+def test_save_artifacts_of_spectrogram_separator(tmp_path):
+    # a separator created from a magnitude spectrogram has no signal and no complex spectrogram to save
+    from SeparationArtifacts import SeparationArtifacts
+
+    hpss = separator()
+    for i in range(3):
+        hpss.next_iteration()
+    hpss.create_masks()
+    directory = hpss.save_artifacts(str(tmp_path / "artifacts"))
+
+    artifacts = SeparationArtifacts(directory)
+    assert "Xc" not in artifacts
+    assert artifacts.meta["length"] is None
+    np.testing.assert_array_equal(artifacts.M_P, hpss.M_P)
+    with pytest.raises(ValueError):
+        artifacts.resynthesize()
+
+
+def test_resynthesize_uses_mask_options():
+    # without arguments, resynthesize uses the masks chosen at construction (mask_power, binary_mask)
+    x = np.random.RandomState(2).randn(8192)
+    hpss = HPSS(x, Rp=4, Rh=4, fftSize=512, frameSize=512, hopSize=128, seed=1, stft_cache=None, binary_mask=True)
+    hpss.next_iteration()
+    hpss.resynthesize()
+    assert set(np.unique(hpss.M_P)) <= {0, 1}
+    hpss.resynthesize(binary=False)
+    assert not set(np.unique(hpss.M_P)) <= {0, 1}
+
+
+def initial_bases(Rp=6, Rh=5, F=64, seed=3):
+    random = np.random.RandomState(seed)
+    return random.rand(F, Rp) + .1, random.rand(F, Rh) + .1
+
+
+@pytest.mark.parametrize("freeze_bases", [True, False])
+def test_coarse_initialization_keeps_initial_bases(freeze_bases):
+    W_P, W_H = initial_bases()
+    hpss = separator(W_P=W_P, W_H=W_H, freeze_bases=freeze_bases, coarseIter=5)
+    hpss.coarse_initialize()
+    np.testing.assert_allclose(hpss.W_P, W_P)
+    np.testing.assert_allclose(hpss.W_H, W_H)
+    for i in range(3):
+        hpss.next_iteration()
+    if freeze_bases:
+        np.testing.assert_allclose(hpss.W_P, W_P)
+        np.testing.assert_allclose(hpss.W_H, W_H)
+
+
+def test_restarts_keep_frozen_bases():
+    # the restarts start from the given bases (only the activations are random) and keep them fixed when frozen
+    W_P, W_H = initial_bases()
+    hpss = separator(W_P=W_P, W_H=W_H, freeze_bases=True, n_restarts=3, restartIter=2, restart_workers=2)
+    hpss.select_best_restart()
+    np.testing.assert_allclose(hpss.W_P, W_P)
+    np.testing.assert_allclose(hpss.W_H, W_H)
+
+
+def test_separate_calls_iteration_callback():
+    # separate() reports each full resolution iteration, counting the coarse ones (exp: progress of the gui jobs)
+    iterations = []
+    x = np.random.RandomState(4).randn(8192)
+    hpss = HPSS(x, Rp=4, Rh=4, fftSize=512, frameSize=512, hopSize=128, seed=1, stft_cache=None, maxIter=6,
+                coarseIter=2, coarseFreq=2, coarseTime=2, iteration_callback=lambda hpss, i: iterations.append(i))
+    hpss.separate()
+    assert iterations == [3, 4, 5, 6]
+
+
+def test_batch_istft_matches_istft_of_each_spectrogram():
+    from librosa.core import stft, istft
+    from Resynthesis import batch_istft
+
+    x = np.random.RandomState(5).randn(10000)
+    X = stft(x, n_fft=1024, hop_length=256, win_length=1024)
+    M = np.random.RandomState(6).rand(*X.shape)
+    stfts = np.stack([X * M, X * (1 - M)])
+    signals = batch_istft(stfts, 256, 1024, frames_per_chunk=7)     # (several chunks)
+    for signal, S in zip(signals, stfts):
+        np.testing.assert_allclose(signal, istft(S, hop_length=256, win_length=1024), atol=1e-5)
+    assert batch_istft(stfts, 256, 1024, length=len(x)).shape == (2, len(x))
+
+
+def test_block_separation_reconstructs_the_signal():
+    # soft masks sum to 1 and the segments are cross-faded with complementary ramps, so x_p + x_h = x
+    from DecomposeSmoothSparse import BlockHPSS
+
+    x = np.random.RandomState(7).randn(20000)
+    block_hpss = BlockHPSS(x, blockSize=8000, overlapSize=1000, Rp=4, Rh=4, fftSize=512, frameSize=512, hopSize=128,
+                           maxIter=3, seed=1)
+    block_hpss.separate()
+    assert len(block_hpss.x_p) == len(x)
+    np.testing.assert_allclose(block_hpss.x_p + block_hpss.x_h, x, atol=1e-4)
+
+
+def test_stft_cache_hits_misses_and_eviction(tmp_path):
+    from STFTCache import STFTCache
+
+    signals = [np.random.RandomState(seed).randn(4096).astype(np.float32) for seed in range(3)]
+    cache = STFTCache(max_bytes=10**9)
+    X = cache.stft(signals[0], 512, 512, 128)
+    assert cache.stft(signals[0], 512, 512, 128) is X
+    assert not X.flags.writeable
+    cache.stft(signals[0], 1024, 1024, 128)                 # other parameters: other spectrogram
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # room for two spectrograms: the least recently used one is evicted (and spilled)
+    spill_directory = str(tmp_path / "spill")
+    cache = STFTCache(max_bytes=2 * X.nbytes, spill_directory=spill_directory)
+    spectrograms = [cache.stft(signal, 512, 512, 128) for signal in signals]
+    assert len(cache.entries) == 2 and cache.n_bytes == 2 * X.nbytes
+    key = cache.key(signals[0], 512, 512, 128, "hann")
+    assert key not in cache.entries
+    assert os.listdir(spill_directory) == [key + ".npy"]
+    spilled = cache.stft(signals[0], 512, 512, 128)         # loaded from the spill directory
+    np.testing.assert_array_equal(spilled, spectrograms[0])
+    assert (cache.hits, cache.misses) == (1, 3)
@@ -1,11 +1,10 @@
 from __future__ import unicode_literals
 import sys
 import os
-import glob
 
 from PyQt5 import QtWidgets
 
-import json
+from datasetIndex import DatasetIndex
 
 progname = os.path.basename(sys.argv[0])
 
@@ -27,6 +26,8 @@ class FileManagerGroupBox(QtWidgets.QGroupBox):
     #       4.  use self.set_current_id(new_id) to change the current id manually from your code
     #       4.  use self.get_id_and_filename() to get the existing id and filename (the filename includes the full
     #                                                                               address of the file)
+    #       5.  the tracks, separated files and json files of the dataset are indexed in self.dataset_index (saved in
+    #           the dataset folder), "Find Tracks" only scans the folders modified since the last time
     #
     #
 
@@ -77,6 +78,7 @@ class FileManagerGroupBox(QtWidgets.QGroupBox):
         self.load_directory_format = ""  # dataset location
         if "load_directory_format" in options:
             self.load_directory_format = options.get("load_directory_format")
+        self.dataset_index = DatasetIndex(self.load_directory_format)
         self.ids = []
         self.filenames = []
         self.youtube_links = []
@@ -138,14 +140,10 @@ class FileManagerGroupBox(QtWidgets.QGroupBox):
         else:
             self.load_directory_format = self.load_directory_line_edit.text()
 
-        self.filenames = glob.glob(self.load_directory_format+"*.mp3")
-        wavfiles = glob.glob(self.load_directory_format + "*.wav")
-
-        if wavfiles:
-            self.filenames.extend(wavfiles)
-
-        # sort filenames in alphabetical order
-        self.filenames = sorted(self.filenames)
+        # sorted mp3 and wav files of the dataset folders (only the folders modified since the last time are scanned)
+        if self.dataset_index.load_directory_format != self.load_directory_format:
+            self.dataset_index = DatasetIndex(self.load_directory_format)
+        self.filenames = self.dataset_index.refresh()
 
         # initialize current file
         if not self.filenames:      # if empty: disable buttons
@@ -166,19 +164,10 @@ class FileManagerGroupBox(QtWidgets.QGroupBox):
 
     def get_youtube_discogs_link(self):
         # gets the youtube and discogs link from the json metadata file located in the same folder as audio
-        jsonFolder = "/".join(self.current_filename.split("/")[:-1])  # assumes json file is in the same folder as audio
-        jsonFile = glob.glob(jsonFolder+"/*.json")
-
-        self.current_youtube_link = "youtube.com/??"
-        self.current_discogs_link = "discogs.com/??"
-
-        if jsonFile:
-            json_data = json.load(open(jsonFile[0]))
+        metadata = self.dataset_index.metadata(self.current_filename)
 
-            if "uri" in json_data:
-                self.current_discogs_link = json_data["uri"]
-            if "youtube" in json_data:
-                self.current_discogs_link = json_data["youtube"]
+        self.current_youtube_link = metadata.get("youtube", "youtube.com/??")
+        self.current_discogs_link = metadata.get("uri", "discogs.com/??")
 
     def create_analysis_folders(self):
         current_folder = os.path.dirname(self.current_filename)
@@ -239,6 +228,18 @@ class FileManagerGroupBox(QtWidgets.QGroupBox):
         self.set_track_data()
         return
 
+    def neighbour_filenames(self, distance=1):
+        # filenames of the tracks up to distance tracks after and before the current one (closest first)
+        if self.current_filename not in self.filenames:
+            return []
+        current_track_index = self.filenames.index(self.current_filename)
+        neighbours = []
+        for offset in range(1, distance + 1):
+            for index in (current_track_index + offset, current_track_index - offset):
+                if 0 <= index < len(self.filenames):
+                    neighbours.append(self.filenames[index])
+        return neighbours
+
     def get_id_and_filename(self):
         # use this to get the current id and filename (which includes the complete address to locate audio)
         return self.current_id, self.current_filename
@@ -33,6 +33,8 @@ import sounddevice as sd
 
 from spectrogramCanvas import SpectrogramCanvas, InteractiveSpectrogramCanvas
 from midiCanvas import MidiCanvas, ChromagramCanvas
+from trackPrefetcher import calc_chromagram
+from spectrogramRenderer import PyramidImage
 
 from draggableDot import DraggableDot
 
@@ -192,27 +194,8 @@ class DrumAndBasslineTranscriberWidget(QtWidgets.QGroupBox):
             self.chromaCanvas.get_ax().set_xlim(xlim)
 
             # Calculate Chromagram
-            self.chromagram = []
-            hpcp = es.HPCP(size=12,  # we will need higher resolution for Key estimation
-                           referenceFrequency=440,  # assume tuning frequency is 44100.
-                           bandPreset=False,
-                           weightType='cosine',
-                           nonLinear=False,
-                           windowSize=1.,
-                           sampleRate=sample_rate)
-
-            spectrum = es.Spectrum(size=fft_size)
-            spectral_peaks = es.SpectralPeaks(sampleRate=sample_rate)
-
-            for frame in es.FrameGenerator(self.audio, frameSize=8192,
-                                           hopSize=hop_size, startFromZero=True):
-
-                frame = array(frame * get_window("hann", 8192))
-                freqs, mags = spectral_peaks(spectrum(frame))
-                chroma = hpcp(freqs, mags)
-                self.chromagram.append(chroma)
-
-            self.chromagram = array(self.chromagram)
+            self.chromagram = calc_chromagram(self.audio, fft_size=fft_size, frame_size=8192, hop_size=hop_size,
+                                              win_type="hann", sample_rate=sample_rate)
 
             self.timeAxSec = np.arange(len(self.chromagram)) * hop_size / (sample_rate)
 
@@ -224,7 +207,7 @@ class DrumAndBasslineTranscriberWidget(QtWidgets.QGroupBox):
             y_ax = np.arange(13)
             self.chromaCanvas.get_ax().set_yticks(y_ax[:12] + .5)
             self.chromaCanvas.get_ax().set_yticklabels(pitchClasses)
-            self.chromaCanvas.get_ax().pcolormesh(self.timeAxSec, y_ax, self.chromagram.T)
+            PyramidImage(self.chromaCanvas.get_ax(), self.chromagram, self.timeAxSec, y_ax[:12] + .5)
             self.chromaCanvas.get_ax().set_ylabel("Pitch Class")
             self.chromaCanvas.get_fig().canvas.draw()
 
@@ -2,6 +2,11 @@ import numpy as np
 import essentia.standard as es
 from essentia import Pool, array
 from copy import deepcopy
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SparsenessSmoothness"))
+from Instrumentation import timed               # latency of the transcription stages
+from utils import spectra, essentia_window      # batched spectra of the frames
 
 
 class BasslineTranscriber:
@@ -161,6 +166,7 @@ class BasslineTranscriber:
 
         return midi_tracks, beats, grid, onsets, estQuantizedMIDI, frame_times
 
+    @timed("bassline_transcriber.get_Yin_Pitch")
     def get_Yin_Pitch(self):
         if self.audio != []:
             pitchDetect = es.PitchYin(frameSize=self.frameSize,
@@ -182,6 +188,7 @@ class BasslineTranscriber:
             return None, None, None
 
 
+    @timed("bassline_transcriber.extractorEssentia")
     def extractorEssentia(self):
 
         # create the results pool
@@ -284,6 +291,7 @@ class BasslineTranscriber:
 
         return midi_tracks, analysisResults["beats"], analysisResults["grid"]
 
+    @timed("bassline_transcriber.get_predominant_pitch")
     def get_predominant_pitch(self):
         if self.audio != []:
             PitchMelodia = es.PitchMelodia(guessUnvoiced=self.guessUnvoiced,
@@ -309,21 +317,21 @@ class BasslineTranscriber:
                     midi.append(69 + 12 * np.math.log(pitch / 440.0, 2))
         return midi
 
+    @timed("bassline_transcriber.get_onsets")
     def get_onsets(self):
 
-        W = es.Windowing(type=self.winType)
-        c2p = es.CartesianToPolar()
-        fft = es.FFT()
         onsetDetection = es.OnsetDetection(method=self.onsetMethod, sampleRate=44100)
         onsets = es.Onsets()
         # onsetIndex = []
         pool = Pool()
 
-        for frame in es.FrameGenerator(self.audio, frameSize=1024, hopSize=512):
-            mag, phase, = c2p(fft(W(frame)))
-            onsetDetection.configure(method=self.onsetMethod)
-            onsetFunction = onsetDetection(mag, phase)
-            pool.add("onsetFunction", onsetFunction)
+        # spectra of all the frames at once (frames, window and phases as es.FrameGenerator, es.Windowing and es.FFT)
+        for t0, X in spectra(self.audio, 1024, 1024, 512, essentia_window(self.winType, 1024), start_from_zero=False,
+                             zero_phase=True):
+            for mag, phase in zip(array(np.abs(X)), array(np.angle(X))):
+                onsetDetection.configure(method=self.onsetMethod)
+                onsetFunction = onsetDetection(mag, phase)
+                pool.add("onsetFunction", onsetFunction)
 
         DetectedOnsetsArray = onsets([pool["onsetFunction"]], [1])
 
@@ -382,6 +390,7 @@ class BasslineTranscriber:
 
         return indexStamps, TimeStamps, MIDIgroupsProcessed
 
+    @timed("bassline_transcriber.getBeats")
     def getBeats(self):
         BeatTracker = es.BeatTrackerMultiFeature()
         beats, _ = BeatTracker(self.audio)
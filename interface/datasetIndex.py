@@ -0,0 +1,202 @@
+import os
+import glob
+import json
+import threading
+
+
+AUDIO_EXTENSIONS = (".mp3", ".wav")
+SEGMENTATION_FILENAME = "segmentation_data.json"
+
+
+def scan_files(folder, extensions):
+    # sorted files of folder (not recursive) with one of the extensions
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return []
+    return sorted(os.path.join(folder, entry.name) for entry in entries
+                  if entry.name.lower().endswith(extensions) and entry.is_file())
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class DatasetIndex:
+
+    # Persistent index of the dataset, so that navigating through the tracks does not scan the dataset folders again
+    #
+    # The index is saved as a json file in a hidden folder of the dataset root (so saving it does not change the
+    # modification time of the root), exp: ../dataset/.dataset_index/index.json for the format ../dataset/*/
+    # It holds, for each track folder:
+    #       mtime               :   modification time of the folder when it was scanned
+    #       tracks              :   audio files (mp3/wav) of the folder
+    #       json_files          :   json files of the folder (metadata and segmentation)
+    #       metadata            :   discogs ("uri") and youtube links of the metadata json file (parsed when first needed)
+    #       harmonic/percussive :   separated files in the harmonic and percussive sub folders (listed when first needed)
+    #
+    # Entries are only scanned again when the modification time of their folder (or sub folder, or metadata file)
+    # changed. The track folders are only globbed again when the modification time of the dataset root changed
+    # (folders added, removed or renamed), so refreshing an unchanged index costs one stat per folder.
+    #
+    # exp:
+    #       index = DatasetIndex("../dataset/*/")
+    #       filenames = index.refresh()
+    #       index.separated_files(filenames[0], "harmonic"), index.metadata(filenames[0])
+
+    def __init__(self, load_directory_format, index_filename=None):
+        #
+        #   load_directory_format (str) :   glob pattern of the track folders (exp: "../dataset/*/")
+        #   index_filename (str)        :   json file of the index (default: .dataset_index/index.json in the dataset
+        #                                   root, i.e. the folder before the first wildcard of load_directory_format)
+        self.load_directory_format = load_directory_format
+        if index_filename is None:
+            root = load_directory_format
+            for wildcard in "*?[":
+                root = root.split(wildcard)[0]
+            index_filename = os.path.join(os.path.dirname(root), ".dataset_index", "index.json")
+        self.index_filename = index_filename
+
+        # folder containing the track folders, None if the pattern has wildcards before its last level (then the
+        # folders are always globbed)
+        self.parent_folder = os.path.dirname(os.path.normpath(load_directory_format))
+        if any(wildcard in self.parent_folder for wildcard in "*?["):
+            self.parent_folder = None
+
+        self.folders = dict()                   # normalized folder path -> entry
+        self.parent_mtime = None                # modification time of parent_folder when the folders were globbed
+        self.dirty = False                      # True if the entries changed since the index was saved
+        self.lock = threading.RLock()           # the index is also used by the prefetching thread
+        self.load()
+
+    def load(self):
+        # loads the saved index (ignored if it was built for another directory format)
+        if not os.path.isfile(self.index_filename):
+            return
+        try:
+            with open(self.index_filename) as f:
+                saved = json.load(f)
+        except (IOError, ValueError):
+            print("Could not read the dataset index %s, it will be rebuilt" % self.index_filename)
+            return
+        if saved.get("load_directory_format") == self.load_directory_format:
+            self.folders = saved["folders"]
+            self.parent_mtime = saved.get("parent_mtime")
+
+    def save(self):
+        # writes the index if it changed (written to a temporary file first, so that it is never partially written)
+        with self.lock:
+            if not self.dirty:
+                return
+            temp_filename = self.index_filename + ".%i.tmp" % os.getpid()
+            try:
+                self.make_index_directory()
+                with open(temp_filename, "w") as f:
+                    json.dump({"load_directory_format": self.load_directory_format, "parent_mtime": self.parent_mtime,
+                               "folders": self.folders}, f)
+                os.replace(temp_filename, self.index_filename)
+                self.dirty = False
+            except (IOError, OSError) as error:
+                print("Could not save the dataset index %s (%s)" % (self.index_filename, error))
+
+    def make_index_directory(self):
+        index_directory = os.path.dirname(self.index_filename)
+        if index_directory and not os.path.isdir(index_directory):
+            try:
+                os.makedirs(index_directory, exist_ok=True)
+            except OSError:
+                pass                            # (reported by save)
+
+    def refresh(self):
+        # updates the index (rescans the folders modified since the last refresh) and returns the sorted audio files
+        # of all the track folders
+        with self.lock:
+            self.make_index_directory()     # (before the stat of the parent folder, which it may contain)
+            parent_mtime = None if self.parent_folder is None else get_mtime(self.parent_folder)
+            if parent_mtime is None or parent_mtime != self.parent_mtime:
+                paths = [os.path.normpath(folder) for folder in glob.glob(self.load_directory_format)]
+                paths = [folder for folder in paths if os.path.isdir(folder)]
+                if parent_mtime != self.parent_mtime:
+                    self.parent_mtime = parent_mtime
+                    self.dirty = True
+            else:
+                paths = list(self.folders)      # same folders as when the parent folder was globbed
+
+            folders = dict()
+            for folder in paths:
+                folders[folder] = self.folder_entry(folder)
+
+            if set(folders) != set(self.folders):
+                self.dirty = True               # folders were added or removed
+            self.folders = folders
+            self.save()
+
+            return sorted(track for entry in self.folders.values() for track in entry["tracks"])
+
+    def folder_entry(self, folder):
+        # entry of folder, scanned again if the folder was modified
+        mtime = get_mtime(folder)
+        entry = self.folders.get(folder)
+        if entry is not None and entry["mtime"] == mtime:
+            return entry
+
+        entry = {"mtime": mtime,
+                 "tracks": scan_files(folder, AUDIO_EXTENSIONS),
+                 "json_files": scan_files(folder, (".json",))}
+        self.folders[folder] = entry
+        self.dirty = True
+        return entry
+
+    def track_entry(self, filename):
+        # entry of the folder of a track (scanned if not indexed yet)
+        with self.lock:
+            return self.folder_entry(os.path.normpath(os.path.dirname(filename)))
+
+    def separated_files(self, filename, part):
+        # separated files (part = "harmonic" or "percussive") of a track, located in <track folder>/<part>/
+        with self.lock:
+            entry = self.track_entry(filename)
+            folder = os.path.join(os.path.dirname(filename), part)
+            mtime = get_mtime(folder)
+            if part not in entry or entry[part]["mtime"] != mtime:
+                entry[part] = {"mtime": mtime, "files": scan_files(folder, AUDIO_EXTENSIONS)}
+                self.dirty = True
+            return list(entry[part]["files"])
+
+    def segmentation_file(self, filename):
+        # segmentation json file of a track (None if there is none)
+        with self.lock:
+            entry = self.track_entry(filename)
+            for json_file in entry["json_files"]:
+                if os.path.basename(json_file) == SEGMENTATION_FILENAME:
+                    return json_file
+        return None
+
+    def metadata(self, filename):
+        # {"uri": <discogs link>, "youtube": <youtube link>} of a track (only the available links), read from the
+        # first json file of its folder that is not the segmentation file
+        with self.lock:
+            entry = self.track_entry(filename)
+            json_files = [json_file for json_file in entry["json_files"]
+                          if os.path.basename(json_file) != SEGMENTATION_FILENAME]
+            if not json_files:
+                return dict()
+
+            mtime = get_mtime(json_files[0])
+            metadata = entry.get("metadata")
+            if metadata is None or metadata["file"] != json_files[0] or metadata["mtime"] != mtime:
+                links = dict()
+                try:
+                    with open(json_files[0]) as f:
+                        json_data = json.load(f)
+                    for key in ("uri", "youtube"):
+                        if key in json_data:
+                            links[key] = json_data[key]
+                except (IOError, ValueError):
+                    pass
+                metadata = entry["metadata"] = {"file": json_files[0], "mtime": mtime, "links": links}
+                self.dirty = True
+            return dict(metadata["links"])
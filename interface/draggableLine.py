@@ -25,6 +25,11 @@ class DraggableHLine:
     #       4. The offset of the object can be moved left or right by dragging the onset
     #       5. To delete a line, double click on the line. Without moving the mouse cursor,
     #          right-click to remove the line. After deleting onset, offset, y_val will be "None".
+    #       6. While a line is dragged, only the line is redrawn (blitted over the background of the axes saved when
+    #          the line was pressed), the figures are drawn normally when the line is released.
+    #       7. A line used on its own handles its events after connect(). The lines of a MidiCanvas are not connected:
+    #          the canvas finds the line under the mouse (see NoteIndex, contains() and contains_chroma()) and calls
+    #          the event handling functions of the selected line.
     #
 
     def __init__(self, fig, ax, onset, offset, midi_value, **options):
@@ -125,11 +130,13 @@ class DraggableHLine:
         self.holdFlag = False
         self.adjustLeftFlag = False
         self.adjustRightFlag = False
-        self.cidClick = []
+        self.cids = []      # (canvas, identifier) of the connected event handling functions
 
         #   set to true if double clicked on a line (right click after double clicking removes a line)
         self.doubleClickFlag = False
 
+        #   backgrounds of the axes (without the line) saved while the line is dragged, None otherwise
+        self.backgrounds = None
 
 
         #   Connect event handling functions
@@ -174,32 +181,46 @@ class DraggableHLine:
 
     def connect(self):
         # connects the event handling functions
-        self.cidpress = self.fig.canvas.mpl_connect('button_press_event', self.on_press)
-        self.cidrelease = self.fig.canvas.mpl_connect('button_release_event', self.on_release)
-        self.cidmotion = self.fig.canvas.mpl_connect('motion_notify_event', self.on_motion)
-
+        self.disconnect()
+        handlers = [(self.fig, 'button_press_event', self.on_press),
+                    (self.fig, 'button_release_event', self.on_release),
+                    (self.fig, 'motion_notify_event', self.on_motion)]
         if self.ax_chroma:
-            # print("connected")
-            self.cidpress_chroma = self.fig_chroma.canvas.mpl_connect('button_press_event', self.on_press_chroma)
-            self.cidrelease_chroma = self.fig_chroma.canvas.mpl_connect('button_release_event', self.on_release)
-            self.cidmotion_chroma = self.fig_chroma.canvas.mpl_connect('motion_notify_event', self.on_motion_chroma)
+            handlers += [(self.fig_chroma, 'button_press_event', self.on_press_chroma),
+                         (self.fig_chroma, 'button_release_event', self.on_release),
+                         (self.fig_chroma, 'motion_notify_event', self.on_motion_chroma)]
 
-    def disconnect(self):
-        # disconnects the event handling functions
-        self.fig.canvas.mpl_disconnect(self.cidpress)
-        self.fig.canvas.mpl_disconnect(self.cidrelease)
-        self.fig.canvas.mpl_disconnect(self.cidmotion)
+        for fig, event_name, handler in handlers:
+            self.cids.append((fig.canvas, fig.canvas.mpl_connect(event_name, handler)))
 
-        if self.fig_chroma:
-            self.fig_chroma.canvas.mpl_disconnect(self.cidpress_chroma)
-            self.fig_chroma.canvas.mpl_disconnect(self.cidrelease_chroma)
-            self.fig_chroma.canvas.mpl_disconnect(self.cidmotion_chroma)
+    def disconnect(self):
+        # disconnects the event handling functions (if connected)
+        for canvas, cid in self.cids:
+            canvas.mpl_disconnect(cid)
+        self.cids = []
 
         # self.onset = None
         # self.offset = None
         # self.midi_value = None
         # self.chroma_value = None
 
+    def contains(self, x, y):
+        # True if (x, y) (data coordinates of the axes) is on the line (the same test as on_press)
+        if self.onset is None or not (self.onset < x < self.offset):
+            return False
+        if self.y_isHz:
+            if y <= 0:
+                return False
+            y = self.pitch2midi(y)
+        return abs(y - self.midi_value) < self.y_sensitivity
+
+    def contains_chroma(self, x, y):
+        # True if (x, y) (data coordinates of the chromagram axes) is on the chromagram line (same test as
+        # on_press_chroma)
+        if self.onset is None or self.chroma_value is None or not (self.onset <= x <= self.offset):
+            return False
+        return abs(np.floor(y - .5) - self.chroma_value) <= self.y_sensitivity
+
     def on_press(self, event):
 
         # event handling function for pressing mouse click
@@ -245,6 +266,8 @@ class DraggableHLine:
             else:
                 self.doubleClickFlag = False
                 self.holdFlag = True
+                self.start_blitting()
+                self.update_line()
 
         else:
             self.doubleClickFlag = False
@@ -252,8 +275,12 @@ class DraggableHLine:
     def on_release(self, event):
         # event handling function for releasing mouse click
         if not (event.xdata and event.ydata):
+            if self.backgrounds is not None:    # released outside the axes, the figures are drawn normally again
+                self.stop_blitting()
+                self.update_line()
             return
 
+        self.stop_blitting()
         self.holdFlag = False
         self.adjustLeftFlag = False
         self.adjustRightFlag = False
@@ -333,6 +360,8 @@ class DraggableHLine:
             else:
                 self.doubleClickFlag = False
                 self.holdFlag = True
+                self.start_blitting()
+                self.update_line()
         else:
             self.doubleClickFlag = False
 
@@ -346,6 +375,7 @@ class DraggableHLine:
         self.doubleClickFlag = False    # disable deleting line if mouse moved after double clicking
 
         current_chroma_value = self.chroma_value
+        current_colors = (self.line_chroma.get_color(), self.line_chroma.get_markeredgecolor())
 
         # check whether (and which of) onset or offset is selected to be moved
         if (event.xdata <= self.onset + self.x_sensitivity) and event.xdata >= self.onset:
@@ -384,16 +414,40 @@ class DraggableHLine:
                 self.snap_offset_to_grid()  # snap to grid implementation here
         else:
             self.line_chroma.set_color(self.defaultColor)
+            if current_colors == (self.line_chroma.get_color(), self.line_chroma.get_markeredgecolor()):
+                return      # hovering without changing the line, nothing to redraw
 
         # update and redraw line
         self.update_line()
 
+    def figure_lines(self):
+        # (figure, axes, line) of the line and of its chromagram line
+        figure_lines = [(self.fig, self.ax, self.line)]
+        if self.ax_chroma:
+            figure_lines.append((self.fig_chroma, self.ax_chroma, self.line_chroma))
+        return figure_lines
+
+    def start_blitting(self):
+        # draws the figures once without the line and saves the background of the axes, update_line then only
+        # redraws the line over it (until stop_blitting)
+        self.stop_blitting()
+        self.backgrounds = []
+        for fig, ax, line in self.figure_lines():
+            line.set_animated(True)
+            fig.canvas.draw()
+            self.backgrounds.append(fig.canvas.copy_from_bbox(ax.bbox))
+
+    def stop_blitting(self):
+        # the line is drawn with the rest of the figure again (the next update_line redraws the figures)
+        if self.backgrounds is None:
+            return
+        for fig, ax, line in self.figure_lines():
+            line.set_animated(False)
+        self.backgrounds = None
+
     def update_line(self):
         # redraws the line
         self.line.set_xdata([self.onset, self.offset])
-
-        self.fig.canvas.draw()
-
         if self.y_isHz:
             self.line.set_ydata([midi2pitch(self.midi_value), midi2pitch(self.midi_value)])
         else:
@@ -405,7 +459,17 @@ class DraggableHLine:
                 self.line_chroma.set_ydata([self.chroma_value+.5, self.chroma_value+.5])
             else:
                 self.line_chroma.set_ydata([None, None])
-            self.fig_chroma.canvas.draw()
+
+        if self.backgrounds is None:
+            for fig, ax, line in self.figure_lines():
+                fig.canvas.draw()
+            return
+
+        # dragged: the line is blitted over the saved background
+        for (fig, ax, line), background in zip(self.figure_lines(), self.backgrounds):
+            fig.canvas.restore_region(background)
+            ax.draw_artist(line)
+            fig.canvas.blit(ax.bbox)
 
     def draw(self):
         self.ax.add_line(self.line)
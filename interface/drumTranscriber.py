@@ -3,6 +3,11 @@ import essentia.standard as es
 from essentia import Pool, array
 from copy import deepcopy
 import json
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SparsenessSmoothness"))
+from Instrumentation import timed               # latency of the transcription stages
+from utils import spectra, essentia_window      # batched spectra of the frames
 
 class DrumTranscriber:
     def __init__(self, **options):
@@ -90,6 +95,7 @@ class DrumTranscriber:
     def get_analysisResults(self):
         return self.analysisResults
 
+    @timed("drum_transcriber.onsets_broad_band")
     def onsets_broad_band(self):
         # uses Yin to calculate midi tracks
 
@@ -244,6 +250,7 @@ class DrumTranscriber:
 
         return analysisResults
 
+    @timed("drum_transcriber.get_onsets")
     def get_onsets(self, _audio=[]):
 
         if _audio!=[]:
@@ -251,24 +258,24 @@ class DrumTranscriber:
         else:
             audio = self.audio
 
-        W = es.Windowing(type=self.winType)
-        c2p = es.CartesianToPolar()
-        fft = es.FFT()
         onsetDetection = es.OnsetDetection(method=self.onsetMethod, sampleRate=44100)
         onsets = es.Onsets(alpha=.2)
         # onsetIndex = []
         pool = Pool()
 
-        for frame in es.FrameGenerator(audio, frameSize=1024, hopSize=512):
-            mag, phase, = c2p(fft(W(frame)))
-            onsetDetection.configure(method=self.onsetMethod)
-            onsetFunction = onsetDetection(mag, phase)
-            pool.add("onsetFunction", onsetFunction)
+        # spectra of all the frames at once (frames, window and phases as es.FrameGenerator, es.Windowing and es.FFT)
+        for t0, X in spectra(audio, 1024, 1024, 512, essentia_window(self.winType, 1024), start_from_zero=False,
+                             zero_phase=True):
+            for mag, phase in zip(array(np.abs(X)), array(np.angle(X))):
+                onsetDetection.configure(method=self.onsetMethod)
+                onsetFunction = onsetDetection(mag, phase)
+                pool.add("onsetFunction", onsetFunction)
 
         DetectedOnsetsArray = onsets([pool["onsetFunction"]], [1])
 
         return DetectedOnsetsArray
 
+    @timed("drum_transcriber.getBeats")
     def getBeats(self):
         #BeatTracker = es.BeatTrackerMultiFeature()
         #beats, _ = BeatTracker(self.audio)
@@ -17,6 +17,7 @@ from matplotlib.figure import Figure
 
 # Module for DraggableMidiLines
 from draggableLine import DraggableHLine
+from noteIndex import NoteIndex     # finds the line under the mouse (the lines are not connected individually)
 import numpy as np
 
 import essentia.standard as es
@@ -25,15 +26,12 @@ from scipy.signal import get_window
 
 from matplotlib.lines import Line2D
 
-from threading import Thread
-
-import time
-
-import sounddevice as sd
-
 import os
 
 from utils import midi2note
+from spectrogramRenderer import PyramidImage     # chromagrams drawn at screen resolution
+from trackPrefetcher import default_prefetcher   # audio and chromagrams shared by the canvases (and prefetched)
+from playbackCursor import default_playback_cursor  # playback cursor blitted on all the canvases
 
 from music21 import *
 from pysynth_b import *
@@ -81,8 +79,6 @@ class MidiCanvas(FigureCanvas):
             self.filename = ""
             self.audio = None
 
-        self.is_playing = False
-
         if "saveFileName" in options:
             self.saveFileName = options.get("saveFileName")
         else:
@@ -156,6 +152,7 @@ class MidiCanvas(FigureCanvas):
 
         # To store the 2 draggable points
         self.midi_draggableLines = []
+        self.note_index = NoteIndex()   # interval tree of the lines (keys: number of the line in midi_draggableLines)
         self.note_stream = []   # music21 transcription of the draggable lines
 
         # Flags for interactively adding lines #
@@ -168,6 +165,7 @@ class MidiCanvas(FigureCanvas):
         self.key_pressed_cid = []
         self.key_released_cid = []
         self.mouse_pressed_cid = []
+        self.mouse_cids = []    # (canvas, identifier) of the mouse events dispatched to the lines
 
         # variables for new lines to be added
         self.newLineParameters = []     #   should be stored as [onset, midi value, offset]
@@ -213,10 +211,24 @@ class MidiCanvas(FigureCanvas):
 
     def connect(self):
         # connects the event handling functions
+        #
+        # The canvas is the only receiver of the mouse events of its lines (and of their chromagram lines): a press
+        # selects the line under the mouse (found with the note index) and the events are forwarded to the selected
+        # line, so the cost of an event does not grow with the number of lines
         self.key_pressed_cid = self.fig.canvas.mpl_connect('key_press_event', self.on_key_press)
         self.key_released_cid = self.fig.canvas.mpl_connect('key_release_event', self.on_key_release)
         self.mouse_pressed_cid = self.fig.canvas.mpl_connect('button_press_event', self.on_press)
 
+        handlers = [(self.fig, 'button_release_event', self.on_release),
+                    (self.fig, 'motion_notify_event', self.on_motion)]
+        fig_chroma = self.options.get("fig_chroma")
+        if fig_chroma and self.options.get("ax_chroma"):
+            handlers += [(fig_chroma, 'button_press_event', self.on_press_chroma),
+                         (fig_chroma, 'button_release_event', self.on_release),
+                         (fig_chroma, 'motion_notify_event', self.on_motion_chroma)]
+        for fig, event_name, handler in handlers:
+            self.mouse_cids.append((fig.canvas, fig.canvas.mpl_connect(event_name, handler)))
+
     def on_key_press(self, event):
         if (event.key == "a" or event.key == "A") and self.addLineKeyPressedFlag != True:
             self.addLineKeyPressedFlag = True
@@ -256,126 +268,117 @@ class MidiCanvas(FigureCanvas):
 
         if event.key == "right":
             if (self.current_interactive_line is None) and self.midi_draggableLines!=[]:
-                self.current_interactive_line = 0
+                self.select_line(0)
             elif self.midi_draggableLines!=[]:
-                # change the color of the unselected line
-                self.midi_draggableLines[self.current_interactive_line].update_default_color(color="b")
-                # disconnect the interactive functions
-                self.midi_draggableLines[self.current_interactive_line].disconnect()
                 # select the next line
-                self.current_interactive_line=min(self.current_interactive_line+1, len(self.midi_draggableLines)-1)
-            else:
-                self.current_interactive_line=None
-
-            if not (self.current_interactive_line is None):
-                # set the color of the selected line to red
-                # and connect the event functions
-                self.midi_draggableLines[self.current_interactive_line].update_default_color(color="r")
-                self.midi_draggableLines[self.current_interactive_line].connect()
+                self.select_line(min(self.current_interactive_line+1, len(self.midi_draggableLines)-1))
 
         if event.key == "left":
             if (self.current_interactive_line is None) and self.midi_draggableLines!=[]:
-                self.current_interactive_line = len(self.midi_draggableLines)-1
+                self.select_line(len(self.midi_draggableLines)-1)
             elif self.midi_draggableLines!=[]:
-                # change the color of the unselected line
-                self.midi_draggableLines[self.current_interactive_line].update_default_color(color="b")
-                # disconnect the interactive functions
-                self.midi_draggableLines[self.current_interactive_line].disconnect()
-                # select the next line
-                self.current_interactive_line=max(self.current_interactive_line-1, 0)
-            else:
-                self.current_interactive_line=None
-
-            if not (self.current_interactive_line is None):
-                # set the color of the selected line to red
-                # and connect the event functions
-                self.midi_draggableLines[self.current_interactive_line].update_default_color(color="r")
-                self.midi_draggableLines[self.current_interactive_line].connect()
+                # select the previous line
+                self.select_line(max(self.current_interactive_line-1, 0))
 
         if event.key in ["up", "down"]:
-            if (not (self.current_interactive_line is None)) and self.midi_draggableLines!=[]:
-                # change the color of the unselected line
-                self.midi_draggableLines[self.current_interactive_line].update_default_color(color="b")
-                # disconnect the interactive functions
-                self.midi_draggableLines[self.current_interactive_line].disconnect()
-                self.current_interactive_line=None
+            self.select_line(None)
 
         if event.key in ["1", "2", "3", "4", "5", "6", "7", "8", "9", "0"]:
             ix = int(event.key)
             if ix<=(len(self.midi_draggableLines)-1):
-                # change the color of the unselected line
-                if not self.current_interactive_line is None:
-                    self.midi_draggableLines[self.current_interactive_line].update_default_color(color="b")
-                    # disconnect the interactive functions
-                    self.midi_draggableLines[self.current_interactive_line].disconnect()
-                # disconnect the interactive functions
-                self.midi_draggableLines[self.current_interactive_line].disconnect()
-                # select the next line
-                self.current_interactive_line = ix
-                #activate new line
-                self.midi_draggableLines[self.current_interactive_line].update_default_color(color="r")
-                self.midi_draggableLines[self.current_interactive_line].connect()
+                self.select_line(ix)
 
         if event.key in ["!", "@", "#", "$", "%", "^", "&", "*", "(", ")"]:
             move_command = {"!":-1, "@":-2, "#":-3, "$":-4, "%":-5, "^":-6, "&":-7, "*":-8, "(":-9, ")":0}
             ix = len(self.midi_draggableLines) - 1 + move_command[event.key]
             if 0<=ix<=(len(self.midi_draggableLines)-1):
-                # change the color of the unselected line
-                if not self.current_interactive_line is None:
-                    self.midi_draggableLines[self.current_interactive_line].update_default_color(color="b")
-                    # disconnect the interactive functions
-                    self.midi_draggableLines[self.current_interactive_line].disconnect()
-                # select the next line
-                self.current_interactive_line = ix
-                #activate new line
-                self.midi_draggableLines[self.current_interactive_line].update_default_color(color="r")
-                self.midi_draggableLines[self.current_interactive_line].connect()
+                self.select_line(ix)
 
         if event.key=="tab":    #plays audio
             if not (self.filename is None):
                 print("in")
-                if not self.is_playing:
+                if not default_playback_cursor.is_playing():
                     print("playing")
-                    self.is_playing = True
-                    sd.play(self.audio, 44100)
+                    default_playback_cursor.play(self.audio, 44100)
                 else:
                     print("stopped playing")
-                    sd.stop()
-                    self.is_playing = False
+                    default_playback_cursor.stop()
 
     def on_key_release(self, event):
 
         self.addLineKeyPressedFlag = False
         self.newLineParameters = []             # remove incomplete points added to list
 
-    # def on_release(self, event):
-    #    self.holdFlag = False
+    def select_line(self, ix):
+        # makes line ix the interactive line, which receives the mouse events (None: no line is selected)
+        if ix == self.current_interactive_line:
+            return
+        if not (self.current_interactive_line is None):
+            # change the color of the unselected line
+            self.midi_draggableLines[self.current_interactive_line].update_default_color(color="b")
+        self.current_interactive_line = ix
+        if not (ix is None):
+            # set the color of the selected line to red
+            self.midi_draggableLines[ix].update_default_color(color="r")
+
+    def dispatch(self, handler, event):
+        # forwards a mouse event to the event handling function (handler) of the selected line
+        if self.current_interactive_line is None:
+            return
+        line = self.midi_draggableLines[self.current_interactive_line]
+        held = line.holdFlag
+        getattr(line, handler)(event)
+
+        if line.onset is None:                  # the line was deleted
+            self.note_index.remove(line)
+        elif held and not line.holdFlag:        # end of a drag: the line may have moved (and snapped to the grid)
+            self.note_index.update()
 
     def on_press(self, event):
-        if event.dblclick and (event.xdata and event.ydata):
-            if self.addLineKeyPressedFlag:
-                if self.newLineParameters == []:
-                    self.newLineParameters.append(event.xdata)    # add onset value
-                    self.newLineParameters.append(event.ydata)    # add midi value
+        if event.dblclick and (event.xdata and event.ydata) and self.addLineKeyPressedFlag:
+            if self.newLineParameters == []:
+                self.newLineParameters.append(event.xdata)    # add onset value
+                self.newLineParameters.append(event.ydata)    # add midi value
+            else:
+                self.newLineParameters.append(event.xdata)  # add onset value
+                onset = self.newLineParameters[0]
+                offset = self.newLineParameters[2]
+                if self.y_isHz:
+                    midi = singlepitch2midi(self.newLineParameters[1], quantizePitch=False)
                 else:
-                    self.newLineParameters.append(event.xdata)  # add onset value
-                    onset = self.newLineParameters[0]
-                    offset = self.newLineParameters[2]
-                    if self.y_isHz:
-                        midi = singlepitch2midi(self.newLineParameters[1], quantizePitch=False)
-                    else:
-                        midi = self.newLineParameters[1]
-                    self.add_midi_line(onset, offset, midi)
-                    self.newLineParameters = []
+                    midi = self.newLineParameters[1]
+                self.add_midi_line(onset, offset, midi)
+                self.newLineParameters = []
             return
 
+        # select the line under the mouse (if any) and let the selected line handle the press
+        if event.xdata and event.ydata:
+            ix = self.note_index.find(event.xdata, event.ydata)
+            if not (ix is None):
+                self.select_line(ix)
+        self.dispatch("on_press", event)
+
+    def on_press_chroma(self, event):
+        if event.xdata and event.ydata:
+            ix = self.note_index.find(event.xdata, event.ydata, chroma=True)
+            if not (ix is None):
+                self.select_line(ix)
+        self.dispatch("on_press_chroma", event)
+
+    def on_release(self, event):
+        self.dispatch("on_release", event)
+
     def on_motion(self, event):
-        return
+        self.dispatch("on_motion", event)
+
+    def on_motion_chroma(self, event):
+        self.dispatch("on_motion_chroma", event)
 
     def add_midi_line(self, onset, offset, midi):
         # creates a midi line using the provided options
         line1 = DraggableHLine(self.fig, self.ax, onset, offset, midi, **self.options)
 
+        self.note_index.add(line1, len(self.midi_draggableLines))
         self.midi_draggableLines.append(line1)
         self.fig.canvas.updateGeometry()
 
@@ -600,16 +603,8 @@ class ChromagramCanvas(FigureCanvas):
         if self.playable:
             self.fig.canvas.mpl_connect('button_press_event', self.start_stop_play_vline)
 
-        self.play_vline = Line2D([0, 0], [0, 40000], color="r")
-        self.ax_chromagram.add_line(self.play_vline)
-
-        self._vline_thread = None  # used for audio playback vline
+        self.play_vline = default_playback_cursor.add_axes(self.ax_chromagram)
         self.vline_start = 0
-        self.vline_current = 0
-
-        self.vline_move_resolution = .2  # (seconds) amount to move line
-
-        self.is_playing = False
 
         #initialize figure
         FigureCanvas.setSizePolicy(self,
@@ -664,8 +659,7 @@ class ChromagramCanvas(FigureCanvas):
         # loads the audio
         # apply equal-loudness filter for PredominantPitchMelodia
         if self.filename:
-            loader = es.MonoLoader(filename=self.filename, sampleRate=self.sample_rate)
-            self.audio = loader()
+            self.audio = default_prefetcher.audio(self.filename, self.sample_rate)
             xvals = np.arange(len(self.audio)) / float(self.sample_rate)
             self.xlim = [0, max(xvals)+1]
             self.ax_chromagram.set_xlim(self.xlim)
@@ -674,27 +668,9 @@ class ChromagramCanvas(FigureCanvas):
 
     def calc_chromagram(self):
 
-        # save the results in the stft_pool
-        self.chromagram = []
-        hpcp = es.HPCP(size=12,     # we will need higher resolution for Key estimation
-                       referenceFrequency=440,  # assume tuning frequency is 44100.
-                       bandPreset=False,
-                       weightType='cosine',
-                       nonLinear=False,
-                       windowSize=1.,
-                       sampleRate=self.sample_rate)
-
-        spectrum = es.Spectrum(size=self.fft_size)
-        spectral_peaks = es.SpectralPeaks(sampleRate=self.sample_rate)
-
-        for frame in es.FrameGenerator(self.audio, frameSize=self.frame_size,
-                                       hopSize=self.hop_size, startFromZero=True):
-            frame = array(frame * self.window)
-            freqs, mags = spectral_peaks(spectrum(frame))
-            chroma = hpcp(freqs, mags)
-            self.chromagram.append(chroma)
-
-        self.chromagram = array(self.chromagram)
+        # the chromagram may already be calculated (exp: prefetched for the next track)
+        self.chromagram = default_prefetcher.chromagram(self.audio, self.fft_size, self.frame_size, self.hop_size,
+                                                        self.win_type, self.sample_rate)
 
         self.timeAxSec = np.arange(len(self.chromagram))*self.hop_size/float(self.sample_rate)
 
@@ -705,7 +681,7 @@ class ChromagramCanvas(FigureCanvas):
         y_ax = np.arange(13)
         self.ax_chromagram.set_yticks(y_ax[:12]+.5)
         self.ax_chromagram.set_yticklabels(self.pitchClasses)
-        self.ax_chromagram.pcolormesh(self.timeAxSec, y_ax, self.chromagram.T)
+        PyramidImage(self.ax_chromagram, self.chromagram, self.timeAxSec, y_ax[:12] + .5)
         self.ax_chromagram.set_ylabel("Pitch Class")
         self.fig.canvas.draw()
         return
@@ -719,27 +695,13 @@ class ChromagramCanvas(FigureCanvas):
         return
 
     def start_stop_play_vline(self, event):
-        if (event.inaxes == self.ax_stft) and event.dblclick:
-            if not self.is_playing:
-                self.vline_current = self.vline_start
-                self.is_playing = True
-                self._vline_thread = Thread(target=self.move_play_vlive)
-                sd.play(self.audio, self.sample_rate)
-                self._vline_thread.start()
+        if (event.inaxes == self.ax_chromagram) and event.dblclick:
+            if not default_playback_cursor.is_playing():
+                default_playback_cursor.play(self.audio, self.sample_rate, self.vline_start)
             else:
-                sd.stop()
-                self.is_playing = False
+                default_playback_cursor.stop()
         return
 
-    def move_play_vlive(self):
-        while self.is_playing and (self.vline_current < (len(self.audio)/float(self.sample_rate))):
-            time.sleep(self.vline_move_resolution)
-            self.vline_current += self.vline_move_resolution
-            self.play_vline.set_xdata([self.vline_current, self.vline_current])
-            self.fig.canvas.draw()
-
-        self.is_playing = False
-
 
 if __name__ == '__main__':
     grid = list(range(21))
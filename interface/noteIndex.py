@@ -0,0 +1,108 @@
+class IntervalTree:
+
+    # Static centered interval tree of closed intervals [start, end], queried by point in O(log n + k)
+    #
+    # Each node holds a center, the intervals containing it (sorted by start and by end), and the subtrees of the
+    # intervals entirely before (left) and after (right) the center.
+    #
+    # exp:
+    #       tree = IntervalTree([(0, 2, "a"), (1, 5, "b"), (6, 7, "c")])
+    #       tree.query(1.5)         # ["a", "b"] (in any order)
+
+    def __init__(self, intervals):
+        #
+        #   intervals (list)    :   (start, end, item) tuples
+        self.root = self.build(list(intervals))
+
+    def build(self, intervals):
+        if not intervals:
+            return None
+        endpoints = sorted(value for start, end, item in intervals for value in (start, end))
+        center = endpoints[len(endpoints) // 2]
+
+        left, right, overlapping = [], [], []
+        for interval in intervals:
+            if interval[1] < center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                overlapping.append(interval)
+
+        by_start = sorted(overlapping, key=lambda interval: interval[0])
+        by_end = sorted(overlapping, key=lambda interval: interval[1], reverse=True)
+        return center, by_start, by_end, self.build(left), self.build(right)
+
+    def query(self, x):
+        # items of the intervals containing x
+        items = []
+        node = self.root
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if x < center:
+                for start, end, item in by_start:
+                    if start > x:
+                        break
+                    items.append(item)
+                node = left
+            elif x > center:
+                for start, end, item in by_end:
+                    if end < x:
+                        break
+                    items.append(item)
+                node = right
+            else:
+                items.extend(item for start, end, item in by_start)
+                break
+        return items
+
+
+class NoteIndex:
+
+    # Index of the DraggableHLine notes of a MidiCanvas, used to find the note under the mouse without testing every
+    # note: the notes are stored in an interval tree of their (onset, offset), and only the notes overlapping the
+    # mouse time are tested against its y value (midi or chroma, see DraggableHLine.contains/contains_chroma).
+    #
+    # The tree is rebuilt on the first query after a note was added, removed or moved: update() is called once at the
+    # end of a drag (not on every motion event), the notes are not queried while being dragged.
+    #
+    # exp:
+    #       index = NoteIndex()
+    #       index.add(line, 0)                      # key: exp the number of the line in the canvas
+    #       index.find(event.xdata, event.ydata)    # key of the note under the mouse (or None)
+    #       index.update()                          # after moving a note
+
+    def __init__(self):
+        self.lines = dict()                     # id(line) -> (key, line)
+        self.tree = None                        # None: to be rebuilt
+
+    def __len__(self):
+        return len(self.lines)
+
+    def add(self, line, key):
+        self.lines[id(line)] = (key, line)
+        self.tree = None
+
+    def remove(self, line):
+        if self.lines.pop(id(line), None) is not None:
+            self.tree = None
+
+    def update(self):
+        # to be called when notes were moved
+        self.tree = None
+
+    def lines_at(self, x):
+        # (key, line) of the notes whose onset <= x <= offset
+        if self.tree is None:
+            self.tree = IntervalTree((line.onset, line.offset, (key, line))
+                                     for key, line in self.lines.values() if line.onset is not None)
+        return self.tree.query(x)
+
+    def find(self, x, y, chroma=False):
+        # key of the note containing (x, y) (y is a value of the chromagram axes if chroma), the highest key if several
+        # notes contain it (exp: the last added line, drawn on top), None if there is none
+        keys = [key for key, line in self.lines_at(x)
+                if (line.contains_chroma(x, y) if chroma else line.contains(x, y))]
+        if not keys:
+            return None
+        return max(keys)
@@ -0,0 +1,141 @@
+import functools
+import os
+import sys
+
+import sounddevice as sd
+from matplotlib.lines import Line2D
+from PyQt5.QtCore import QTimer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SparsenessSmoothness"))
+from Instrumentation import span
+
+
+class PlaybackCursor:
+
+    # Vertical line showing the playback position on all the registered axes (exp: the linked canvases of a track)
+    #
+    # The canvases used to move their own cursor from a thread calling fig.canvas.draw() every 0.2 s, i.e. redrawing
+    # the whole figure for each step. The cursor lines are now animated artists: the background of each axes is saved
+    # after every full draw of its figure, and a Qt timer restores it and blits the lines only (no figure redraw).
+    # The position is read from the time of the sounddevice stream, so the cursors of all the canvases follow the
+    # audio (and not a sleep based estimate).
+    #
+    # The axes of a canvas are unregistered when its Qt widget is destroyed (exp: the canvases of a transcriber window
+    # replaced by a new transcription), so the cursor neither keeps dead canvases alive nor blits into them.
+    #
+    # exp:
+    #       default_playback_cursor.add_axes(ax)                # once per axes showing the cursor
+    #       default_playback_cursor.play(audio, 44100)          # or default_playback_cursor.stop()
+
+    def __init__(self, interval_ms=30, color="r"):
+        #
+        #   interval_ms (int)   :   period of the cursor updates during playback (30 ms: about 33 fps)
+        #   color (str)         :   color of the cursor lines
+        self.interval_ms = interval_ms
+        self.color = color
+
+        self.lines = dict()                     # axes -> cursor line
+        self.backgrounds = dict()               # axes -> saved background (None until its figure is drawn)
+        self.canvases = dict()                  # id -> figure canvas whose draw events are connected
+
+        self.position = 0.0                     # (seconds) current position of the cursors
+        self.start = 0.0                        # (seconds) position in the audio where the playback started
+        self.stream = None                      # sounddevice stream of the playback (None when stopped)
+        self.stream_start = 0.0                 # stream time when the playback started
+        self.duration = 0.0
+        self.timer = None                       # created on first playback (needs the QApplication)
+
+    def add_axes(self, ax):
+        # shows the cursor on ax (the line is not added to the axes, so clearing the axes does not remove it)
+        line = Line2D([self.position, self.position], [0, 1], color=self.color, animated=True,
+                      transform=ax.get_xaxis_transform())
+        line.set_figure(ax.figure)
+        line.axes = ax
+        line.set_clip_box(ax.bbox)
+        self.lines[ax] = line
+        self.backgrounds[ax] = None
+
+        canvas = ax.figure.canvas
+        if id(canvas) not in self.canvases:
+            self.canvases[id(canvas)] = canvas
+            canvas.mpl_connect("draw_event", self.on_draw)
+            if hasattr(canvas, "destroyed"):
+                # (the slot only holds the id of the canvas: a reference would keep the canvas alive)
+                canvas.destroyed.connect(functools.partial(self.remove_canvas, id(canvas)))
+        return line
+
+    def remove_axes(self, ax):
+        self.lines.pop(ax, None)
+        self.backgrounds.pop(ax, None)
+
+    def remove_canvas(self, canvas_id, *args):
+        # unregisters a canvas and its axes (called when the widget of the canvas is destroyed)
+        canvas = self.canvases.pop(canvas_id, None)
+        for ax in [ax for ax in self.lines if ax.figure.canvas is canvas]:
+            self.remove_axes(ax)
+
+    def on_draw(self, event):
+        # saves the backgrounds of the axes of the drawn figure and draws their cursors on top
+        for ax, line in self.lines.items():
+            if ax.figure.canvas is event.canvas:
+                self.backgrounds[ax] = event.canvas.copy_from_bbox(ax.bbox)
+                line.set_xdata([self.position, self.position])
+                ax.draw_artist(line)
+
+    # ------------------------------------- Playback -------------------------------------------------------#
+
+    def is_playing(self):
+        return self.stream is not None
+
+    def play(self, audio, sample_rate=44100, start=0.0, **kwargs):
+        # plays audio from start (seconds), kwargs are passed to sounddevice.play (exp: blocksize)
+        self.stop()
+        first_sample = int(start * sample_rate)
+        sd.play(audio[first_sample:], sample_rate, **kwargs)
+        self.stream = sd.get_stream()
+        self.stream_start = self.stream.time
+        self.start = first_sample / float(sample_rate)
+        self.duration = len(audio) / float(sample_rate)
+
+        if self.timer is None:
+            self.timer = QTimer()
+            self.timer.timeout.connect(self.update)
+        self.timer.start(self.interval_ms)
+        self.move_to(self.start)
+
+    def stop(self):
+        # stops the playback (the cursors stay at the current position)
+        if self.stream is None:
+            return
+        sd.stop()
+        self.stream = None
+        self.timer.stop()
+
+    def update(self):
+        # moves the cursors to the position of the stream (called by the timer)
+        stream = self.stream
+        if stream is None:
+            return
+        if not stream.active:
+            self.stop()
+            return
+        elapsed = stream.time - self.stream_start - stream.latency
+        self.move_to(min(self.start + max(elapsed, 0.0), self.duration))
+
+    def move_to(self, position):
+        # blits the cursors at position (seconds), the figures are drawn normally if their background is unknown
+        with span("playback.cursor", n_axes=len(self.lines)):
+            self.position = position
+            for ax, line in self.lines.items():
+                canvas = ax.figure.canvas
+                background = self.backgrounds[ax]
+                if background is None:
+                    canvas.draw_idle()
+                    continue
+                canvas.restore_region(background)
+                line.set_xdata([position, position])
+                ax.draw_artist(line)
+                canvas.blit(ax.bbox)
+
+
+default_playback_cursor = PlaybackCursor()      # cursor shared by all the canvases (one playback at a time)
@@ -1,8 +1,6 @@
 from __future__ import unicode_literals
 import sys
 import os
-import shutil
-import glob
 
 import matplotlib
 # Make sure that we are using QT5
@@ -14,7 +12,6 @@ import essentia
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtCore import *
 
-from threading import Thread
 from matplotlib.backends.backend_qt5agg import (
         FigureCanvas, NavigationToolbar2QT)
 
@@ -37,10 +34,10 @@ from drumTranscriber import DrumTranscriber
 sys.path.append('../SparsenessSmoothness')
 sys.path.append('../MedianFiltering')
 
-from DecomposeSmoothSparse import HPSS as SMSP_HPSS  # smoothness/sparseness based harmonic/percussive source separation
+from separationJobManager import SeparationJobManager  # smsp/median separations in worker processes
+from Instrumentation import span, timed             # latency of the separation/transcription actions
+from trackPrefetcher import default_prefetcher      # loads the next/previous tracks in the background
 
-from librosa.core import stft, istft                    # Librosa Version 0.6.0
-import librosa.decompose
 
 import essentia.standard as es
 
@@ -94,6 +91,8 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         # button to load file into project
         self.load_button = QtWidgets.QPushButton('   Load   ')
         self.load_button.clicked.connect(self.load_mixed_file)
+        self.file_manager_gbox.next_push_button.clicked.connect(self.prefetch_neighbour_tracks)
+        self.file_manager_gbox.previous_push_button.clicked.connect(self.prefetch_neighbour_tracks)
 
 
         # separate and analyze buttons and algorithm selection check box
@@ -104,6 +103,12 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.separate_analyze_button = QtWidgets.QPushButton('   Separate and Analyze   ')
         self.separate_analyze_button.clicked.connect(self.separate_and_analyze)
         self.separate_analyze_button.setDisabled(True)  # Next  should be disabled before finding tracks
+        self.cancel_separation_button = QtWidgets.QPushButton('Cancel')
+        self.cancel_separation_button.clicked.connect(self.cancel_separations)
+        self.cancel_separation_button.setDisabled(True)
+        self.pause_separation_button = QtWidgets.QPushButton('Pause')
+        self.pause_separation_button.clicked.connect(self.pause_separations)
+        self.pause_separation_button.setDisabled(True)
 
         # bassline file selector drop down menu combobox
         self.bassline_files_comboBox = QtWidgets.QComboBox(self)    # shows the available separated bassline files
@@ -154,6 +159,8 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.mixed_canvas.main_layout.addWidget(self.median_checkbox, 3, 0, Qt.AlignLeft)     # separates using smsp or median
         self.mixed_canvas.main_layout.addWidget(self.SMSP_checkbox, 3, 0, Qt.AlignRight)  # separates using smsp or median
         self.mixed_canvas.main_layout.addWidget(self.separate_analyze_button, 5, 0)  # separates using smsp or median
+        self.mixed_canvas.main_layout.addWidget(self.pause_separation_button, 6, 0, Qt.AlignLeft)
+        self.mixed_canvas.main_layout.addWidget(self.cancel_separation_button, 6, 0, Qt.AlignRight)
 
         #           Bassline Audio Widget
         top_level_qt_widget.addWidget(self.harmonic_canvas, 2, 1, 2, 1)
@@ -197,6 +204,12 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.StatusBarSignal.connect(self.StatusBarUpdate)
         self.FindSeparatedFilesSignal.connect(self.find_separated_files)
 
+        # background separations (polled every 200 ms while running)
+        self.job_manager = SeparationJobManager()
+        self.separation_timer = QTimer(self)
+        self.separation_timer.setInterval(200)
+        self.separation_timer.timeout.connect(self.poll_separation_jobs)
+
         #
         self.statusBar().showMessage("", 2000)
         self.resize(1200, 1000)
@@ -207,6 +220,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.mixed_canvas.share_with_external_ax(midi_ax)
         self.percussive_canvas.share_with_external_ax(midi_ax)
 
+    @timed("gui.transcribe_drum")
     def transcribe_drum(self):
 
         drum_audio, sampleRate = self.percussive_canvas.get_audio()
@@ -216,8 +230,9 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         fftSize = int(self.harmonic_canvas.fft_size_comboBox.currentText())
         hopSize = int(eval(self.harmonic_canvas.hop_size_comboBox.currentText()) * frameSize)
 
-        segmentationJsonFilename = os.path.join(os.path.join(os.path.dirname(self.drum_files_comboBox.currentText()),
-                                                             '..'), "segmentation_data.json")
+        # (None if the track has no segmentation file: the beats are estimated)
+        segmentationJsonFilename = self.file_manager_gbox.dataset_index.segmentation_file(
+            self.file_manager_gbox.get_current_filename())
 
         if self.reestimate_beats_checkbox.checkState():
             segmentationJsonFilename = None
@@ -252,7 +267,8 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                                                segmentationJsonFilename=segmentationJsonFilename
                                                )
 
-        drum_analysisResults = AutoDrumLTranscriber.onsets_per_bands
+        with span("drum_transcriber.onsets_per_bands"):
+            drum_analysisResults = AutoDrumLTranscriber.onsets_per_bands
         grid = drum_analysisResults["grid"][0]
         beats = drum_analysisResults["beats"][0]
         onsets = drum_analysisResults["onsets"][0]
@@ -283,6 +299,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                 prefix_text = self.drum_prefix_lineEdit.text()
             )
 
+    @timed("gui.transcribe_bassline")
     def transcribe_bassline(self):
 
         drum_audio, sampleRate = self.percussive_canvas.get_audio()
@@ -293,8 +310,9 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         fftSize = int(self.harmonic_canvas.fft_size_comboBox.currentText())
         hopSize = int(eval(self.harmonic_canvas.hop_size_comboBox.currentText()) * frameSize)
 
-        segmentationJsonFilename = os.path.join(os.path.join(os.path.dirname(self.drum_files_comboBox.currentText()),
-                                                             '..'), "segmentation_data.json")
+        # (None if the track has no segmentation file: the beats are estimated)
+        segmentationJsonFilename = self.file_manager_gbox.dataset_index.segmentation_file(
+            self.file_manager_gbox.get_current_filename())
 
         if self.reestimate_beats_checkbox.checkState():
             segmentationJsonFilename = None
@@ -382,7 +400,8 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                                                    snapEnd=False)
 
         # midi_tracks, beats, _grid = AutomaticTranscriber.extractorEssentia()    # uses pitchMelodia
-        midi_tracks, _, _, bassline_onsets, estQuantizedMIDI, frame_times = AutoBassLTranscriber.onsets_with_pitch  # uses Yin
+        with span("bassline_transcriber.onsets_with_pitch"):    # uses Yin
+            midi_tracks, _, _, bassline_onsets, estQuantizedMIDI, frame_times = AutoBassLTranscriber.onsets_with_pitch
         print("bassline_onsets", bassline_onsets)
 
         # remove the first grid location if the distance to next grid line doesnt match with the rest
@@ -599,14 +618,20 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.find_bassline_files()
         self.find_drum_files()
         self.repaint()
+        self.prefetch_neighbour_tracks()
         return
 
-    def separate_and_analyze(self):
-        thread = Thread(target=self.separate_and_analyze_function)
-        thread.start()
+    def prefetch_neighbour_tracks(self):
+        # decodes and analyses the tracks before and after the current one while the current one is edited
+        default_prefetcher.prefetch(self.file_manager_gbox.neighbour_filenames(),
+                                    dataset_index=self.file_manager_gbox.dataset_index,
+                                    mix=self.mixed_canvas.analysis_parameters(),
+                                    harmonic=self.harmonic_canvas.analysis_parameters(),
+                                    percussive=self.percussive_canvas.analysis_parameters())
 
-    def separate_and_analyze_function(self):
-        # Separation using Smoothness/Sparseness
+    def separate_and_analyze(self):
+        # Separations run in worker processes (see separationJobManager.py), their progress is polled by
+        # self.separation_timer
         frameSize = self.mixed_canvas.frame_size_comboBox.currentText()
         frameSize = int(frameSize)
         hopSize = self.mixed_canvas.hop_size_comboBox.currentText()
@@ -615,22 +640,13 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         fftSize = int(fftSize)
 
         x, sampleRate = self.mixed_canvas.get_audio()
-        file_directory = os.path.dirname(self.mixed_canvas.get_filename())
-
-        # File name format Algo_FFTSize_frameSize_hopSize
-        SMSP_filename_prefix = "SMSP_"+str(fftSize)+"_"+str(frameSize)+"_"+str(hopSize)
-        median_filename_prefix = "median_"+str(fftSize)+"_"+str(frameSize)+"_"+str(hopSize)
+        filename = self.mixed_canvas.get_filename()
 
         if not x == []:
+            submitted = []
             if self.SMSP_checkbox.checkState():
-                self.StatusBarSignal.emit("Separating Using Smoothness/Sparseness NMF Algorithm")
-
                 #   separate using Smoothness/Sparseness
-                hpss = SMSP_HPSS(
-                    np.array(x),
-                    directory=file_directory,
-                    filename=SMSP_filename_prefix,
-                    format="wav",
+                params = dict(
                     beta=1.5,
                     frameSize=frameSize,
                     hopSize=hopSize,
@@ -641,65 +657,86 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                     K_TSP=.1,  # Percussive Temporal Smoothness
                     K_SSP=.1,  # Harmonic Spectral Smoothness
                     K_TSM=.2,  # Harmonic Temporal Smoothness
+                    tol=1e-3,  # Stop iterating when the relative cost decrease is below tol
+                    cost_interval=10,
+                    maxIter=100,
                 )
-
-                maxIter = 100
-
-                for i in range(int(maxIter)):
-                    self.StatusBarSignal.emit("Iteration %i out of %i" % (i + 1, maxIter))
-                    hpss.next_iteration()
-
-                hpss.create_masks()
-                hpss.spectral_to_temporal_using_masks()
-
-                hpss.save_separated_audiofiles()
-
-                shutil.move(os.path.join(file_directory, SMSP_filename_prefix+"_harmonic.wav"),
-                            os.path.join(os.path.join(file_directory, "harmonic"),
-                                         SMSP_filename_prefix+"_harmonic.wav"))
-
-                shutil.move(os.path.join(file_directory, SMSP_filename_prefix+"_percussive.wav"),
-                            os.path.join(os.path.join(file_directory, "percussive"),
-                                         SMSP_filename_prefix+"_percussive.wav"))
-
-                # self.StatusBarSignal.emit("Finished Separating (SMSP)")
+                submitted.append(self.job_manager.submit(filename, "smsp", x, params))
 
             if self.median_checkbox.checkState():
-                self.StatusBarSignal.emit("Separating Using Median Filtering Algorithm")
                 # Separation using median filtering
-                _stft = stft(x, n_fft=fftSize, hop_length=hopSize, win_length=frameSize, window="hann")
-
-                X_H, X_P = librosa.decompose.hpss(_stft, kernel_size=150)  # Get harmonic and percussive stfts
+                params = dict(frameSize=frameSize, hopSize=hopSize, fftSize=fftSize)
+                submitted.append(self.job_manager.submit(filename, "median", x, params))
 
-                x_h = istft(X_H, hop_length=hopSize, win_length=frameSize)  # Convert stfts to time domain signals
-                x_p = istft(X_P, hop_length=hopSize, win_length=frameSize)
+            if None in submitted:
+                self.StatusBarSignal.emit("This track is already being separated")
+            if self.job_manager.active_jobs():
+                self.cancel_separation_button.setDisabled(False)
+                self.update_pause_separation_button()
+                self.separation_timer.start()
 
-                MonoWriter = es.MonoWriter(sampleRate=44100, format="wav")  # Write to file
-                MonoWriter.configure(filename=
-                                     os.path.join(os.path.join(file_directory, "percussive"),
-                                                  median_filename_prefix+"_percussive.wav"))
-                MonoWriter(array(x_p))
-
-                MonoWriter = es.MonoWriter(sampleRate=44100, format="wav")  # Write to file
-                MonoWriter.configure(filename=
-                                     os.path.join(os.path.join(file_directory, "harmonic"),
-                                                  median_filename_prefix+"_harmonic.wav"))
-                MonoWriter(array(x_h))
+        return
 
-                # self.StatusBarSignal.emit("Finished Separating (Median Filtering)")
+    def poll_separation_jobs(self):
+        # called by self.separation_timer while separations are running
+        finished = False
+        for job in self.job_manager.poll():
+            if job.state == "done":
+                # the separated signals are displayed from the results of the job (no decoding of the saved files)
+                for output, values in zip(job.outputs, job.result()):
+                    default_prefetcher.add_audio(output, values)
+                finished = True
+            elif job.state == "failed":
+                print(job.error)
+
+        active_jobs = self.job_manager.active_jobs()
+        if active_jobs:
+            self.StatusBarSignal.emit(" | ".join(job.status_text() for job in active_jobs))
+            self.update_pause_separation_button()
+        else:
+            self.separation_timer.stop()
+            self.cancel_separation_button.setDisabled(True)
+            self.pause_separation_button.setDisabled(True)
+            self.pause_separation_button.setText("Pause")
+            self.StatusBarSignal.emit("Separation finished")
 
+        if finished:
             self.FindSeparatedFilesSignal.emit()
 
-        return
+    def cancel_separations(self):
+        for job in self.job_manager.active_jobs():
+            self.job_manager.cancel(job.job_id)
+        self.poll_separation_jobs()
+        self.StatusBarSignal.emit("Separations cancelled")
+
+    def pause_separations(self):
+        # pauses (or resumes) all the running separations that can be paused (see SeparationJob.can_pause)
+        active_jobs = [job for job in self.job_manager.active_jobs() if job.can_pause()]
+        if any(job.state == "running" for job in active_jobs):
+            for job in active_jobs:
+                self.job_manager.pause(job.job_id)
+        else:
+            for job in active_jobs:
+                self.job_manager.resume(job.job_id)
+        self.update_pause_separation_button()
+
+    def update_pause_separation_button(self):
+        # the button is only enabled while a running separation can be paused (exp: not for median filtering alone)
+        pausable_jobs = [job for job in self.job_manager.active_jobs() if job.can_pause()]
+        self.pause_separation_button.setDisabled(not pausable_jobs)
+        if any(job.state == "running" for job in pausable_jobs) or not pausable_jobs:
+            self.pause_separation_button.setText("Pause")
+        else:
+            self.pause_separation_button.setText("Resume")
+
+    def closeEvent(self, event):
+        self.job_manager.shutdown()
+        self.file_manager_gbox.dataset_index.save()
+        QtWidgets.QMainWindow.closeEvent(self, event)
 
     def find_bassline_files(self):
-        mix_track_folder = os.path.dirname(self.file_manager_gbox.get_current_filename())
-        bassline_folder = os.path.join(mix_track_folder, "harmonic")
-        bassline_files = glob.glob(os.path.join(bassline_folder, "*.mp3"))
-        wavs = glob.glob(os.path.join(bassline_folder, "*.wav"))
-        if wavs:
-            for wav in wavs:
-                bassline_files.append(wav)
+        bassline_files = self.file_manager_gbox.dataset_index.separated_files(
+            self.file_manager_gbox.get_current_filename(), "harmonic")
 
         # disable combo_box for selecting bassline file
         self.bassline_files_comboBox.setDisabled(True)
@@ -726,13 +763,8 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.repaint()
 
     def find_drum_files(self):
-        mix_track_folder = os.path.dirname(self.file_manager_gbox.get_current_filename())
-        drum_folder = os.path.join(mix_track_folder, "percussive")
-        drum_files = glob.glob(os.path.join(drum_folder, "*.mp3"))
-        wavs = glob.glob(os.path.join(drum_folder, "*.wav"))
-        if wavs:
-            for wav in wavs:
-                drum_files.append(wav)
+        drum_files = self.file_manager_gbox.dataset_index.separated_files(
+            self.file_manager_gbox.get_current_filename(), "percussive")
 
         # disable combo_box for selecting bassline file
         self.drum_files_comboBox.setDisabled(True)
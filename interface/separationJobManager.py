@@ -0,0 +1,353 @@
+import multiprocessing
+import os
+import sys
+import time
+import shutil
+import traceback
+import queue
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SparsenessSmoothness"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "MedianFiltering"))
+from STFTCache import STFTCache, default_stft_cache    # spectrograms shared with the workers
+
+
+class SeparationJob:
+    # State of a separation running in a worker process (updated by SeparationJobManager.poll)
+
+    def __init__(self, job_id, filename, method, process, messages, pause_event, shared_audio, results_prefix,
+                 output_prefix):
+        self.job_id = job_id
+        self.filename = filename                # mix file being separated
+        self.method = method                    # "smsp" or "median"
+        self.process = process
+        self.messages = messages                # (state, info) messages sent by the worker
+        self.pause_event = pause_event          # set to pause the separation (cleared to resume)
+        self.shared_audio = shared_audio        # input signal in shared memory (released when the job ends)
+        self.results_prefix = results_prefix    # prefix of the .npy files of the separated signals
+        self.output_prefix = output_prefix      # prefix of the separated files (Algo_FFTSize_frameSize_hopSize)
+
+        self.state = "running"                  # running, paused, done, failed or cancelled
+        self.iteration = 0                      # number of iterations done
+        self.n_iterations = 1                   # maximum number of iterations
+        self.cost = None                        # last evaluated cost
+        self.iteration_s = None                 # mean duration of an iteration (seconds)
+        self.error = None                       # traceback of the worker if the separation failed
+        self.outputs = []                       # separated files
+        self.results = dict()                   # "x_p"/"x_h" -> .npy file of the separated signal
+        self.start_time = time.time()
+
+    def is_active(self):
+        return self.state in ("running", "paused")
+
+    def can_pause(self):
+        # only the smsp separation checks for pauses (between its iterations), median filtering runs in one call
+        return self.method == "smsp"
+
+    def partial_outputs(self):
+        # files the worker may have left when it is stopped
+        files = [self.results_prefix + "_" + name + ".npy" for name in ("x_p", "x_h")]
+        files += [output + ".part" for output in separated_files(self.filename, self.output_prefix)]
+        return files
+
+    def result(self):
+        # returns the separated signals (x_p, x_h) as read-only memory mapped arrays (the job must be done)
+        if self.state != "done":
+            raise RuntimeError("Separation job %i is %s" % (self.job_id, self.state))
+        return tuple(np.load(self.results[name], mmap_mode="r") for name in ("x_p", "x_h"))
+
+    def progress(self):
+        # fraction of the iterations done
+        return min(self.iteration / float(max(self.n_iterations, 1)), 1.0)
+
+    def eta(self):
+        # estimated number of seconds left (None if unknown)
+        if self.state != "running" or self.iteration_s is None:
+            return None
+        return (self.n_iterations - self.iteration) * self.iteration_s
+
+    def status_text(self):
+        text = "%s %s: %s" % (self.method.upper(), os.path.basename(self.filename), self.state)
+        if self.is_active():
+            text += " %i/%i" % (self.iteration, self.n_iterations)
+            if self.cost is not None:
+                text += " (cost = %.4g)" % self.cost
+            if self.eta() is not None:
+                text += " ETA %is" % self.eta()
+        return text
+
+
+class SeparationJobManager:
+
+    # Runs harmonic/percussive separations in worker processes (one process per job), so that the separations of
+    # different methods run concurrently and never block the gui
+    #
+    # The input signal is passed to the worker in shared memory (no pickling of the audio), and the separated signals
+    # are returned as .npy files in results_directory, opened as memory maps by SeparationJob.result()
+    #
+    #   exp:
+    #       manager = SeparationJobManager()     # or SeparationJobManager(results_directory) to keep the results
+    #       manager.submit(filename, "smsp", audio, params)
+    #       ...
+    #       for job in manager.poll():      # call periodically (exp: from a QTimer), returns the updated jobs
+    #           print(job.status_text())
+    #       manager.cancel(job_id) / manager.pause(job_id) / manager.resume(job_id)
+    #
+    # The workers do not share the memory of the STFTCache of the gui: the spectrogram of the mix is passed to them
+    # through a spill directory (stft_directory) when it is in stft_cache, and the workers save the spectrograms they
+    # calculate there, for the next jobs
+    #
+    # Cancelling a job terminates its worker and removes its partial outputs. Each worker has its own message queue,
+    # which is discarded with it (a process terminated while writing to a queue may leave it corrupted).
+    #       x_p, x_h = job.result()         # once job.state == "done"
+
+    def __init__(self, results_directory=None, stft_cache=default_stft_cache):
+        #
+        #   results_directory (str) :   directory of the separated signals (default = None, i.e. a temporary directory)
+        #   stft_cache (STFTCache)  :   cache whose spectrograms are shared with the workers (None: no sharing)
+        self.context = multiprocessing.get_context("spawn")
+        self.jobs = dict()                          # job_id -> SeparationJob
+        self.next_job_id = 0
+
+        # temporary results are removed by shutdown()
+        self.temporary_results = results_directory is None
+        self.results_directory = tempfile.mkdtemp(prefix="separation_jobs_") if results_directory is None \
+            else results_directory
+        if not os.path.isdir(self.results_directory):
+            os.makedirs(self.results_directory)
+
+        self.stft_cache = stft_cache
+        self.shared_stft = STFTCache(max_bytes=0, spill_directory=os.path.join(self.results_directory, "stft"))
+
+    def active_job(self, filename, method):
+        # returns the active job separating filename with method (or None)
+        for job in self.jobs.values():
+            if job.filename == filename and job.method == method and job.is_active():
+                return job
+        return None
+
+    def submit(self, filename, method, audio, params):
+        #
+        #   filename (str)      :   mix file (the separated files are saved in the harmonic/percussive folders next
+        #                           to it)
+        #   method (str)        :   "smsp" or "median"
+        #   audio (1-D Array)   :   mix signal
+        #   params (dict)       :   frameSize, hopSize, fftSize (and for smsp: maxIter, tol and any HPSS option)
+        #
+        #   returns the new job, or None if the same file is already being separated with the same method
+        if self.active_job(filename, method) is not None:
+            return None
+
+        job_id = self.next_job_id
+        self.next_job_id += 1
+
+        shared_audio = self.context.RawArray("f", len(audio))
+        np.frombuffer(shared_audio, dtype=np.float32)[:] = audio
+
+        self.share_stft(audio, params)
+
+        results_prefix = os.path.join(self.results_directory, "job%i_%s" % (job_id, method))
+        output_prefix = "%s_%i_%i_%i" % ("SMSP" if method == "smsp" else "median", params["fftSize"],
+                                         params["frameSize"], params["hopSize"])
+        messages = self.context.Queue()
+        pause_event = self.context.Event()
+        process = self.context.Process(target=separation_process,
+                                       args=(filename, method, shared_audio, params, results_prefix, output_prefix,
+                                             self.shared_stft.spill_directory, messages, pause_event),
+                                       daemon=True)
+        job = SeparationJob(job_id, filename, method, process, messages, pause_event, shared_audio, results_prefix,
+                            output_prefix)
+        self.jobs[job_id] = job
+        process.start()
+        return job
+
+    def share_stft(self, audio, params):
+        # saves the spectrogram of audio (if it is in stft_cache) where the worker looks for it
+        # (the key is the one of the float32 copy of audio used by the worker)
+        if self.stft_cache is None:
+            return
+        key = self.stft_cache.key(np.asarray(audio, dtype=np.float32), params["fftSize"], params["frameSize"],
+                                  params["hopSize"], params.get("winType", "hann"))
+        spectrogram = self.stft_cache.get(key)
+        if spectrogram is not None:
+            self.shared_stft.spill(key, spectrogram)
+
+    def cancel(self, job_id):
+        # stops the worker wherever it is (stft, initialization, iterations, masks or saving)
+        job = self.jobs[job_id]
+        if not job.is_active():
+            return
+        job.process.terminate()
+        job.process.join()
+        job.state = "cancelled"
+        job.shared_audio = None
+        job.messages = None                     # (a late "done" message of the worker is never read)
+        for partial_output in job.partial_outputs():
+            if os.path.isfile(partial_output):
+                os.remove(partial_output)
+
+    def pause(self, job_id):
+        # returns True if the job was paused (a paused smsp job stops at the start of its next iteration)
+        job = self.jobs[job_id]
+        if job.state != "running" or not job.can_pause():
+            return False
+        job.pause_event.set()
+        job.state = "paused"
+        return True
+
+    def resume(self, job_id):
+        job = self.jobs[job_id]
+        if job.state == "paused":
+            job.pause_event.clear()
+            job.state = "running"
+
+    def active_jobs(self):
+        return [job for job in self.jobs.values() if job.is_active()]
+
+    def poll(self):
+        # processes the messages of the workers, returns the jobs that were updated
+        updated = dict()
+        self.read_messages(updated)
+
+        # workers that died without reporting (exp: killed). The queues are read again once they are found dead: a
+        # worker may have sent its last message and exited after the first read
+        exited = [job for job in self.jobs.values() if job.is_active() and not job.process.is_alive()]
+        if exited:
+            self.read_messages(updated)
+        for job in exited:
+            if not job.is_active() or job.job_id in updated:
+                continue
+            job.process.join()
+            if job.process.exitcode == 0:
+                continue        # exited normally, its message is read by the next poll
+            job.state = "failed"
+            if job.error is None:
+                job.error = "worker exited with code %s" % job.process.exitcode
+            updated[job.job_id] = job
+
+        for job in updated.values():
+            if not job.is_active():
+                job.shared_audio = None
+
+        return list(updated.values())
+
+    def read_messages(self, updated):
+        # applies the messages waiting in the queues of the active jobs (updated: job_id -> job of the updated jobs)
+        for job in self.active_jobs():
+            while job.is_active():
+                try:
+                    state, info = job.messages.get_nowait()
+                except queue.Empty:
+                    break
+                if state == "progress":
+                    if job.state != "paused":
+                        job.state = "running"
+                else:
+                    job.state = state
+                for key, value in info.items():
+                    setattr(job, key, value)
+                updated[job.job_id] = job
+
+    def shutdown(self):
+        # cancels all the active jobs
+        for job in self.active_jobs():
+            self.cancel(job.job_id)
+        if self.temporary_results:
+            shutil.rmtree(self.results_directory, ignore_errors=True)
+
+
+# ------------------------------------- Worker process -------------------------------------------------#
+
+def separation_process(filename, method, shared_audio, params, results_prefix, output_prefix, stft_directory, messages,
+                       pause_event):
+    # Entry point of the worker processes
+    try:
+        audio = np.frombuffer(shared_audio, dtype=np.float32)
+        stft_cache = STFTCache(spill_directory=stft_directory)     # (spectrograms shared with the gui and other jobs)
+        if method == "smsp":
+            x_p, x_h = separate_smsp(audio, params, messages, pause_event, stft_cache)
+        else:
+            x_p, x_h = separate_median(audio, params, messages, stft_cache)
+
+        results = dict()
+        for name, values in (("x_p", x_p), ("x_h", x_h)):
+            results[name] = results_prefix + "_" + name + ".npy"
+            result = np.lib.format.open_memmap(results[name], mode="w+", dtype=np.float32, shape=values.shape)
+            result[:] = values
+            result.flush()
+            del result
+        outputs = save_separated(filename, output_prefix, x_p, x_h)
+        messages.put(("done", {"outputs": outputs, "results": results}))
+    except Exception:
+        messages.put(("failed", {"error": traceback.format_exc()}))
+
+
+def separated_files(filename, prefix):
+    # separated files are saved in the harmonic and percussive folders next to the mix file
+    # (file name format Algo_FFTSize_frameSize_hopSize)
+    file_directory = os.path.dirname(filename)
+    return [os.path.join(file_directory, "percussive", prefix + "_percussive.wav"),
+            os.path.join(file_directory, "harmonic", prefix + "_harmonic.wav")]
+
+
+def save_separated(filename, prefix, x_p, x_h):
+    # the files are written as .part files and renamed once complete, so a cancelled job never leaves a truncated
+    # separated file (nor overwrites the file of a previous separation with one)
+    import essentia.standard as es
+    from essentia import array
+
+    outputs = separated_files(filename, prefix)
+    for output, values in zip(outputs, (x_p, x_h)):
+        if not os.path.isdir(os.path.dirname(output)):
+            os.makedirs(os.path.dirname(output))
+        es.MonoWriter(filename=output + ".part", sampleRate=44100, format="wav")(array(values))
+    for output in outputs:
+        os.replace(output + ".part", output)
+    return outputs
+
+
+def separate_smsp(audio, params, messages, pause_event, stft_cache):
+    # returns the separated signals (x_p, x_h) of HPSS.separate (so every HPSS option, exp: coarseIter, n_restarts or
+    # tol, is used as in the batch separations). Progress is reported and pauses are honored between the iterations.
+    from DecomposeSmoothSparse import HPSS
+    from Instrumentation import span
+
+    callback_times = []
+
+    def iteration_callback(hpss, iteration):
+        callback_times.append(time.time())
+        info = {"iteration": iteration}
+        if len(callback_times) > 1:
+            info["iteration_s"] = float(np.mean(np.diff(callback_times[-11:])))
+        if hpss.cost_history:
+            info["cost"] = hpss.cost_history[-1][1]
+        messages.put(("progress", info))
+        while pause_event.is_set():
+            time.sleep(.1)
+
+    hpss = HPSS(audio, stft_cache=stft_cache, iteration_callback=iteration_callback, **params)
+    stft_cache.flush()
+    messages.put(("progress", {"iteration": 0, "n_iterations": int(hpss.maxIter)}))
+
+    with span("job.separate_smsp", frameSize=params["frameSize"], hopSize=params["hopSize"],
+              fftSize=params["fftSize"]):
+        hpss.separate()
+    return hpss.x_p, hpss.x_h
+
+
+def separate_median(audio, params, messages, stft_cache):
+    from MedianSeparate import median_separate
+    from Instrumentation import span
+
+    messages.put(("progress", {"iteration": 0, "n_iterations": 1}))
+    with span("job.separate_median", frameSize=params["frameSize"], hopSize=params["hopSize"],
+              fftSize=params["fftSize"]):
+        x_p, x_h = median_separate(audio, frameSize=params["frameSize"], hopSize=params["hopSize"],
+                                   fftSize=params["fftSize"], winType="hann", kernel_size=150,
+                                   stft_cache=stft_cache)
+        stft_cache.flush()
+
+    messages.put(("progress", {"iteration": 1}))
+    return x_p, x_h
@@ -2,6 +2,7 @@
 # -*-coding:Utf-8 -*
 
 import sys
+import os
 
 from utils import *
 
@@ -26,13 +27,13 @@ import matplotlib.pyplot as plt
 
 from matplotlib.lines import Line2D
 
-from threading import Thread
-
-import time
-
-import sounddevice as sd
-
 from midiCanvas import ChromagramCanvas
+from spectrogramRenderer import PyramidImage, WaveformEnvelope   # spectrograms/waveforms drawn at screen resolution
+from trackPrefetcher import default_prefetcher   # audio decoded once and shared by the canvases (and prefetched)
+from playbackCursor import default_playback_cursor  # playback cursor blitted on all the canvases
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SparsenessSmoothness"))
+from STFTCache import default_stft_cache    # spectrograms shared with the separators
 
 
 class InteractiveSpectrogramCanvas(QtWidgets.QGroupBox):
@@ -246,6 +247,14 @@ class InteractiveSpectrogramCanvas(QtWidgets.QGroupBox):
     def get_filename(self):
         return self.AudioCanvas.filename
 
+    def analysis_parameters(self):
+        # stft and chromagram parameters of the canvases (used for prefetching the next tracks)
+        return dict(sample_rate=self.AudioCanvas.sample_rate,
+                    stft=dict(fft_size=self.HzCanvas.fft_size, frame_size=self.HzCanvas.frame_size,
+                              hop_size=self.HzCanvas.hop_size, win_type=self.HzCanvas.win_type),
+                    chromagram=dict(fft_size=self.ChromaCanvas.fft_size, frame_size=self.ChromaCanvas.frame_size,
+                                    hop_size=self.ChromaCanvas.hop_size, win_type=self.ChromaCanvas.win_type))
+
     def set_filename(self, filename):
         if filename[-4:] == ".mp3" or filename[-4:] == ".m4a" or filename[-4:] == ".wav" or filename[-5:] == ".flac":
             self.AudioCanvas.update_data(filename=filename)
@@ -354,16 +363,8 @@ class AudioWaveCanvas(FigureCanvas):
         #   variables used for plotting the moving vetrical audio scroll bar
         self.fig.canvas.mpl_connect('button_press_event', self.start_stop_play_vline)
 
-        self.play_vline = Line2D([0, 0], [-1, 1], color="r")
-        self.ax.add_line(self.play_vline)
-
-        self._vline_thread = None  # used for audio playback vline
+        self.play_vline = default_playback_cursor.add_axes(self.ax)
         self.vline_start = 0
-        self.vline_current = 0
-
-        self.vline_move_resolution = .2     # (seconds) amount to move line
-
-        self.is_playing = False
 
         self.show()
 
@@ -389,18 +390,15 @@ class AudioWaveCanvas(FigureCanvas):
     def load_audio(self):
         # loads the audio
         # apply equal-loudness filter for PredominantPitchMelodia
-        loader = es.MonoLoader(filename=self.filename, sampleRate=self.sample_rate)
-        self.audio = loader()
-        xvals = np.arange(len(self.audio)) / float(self.sample_rate)
-        self.xlim = [0, max(xvals)]
+        self.audio = default_prefetcher.audio(self.filename, self.sample_rate)
+        self.xlim = [0, len(self.audio) / float(self.sample_rate)]
 
     def plot(self):
         self.ax.cla()
         # loads audio, calculates stft and updates the plot
-        self.ax.add_line(self.play_vline)
-        xvals = np.arange(len(self.audio))/float(self.sample_rate)
-        self.xlim = [0, max(xvals)+self.sample_rate]
-        self.ax.plot(xvals, self.audio)
+        self.xlim = [0, len(self.audio) / float(self.sample_rate)]
+        WaveformEnvelope(self.ax, self.audio, self.sample_rate,
+                         levels=default_prefetcher.waveform_envelope(self.audio), color="C0")
         self.ax.set_xlim(self.xlim)
         self.ax.set_ylim([-1, 1])
         self.fig.canvas.draw()
@@ -408,27 +406,12 @@ class AudioWaveCanvas(FigureCanvas):
 
     def start_stop_play_vline(self, event):
         if (event.inaxes == self.ax) and event.dblclick:
-            if not self.is_playing:
-                self.vline_current = self.vline_start
-                self.is_playing = True
-                blocksize = 2048
-                self._vline_thread = Thread(target=self.move_play_vlive)
-                self._vline_thread.start()
-                sd.play(self.audio, self.sample_rate, blocksize=2048)
+            if not default_playback_cursor.is_playing():
+                default_playback_cursor.play(self.audio, self.sample_rate, self.vline_start, blocksize=2048)
             else:
-                sd.stop()
-                self.is_playing = False
+                default_playback_cursor.stop()
         return
 
-    def move_play_vlive(self):
-        while self.is_playing and (self.vline_current < (len(self.audio)/float(self.sample_rate))):
-            time.sleep(self.vline_move_resolution)
-            self.vline_current += self.vline_move_resolution
-            self.play_vline.set_xdata([self.vline_current, self.vline_current])
-            self.fig.canvas.draw()
-
-        self.is_playing = False
-
 
 class SpectrogramCanvas(FigureCanvas):
     # The Canvas for MIDI modification
@@ -511,16 +494,8 @@ class SpectrogramCanvas(FigureCanvas):
         if self.playable:
             self.fig.canvas.mpl_connect('button_press_event', self.start_stop_play_vline)
 
-        self.play_vline = Line2D([0, 0], [0, 40000], color="r")
-        self.ax_stft.add_line(self.play_vline)
-
-        self._vline_thread = None  # used for audio playback vline
+        self.play_vline = default_playback_cursor.add_axes(self.ax_stft)
         self.vline_start = 0
-        self.vline_current = 0
-
-        self.vline_move_resolution = .1  # (seconds) amount to move line
-
-        self.is_playing = False
 
         #initialize figure
         FigureCanvas.setSizePolicy(self,
@@ -579,8 +554,7 @@ class SpectrogramCanvas(FigureCanvas):
         # loads the audio
         # apply equal-loudness filter for PredominantPitchMelodia
         if self.filename:
-            loader = es.MonoLoader(filename=self.filename, sampleRate=self.sample_rate)
-            self.audio = loader()
+            self.audio = default_prefetcher.audio(self.filename, self.sample_rate)
             xvals = np.arange(len(self.audio)) / float(self.sample_rate)
             self.xlim = [0, max(xvals)]
             print("******", self.ax_stft)
@@ -591,21 +565,19 @@ class SpectrogramCanvas(FigureCanvas):
 
     def stft(self):
 
-        # save the results in the stft_pool
-        self.mX = []
-        for frame in es.FrameGenerator(self.audio, frameSize=self.frame_size,
-                                       hopSize=self.hop_size, startFromZero=True):
-
-            frame = frame*self.window
-            X = fft(frame, self.fft_size)  # computing fft
-            absX = np.abs(X[:int(self.fft_size / 2)])  # taking first half of the spectrum and its magnitude
-            absX[absX < np.finfo(float).eps] = np.finfo(float).eps  # getting rid of zeros before the next step
-            mX = 20 * np.log10(absX)
-            if self.threshold:
-                mX[mX < self.threshold] = -1000
-            self.mX.append(mX)
-
-        self.mX = array(self.mX)
+        # in both cases the frames are centered at multiples of hop_size (frame t is displayed at t*hop_size)
+        if self.frame_size <= self.fft_size:
+            # the complex spectrogram is shared (through the cache) with the separators and the other canvases
+            X = default_stft_cache.stft(self.audio, fftSize=self.fft_size, frameSize=self.frame_size,
+                                        hopSize=self.hop_size, winType=self.win_type)
+            absX = np.abs(X[:int(self.fft_size / 2)]).T  # taking first half of the spectrum and its magnitude
+            self.mX = array(amplitude_to_db(absX, self.threshold))
+        else:
+            # frames longer than the fft size are truncated to their central fft_size samples (i.e. frames of fft_size
+            # samples weighted by the center of the window), all the frames are transformed at once
+            first = (self.frame_size - self.fft_size) // 2
+            self.mX = db_spectrogram(self.audio, self.fft_size, self.fft_size, self.hop_size,
+                                     self.window[first:first + self.fft_size], self.threshold, start_from_zero=False)
 
         self.freqAxHz = float(self.sample_rate) * np.arange(len(self.mX[0])) / float(self.fft_size)
         self.freqAxMidi = pitch2midi(self.freqAxHz, quantizePitch=False)
@@ -617,7 +589,7 @@ class SpectrogramCanvas(FigureCanvas):
             self.ax_stft.cla()
             self.ax_stft.set_xlim(*self.xlim)
             self.ax_stft.set_ylim(*self.ylim)
-            self.ax_stft.pcolormesh(self.timeAxSec, self.freqAxHz, self.mX.T, cmap='RdBu_r')
+            PyramidImage(self.ax_stft, self.mX, self.timeAxSec, self.freqAxHz, cmap='RdBu_r')
             self.ax_stft.set_ylabel("(Hz)")  # we already handled the x-label with ax1
             self.fig.canvas.draw()
         else:
@@ -627,7 +599,7 @@ class SpectrogramCanvas(FigureCanvas):
             self.ax_stft.set_yticklabels(self.midis_ticks)
             self.ax_stft.set_ylim(*self.ylim)
             #self.ax_stft.pcolormesh(self.timeAxSec, self.freqAxMidi, self.mX.T)
-            self.ax_stft.pcolormesh(self.timeAxSec, self.freqAxHz, self.mX.T, cmap='RdBu_r')
+            PyramidImage(self.ax_stft, self.mX, self.timeAxSec, self.freqAxHz, cmap='RdBu_r')
             self.ax_stft.set_ylabel("(Midi #)")  # we already handled the x-label with ax1
             self.fig.canvas.draw()
         return
@@ -642,26 +614,12 @@ class SpectrogramCanvas(FigureCanvas):
 
     def start_stop_play_vline(self, event):
         if (event.inaxes == self.ax_stft) and event.dblclick:
-            if not self.is_playing:
-                self.vline_current = self.vline_start
-                self.is_playing = True
-                self._vline_thread = Thread(target=self.move_play_vlive)
-                sd.play(self.audio, self.sample_rate)
-                self._vline_thread.start()
+            if not default_playback_cursor.is_playing():
+                default_playback_cursor.play(self.audio, self.sample_rate, self.vline_start)
             else:
-                sd.stop()
-                self.is_playing = False
+                default_playback_cursor.stop()
         return
 
-    def move_play_vlive(self):
-        while self.is_playing and (self.vline_current < (len(self.audio)/float(self.sample_rate))):
-            time.sleep(self.vline_move_resolution)
-            self.vline_current += self.vline_move_resolution
-            self.play_vline.set_xdata([self.vline_current, self.vline_current])
-            self.fig.canvas.draw()
-
-        self.is_playing = False
-
 if __name__ == '__main__':
 
     app = QtWidgets.QApplication(sys.argv)
@@ -0,0 +1,206 @@
+import numpy as np
+from matplotlib.image import AxesImage
+from matplotlib.lines import Line2D
+
+
+# ------------------------------------- Pyramid image --------------------------------------------------#
+# Drawing a full spectrogram with pcolormesh creates one quad per bin (millions for a few minutes of audio at small
+# hop sizes), which makes every redraw (zoom, pan, play cursor) slow. PyramidImage draws it as an image of (about)
+# screen resolution instead: at each draw, only the visible part of the spectrogram is selected from a pyramid of
+# time downsampled copies (the minimum and maximum of pairs of frames at each level), and its frequency bins are
+# reduced to the number of pixel rows.
+
+
+def build_pyramid(values, min_frames=256):
+    # [(mins, maxs) of values, (mins, maxs) of values downsampled 2 times, 4 times, ...] along axis 0 (minimum and
+    # maximum of consecutive pairs of rows), until less than min_frames rows are left
+    values = np.asarray(values, dtype=np.float32)
+    levels = [(values, values)]
+    while len(levels[-1][0]) >= 2 * min_frames:
+        mins, maxs = levels[-1]
+        n = len(mins) // 2
+        next_mins, next_maxs = mins[0::2].copy(), maxs[0::2].copy()      # an odd last row is kept as is
+        np.minimum(next_mins[:n], mins[1::2], out=next_mins[:n])
+        np.maximum(next_maxs[:n], maxs[1::2], out=next_maxs[:n])
+        levels.append((next_mins, next_maxs))
+    return levels
+
+
+class PyramidImage(AxesImage):
+
+    # Image of a matrix <TxF> (exp: dB spectrogram, chromagram) with uniformly spaced time (x) and frequency (y) bins
+    #
+    # exp:  (replaces ax.pcolormesh(timeAxSec, freqAxHz, mX.T, cmap='RdBu_r'))
+    #       PyramidImage(ax, mX, timeAxSec, freqAxHz, cmap='RdBu_r')
+    #
+    # x and y are the centers of the bins. The colors are scaled to the min/max of the whole matrix, so they do not
+    # change when zooming.
+    #
+    # When several bins fall in one pixel, the pixel shows (reduction):
+    #       "max"       :   their maximum (default, exp: the peaks of a dB spectrogram)
+    #       "min"       :   their minimum
+    #       "extremum"  :   their minimum or maximum, the farthest from the center of the color scale (exp: a
+    #                       diverging color map)
+
+    def __init__(self, ax, values, x, y, cmap=None, vmin=None, vmax=None, reduction="max", **kwargs):
+        AxesImage.__init__(self, ax, cmap=cmap, origin="lower", interpolation="nearest", **kwargs)
+        if reduction not in ("max", "min", "extremum"):
+            raise ValueError("reduction must be 'max', 'min' or 'extremum' (got %r)" % (reduction,))
+        self.reduction = reduction
+
+        values = np.asarray(values)
+        self.levels = build_pyramid(values)
+        self.n_frames, self.n_bins = values.shape
+
+        # bin edges: x0 + i*dx, y0 + j*dy
+        self.dx = (x[-1] - x[0]) / float(len(x) - 1) if len(x) > 1 else 1.0
+        self.dy = (y[-1] - y[0]) / float(len(y) - 1) if len(y) > 1 else 1.0
+        self.x0 = x[0] - self.dx / 2.0
+        self.y0 = y[0] - self.dy / 2.0
+
+        self.set_clim(values.min() if vmin is None else vmin, values.max() if vmax is None else vmax)
+        self.view = None                        # (limits, size in pixels) of the rendered part
+
+        self.set_data(self.levels[-1][1].T)
+        ax.add_image(self)
+        self.set_extent((self.x0, self.x0 + self.n_frames * self.dx, self.y0, self.y0 + self.n_bins * self.dy))
+
+    def visible_range(self, limits, origin, step, n):
+        # first and last (excluded) bins within limits
+        lo, hi = sorted(limits)
+        first = int(np.clip(np.floor((lo - origin) / step), 0, n - 1))
+        last = int(np.clip(np.ceil((hi - origin) / step), first + 1, n))
+        return first, last
+
+    def render(self):
+        # selects the visible part of the matrix at the resolution of the axes
+        xlim, ylim = self.axes.get_xlim(), self.axes.get_ylim()
+        width, height = max(int(self.axes.bbox.width), 1), max(int(self.axes.bbox.height), 1)
+        view = (xlim, ylim, width, height)
+        if view == self.view:
+            return
+        self.view = view
+
+        t0, t1 = self.visible_range(xlim, self.x0, self.dx, self.n_frames)
+        f0, f1 = self.visible_range(ylim, self.y0, self.dy, self.n_bins)
+
+        # pyramid level with at least one frame per pixel column
+        level = int(np.clip(np.floor(np.log2(max((t1 - t0) / float(width), 1.0))), 0, len(self.levels) - 1))
+        factor = 2 ** level
+        l0, l1 = t0 // factor, -(-t1 // factor)
+        mins, maxs = self.levels[level]
+
+        # frequency bins reduced to (at least) one bin per pixel row
+        step = max((f1 - f0) // height, 1)
+        if self.reduction != "min":
+            block = maxs[l0:l1, f0:f1]
+            if step > 1:
+                block = np.maximum.reduceat(block, np.arange(0, f1 - f0, step), axis=1)
+        if self.reduction != "max":
+            block_min = mins[l0:l1, f0:f1]
+            if step > 1:
+                block_min = np.minimum.reduceat(block_min, np.arange(0, f1 - f0, step), axis=1)
+            if self.reduction == "min":
+                block = block_min
+            else:
+                center = (self.norm.vmin + self.norm.vmax) / 2.0
+                block = np.where(center - block_min > block - center, block_min, block)
+
+        self.set_data(block.T)
+        # (the extent of the rendered part must not autoscale the axes to it)
+        autoscale = self.axes.get_autoscalex_on(), self.axes.get_autoscaley_on()
+        self.axes.set_autoscale_on(False)
+        self.set_extent((self.x0 + l0 * factor * self.dx, self.x0 + min(l1 * factor, self.n_frames) * self.dx,
+                         self.y0 + f0 * self.dy, self.y0 + f1 * self.dy))
+        self.axes.set_autoscalex_on(autoscale[0])
+        self.axes.set_autoscaley_on(autoscale[1])
+
+    def draw(self, renderer, *args, **kwargs):
+        self.render()
+        AxesImage.draw(self, renderer, *args, **kwargs)
+
+
+# ------------------------------------- Waveform envelope ----------------------------------------------#
+# Plotting every sample of a track (millions of points) freezes the gui when opening long mixes. WaveformEnvelope
+# draws the min/max envelope of the samples under each pixel column instead (2 points per column), taken from a
+# pyramid of min/max values of blocks of 16, 32, 64, ... samples. The samples are drawn when zoomed in to less than
+# 16 samples per pixel.
+
+
+def build_envelope_pyramid(audio, block_size=16, min_blocks=256):
+    # [(mins, maxs) of the blocks of block_size samples, (mins, maxs) of the blocks of 2*block_size samples, ...]
+    # until less than min_blocks blocks are left
+    audio = np.asarray(audio, dtype=np.float32)
+    n_blocks = max(-(-len(audio) // block_size), 1)
+    padded = np.pad(audio, (0, n_blocks * block_size - len(audio)), mode="edge") if len(audio) else \
+        np.zeros(block_size, dtype=np.float32)
+    blocks = padded.reshape(n_blocks, block_size)
+    levels = [(blocks.min(axis=1), blocks.max(axis=1))]
+
+    while len(levels[-1][0]) >= 2 * min_blocks:
+        mins, maxs = levels[-1]
+        n = len(mins) // 2
+        next_mins, next_maxs = mins[0::2].copy(), maxs[0::2].copy()      # an odd last block is kept as is
+        np.minimum(next_mins[:n], mins[1::2], out=next_mins[:n])
+        np.maximum(next_maxs[:n], maxs[1::2], out=next_maxs[:n])
+        levels.append((next_mins, next_maxs))
+    return levels
+
+
+class WaveformEnvelope(Line2D):
+
+    # Waveform of audio drawn at the resolution of the axes
+    #
+    # exp:  (replaces ax.plot(np.arange(len(audio)) / float(sample_rate), audio))
+    #       WaveformEnvelope(ax, audio, sample_rate)
+
+    block_size = 16                             # number of samples of the blocks of the first pyramid level
+
+    def __init__(self, ax, audio, sample_rate, levels=None, **kwargs):
+        #
+        #   levels (list)   :   envelope pyramid of audio (exp: cached with the audio, see TrackPrefetcher), computed
+        #                       if not provided
+        self.audio = audio
+        self.sample_rate = float(sample_rate)
+        self.levels = build_envelope_pyramid(audio, self.block_size) if levels is None else levels
+        self.view = None                        # (xlim, width in pixels) of the rendered envelope
+
+        mins, maxs = self.levels[-1]
+        size = self.block_size * 2 ** (len(self.levels) - 1)
+        Line2D.__init__(self, *self.envelope(0, mins, maxs, size), **kwargs)
+        ax.add_line(self)
+
+    def envelope(self, first_block, mins, maxs, size):
+        # x and y data of a vertical min to max segment per block
+        x = np.repeat((np.arange(first_block, first_block + len(mins)) + .5) * size / self.sample_rate, 2)
+        y = np.empty(2 * len(mins), dtype=np.float32)
+        y[0::2] = mins
+        y[1::2] = maxs
+        return x, y
+
+    def render(self):
+        # selects the samples or the envelope level matching the visible time range
+        xlim = self.axes.get_xlim()
+        width = max(int(self.axes.bbox.width), 1)
+        if (xlim, width) == self.view:
+            return
+        self.view = (xlim, width)
+
+        lo, hi = sorted(xlim)
+        s0 = int(np.clip(np.floor(lo * self.sample_rate), 0, max(len(self.audio) - 1, 0)))
+        s1 = int(np.clip(np.ceil(hi * self.sample_rate) + 1, s0 + 1, len(self.audio)))
+        samples_per_pixel = (s1 - s0) / float(width)
+
+        if samples_per_pixel < self.block_size:
+            self.set_data(np.arange(s0, s1) / self.sample_rate, self.audio[s0:s1])
+            return
+
+        level = int(np.clip(np.floor(np.log2(samples_per_pixel / self.block_size)), 0, len(self.levels) - 1))
+        size = self.block_size * 2 ** level
+        b0, b1 = s0 // size, -(-s1 // size)
+        mins, maxs = self.levels[level]
+        self.set_data(*self.envelope(b0, mins[b0:b1], maxs[b0:b1], size))
+
+    def draw(self, renderer, *args, **kwargs):
+        self.render()
+        Line2D.draw(self, renderer, *args, **kwargs)
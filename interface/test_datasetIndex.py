@@ -0,0 +1,100 @@
+#   Tests of the dataset index (run with: python -m pytest interface)
+import glob
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import datasetIndex
+from datasetIndex import DatasetIndex
+
+
+def touch(path, mtime=None):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, "w").close()
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def bump_mtime(path, seconds=10):
+    # modification times may not change between two quick writes (coarse file system resolution)
+    mtime = os.stat(path).st_mtime + seconds
+    os.utime(path, (mtime, mtime))
+
+
+def make_dataset(root):
+    touch(os.path.join(root, "track_1", "track_1.mp3"))
+    touch(os.path.join(root, "track_1", "metadata.json"))
+    touch(os.path.join(root, "track_1", "harmonic", "SMSP_2048_2048_512_harmonic.wav"))
+    touch(os.path.join(root, "track_2", "track_2.wav"))
+    return os.path.join(root, "*/")
+
+
+def count_calls(monkeypatch, module, name):
+    calls = []
+    function = getattr(module, name)
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return function(*args, **kwargs)
+    monkeypatch.setattr(module, name, counted)
+    return calls
+
+
+def test_refresh_lists_the_tracks(tmp_path):
+    load_directory_format = make_dataset(str(tmp_path))
+    index = DatasetIndex(load_directory_format)
+    assert index.refresh() == [str(tmp_path / "track_1" / "track_1.mp3"), str(tmp_path / "track_2" / "track_2.wav")]
+    assert index.separated_files(str(tmp_path / "track_1" / "track_1.mp3"), "harmonic") == \
+        [str(tmp_path / "track_1" / "harmonic" / "SMSP_2048_2048_512_harmonic.wav")]
+    assert index.separated_files(str(tmp_path / "track_2" / "track_2.wav"), "percussive") == []
+
+
+def test_saved_index_is_reused(tmp_path, monkeypatch):
+    # a new index loads the saved json file, and neither globs nor scans the unchanged folders
+    load_directory_format = make_dataset(str(tmp_path))
+    tracks = DatasetIndex(load_directory_format).refresh()
+    assert os.path.isfile(str(tmp_path / ".dataset_index" / "index.json"))
+
+    globs = count_calls(monkeypatch, glob, "glob")
+    scans = count_calls(monkeypatch, datasetIndex, "scan_files")
+    index = DatasetIndex(load_directory_format)
+    assert index.refresh() == tracks
+    assert globs == [] and scans == []
+    assert not index.dirty
+
+
+def test_modified_folders_are_scanned_again(tmp_path, monkeypatch):
+    load_directory_format = make_dataset(str(tmp_path))
+    index = DatasetIndex(load_directory_format)
+    index.refresh()
+
+    # a file added to a track folder: only this folder is scanned again (the folders are not globbed)
+    touch(str(tmp_path / "track_2" / "track_2_remix.mp3"))
+    bump_mtime(str(tmp_path / "track_2"))
+    globs = count_calls(monkeypatch, glob, "glob")
+    scans = count_calls(monkeypatch, datasetIndex, "scan_files")
+    assert str(tmp_path / "track_2" / "track_2_remix.mp3") in index.refresh()
+    assert globs == []
+    assert {args[0] for args in scans} == {os.path.normpath(str(tmp_path / "track_2"))}
+
+    # a track folder added: the folders are globbed again
+    touch(str(tmp_path / "track_3" / "track_3.mp3"))
+    bump_mtime(str(tmp_path))
+    assert str(tmp_path / "track_3" / "track_3.mp3") in index.refresh()
+    assert len(globs) == 1
+
+    # and the saved index knows about it
+    assert str(tmp_path / "track_3" / "track_3.mp3") in DatasetIndex(load_directory_format).refresh()
+
+
+def test_separated_files_are_listed_again_when_modified(tmp_path):
+    load_directory_format = make_dataset(str(tmp_path))
+    index = DatasetIndex(load_directory_format)
+    track = str(tmp_path / "track_1" / "track_1.mp3")
+    index.refresh()
+    assert len(index.separated_files(track, "harmonic")) == 1
+
+    touch(str(tmp_path / "track_1" / "harmonic" / "median_2048_2048_512_harmonic.wav"))
+    bump_mtime(str(tmp_path / "track_1" / "harmonic"))
+    assert len(index.separated_files(track, "harmonic")) == 2
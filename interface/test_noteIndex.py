@@ -0,0 +1,83 @@
+#   Tests of the note index (run with: python -m pytest interface)
+import os
+import random
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from noteIndex import IntervalTree, NoteIndex
+
+
+class FakeLine:
+
+    # onset, offset and y tests of a DraggableHLine (midi value +/- 0.5, chroma value +/- 0.5)
+
+    def __init__(self, onset, offset, midi):
+        self.onset = onset
+        self.offset = offset
+        self.midi = midi
+
+    def contains(self, x, y):
+        return self.onset <= x <= self.offset and abs(y - self.midi) <= 0.5
+
+    def contains_chroma(self, x, y):
+        return self.onset <= x <= self.offset and abs(y - self.midi % 12) <= 0.5
+
+
+def random_intervals(rng, n):
+    intervals = []
+    for i in range(n):
+        start = rng.randint(0, 100) / 4.0           # (repeated endpoints)
+        intervals.append((start, start + rng.randint(0, 20) / 4.0, i))
+    return intervals
+
+
+def test_interval_tree_matches_a_scan():
+    rng = random.Random(0)
+    for n in [0, 1, 2, 10, 200]:
+        intervals = random_intervals(rng, n)
+        tree = IntervalTree(intervals)
+        endpoints = [value for start, end, item in intervals for value in (start, end)]
+        points = endpoints + [rng.uniform(-5, 130) for i in range(100)]
+        for x in points:
+            expected = sorted(item for start, end, item in intervals if start <= x <= end)
+            assert sorted(tree.query(x)) == expected
+
+
+def test_note_index_finds_the_note_under_the_mouse():
+    rng = random.Random(1)
+    lines = [FakeLine(start, end, rng.randint(40, 50)) for start, end, i in random_intervals(rng, 100)]
+    index = NoteIndex()
+    for key, line in enumerate(lines):
+        index.add(line, key)
+    assert len(index) == 100
+
+    def scan(x, y, chroma):
+        keys = [key for key, line in enumerate(lines)
+                if index.lines.get(id(line)) and (line.contains_chroma(x, y) if chroma else line.contains(x, y))]
+        return max(keys) if keys else None
+
+    for i in range(300):
+        x, y, chroma = rng.uniform(-5, 130), rng.uniform(39, 51), rng.random() < 0.3
+        if chroma:
+            y = y % 12
+        assert index.find(x, y, chroma=chroma) == scan(x, y, chroma)
+
+    # moved and removed notes
+    for line in lines[::3]:
+        line.onset, line.offset = line.onset + 7, line.offset + 7
+    index.update()
+    for line in lines[1::5]:
+        index.remove(line)
+    for i in range(300):
+        x, y = rng.uniform(-5, 130), rng.uniform(39, 51)
+        assert index.find(x, y) == scan(x, y, False)
+
+
+def test_deleted_notes_are_not_indexed():
+    index = NoteIndex()
+    line = FakeLine(1.0, 2.0, 45)
+    index.add(line, 0)
+    assert index.find(1.5, 45) == 0
+    line.onset = line.offset = None         # (deleted by a double click)
+    index.update()
+    assert index.find(1.5, 45) is None
@@ -0,0 +1,197 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import essentia.standard as es
+from essentia import array
+from scipy.signal import get_window
+
+from utils import magnitude_spectrogram
+from spectrogramRenderer import build_envelope_pyramid, WaveformEnvelope
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SparsenessSmoothness"))
+from STFTCache import STFTCache, default_stft_cache    # spectrograms shared with the separators and canvases
+from Instrumentation import span
+
+
+def load_audio(filename, sample_rate=44100):
+    # decodes an audio file (mono)
+    return es.MonoLoader(filename=filename, sampleRate=sample_rate)()
+
+
+def calc_chromagram(audio, fft_size=1024, frame_size=1024, hop_size=256, win_type="hann", sample_rate=44100):
+    # 12 bin HPCP chromagram <Tx12> of audio (see ChromagramCanvas)
+    # (fft_size is not used: as es.Spectrum, the spectrum size is the frame size)
+    hpcp = es.HPCP(size=12,     # we will need higher resolution for Key estimation
+                   referenceFrequency=440,  # assume tuning frequency is 44100.
+                   bandPreset=False,
+                   weightType='cosine',
+                   nonLinear=False,
+                   windowSize=1.,
+                   sampleRate=sample_rate)
+
+    spectral_peaks = es.SpectralPeaks(sampleRate=sample_rate)
+
+    # spectra of all the frames at once
+    spectrogram = magnitude_spectrogram(audio, frame_size, frame_size, hop_size, get_window(win_type, frame_size))
+
+    chromagram = []
+    for spectrum in spectrogram:
+        freqs, mags = spectral_peaks(spectrum)
+        chromagram.append(hpcp(freqs, mags))
+
+    return array(chromagram)
+
+
+class TrackPrefetcher:
+
+    # Loads the tracks next to the current one in a background thread, so that switching tracks does not wait for
+    # decoding and analysing the audio
+    #
+    # For each prefetched track, the thread:
+    #       1.  decodes the mix and its first harmonic/percussive separated files (the ones displayed after loading)
+    #       2.  calculates their waveform envelopes, spectrograms (stored in the shared STFTCache, where the
+    #           spectrogram canvases find them) and chromagrams
+    #
+    # The canvases get their audio, envelopes and chromagrams through audio(), waveform_envelope() and chromagram(),
+    # which return the prefetched results if available and compute them (and keep them) otherwise.
+    #
+    # exp:
+    #       default_prefetcher.prefetch(["track_2.mp3", "track_4.mp3"], dataset_index,
+    #                                   mix=mixed_canvas.analysis_parameters())
+    #       audio = default_prefetcher.audio("track_2.mp3")                 # no decoding if already prefetched
+
+    def __init__(self, max_tracks=9, max_chromagrams=12, stft_cache=default_stft_cache):
+        #
+        #   max_tracks (int)        :   maximum number of decoded audio files kept in memory (default: the current
+        #                               and the two neighbour tracks, each with its two displayed separated files)
+        #   max_chromagrams (int)   :   maximum number of chromagrams kept in memory
+        #   stft_cache (STFTCache)  :   cache where the spectrograms are prefetched
+        self.max_tracks = max_tracks
+        self.max_chromagrams = max_chromagrams
+        self.stft_cache = stft_cache
+
+        self.audios = OrderedDict()             # (filename, sample_rate, mtime) -> audio (least recently used first)
+        self.chromagrams = OrderedDict()        # (audio hash, parameters) -> chromagram
+        self.envelopes = OrderedDict()          # audio hash -> waveform envelope pyramid
+        self.dataset_index = None               # DatasetIndex listing the separated files of the tracks
+        self.lock = threading.RLock()
+
+        self.pending = []                       # (filename, mix/harmonic/percussive parameters) to prefetch
+        self.condition = threading.Condition(self.lock)
+        self.thread = None
+
+    # ------------------------------------- Cached data ----------------------------------------------------#
+
+    def audio(self, filename, sample_rate=44100):
+        # decoded audio of filename (shared, do not modify in place)
+        key = (filename, sample_rate, os.path.getmtime(filename))
+        with self.lock:
+            if key in self.audios:
+                self.audios.move_to_end(key)
+                return self.audios[key]
+
+        with span("prefetch.load_audio"):
+            audio = load_audio(filename, sample_rate)
+
+        with self.lock:
+            self.audios[key] = audio
+            while len(self.audios) > self.max_tracks:
+                self.audios.popitem(last=False)
+        return audio
+
+    def add_audio(self, filename, audio, sample_rate=44100):
+        # stores the audio of a file that was just written (exp: the memory mapped result of a separation job), so it
+        # is not decoded again when displayed
+        key = (filename, sample_rate, os.path.getmtime(filename))
+        with self.lock:
+            self.audios[key] = audio
+            while len(self.audios) > self.max_tracks:
+                self.audios.popitem(last=False)
+
+    def chromagram(self, audio, fft_size=1024, frame_size=1024, hop_size=256, win_type="hann", sample_rate=44100):
+        key = (STFTCache.audio_hash(audio), fft_size, frame_size, hop_size, win_type, sample_rate)
+        with self.lock:
+            if key in self.chromagrams:
+                self.chromagrams.move_to_end(key)
+                return self.chromagrams[key]
+
+        with span("prefetch.chromagram"):
+            chromagram = calc_chromagram(audio, fft_size, frame_size, hop_size, win_type, sample_rate)
+
+        with self.lock:
+            self.chromagrams[key] = chromagram
+            while len(self.chromagrams) > self.max_chromagrams:
+                self.chromagrams.popitem(last=False)
+        return chromagram
+
+    def waveform_envelope(self, audio):
+        # min/max envelope pyramid of audio (see spectrogramRenderer.WaveformEnvelope), kept as long as the audio
+        key = STFTCache.audio_hash(audio)
+        with self.lock:
+            if key in self.envelopes:
+                self.envelopes.move_to_end(key)
+                return self.envelopes[key]
+
+        with span("prefetch.waveform_envelope"):
+            envelope = build_envelope_pyramid(audio, WaveformEnvelope.block_size)
+        with self.lock:
+            self.envelopes[key] = envelope
+            while len(self.envelopes) > self.max_tracks:
+                self.envelopes.popitem(last=False)
+        return envelope
+
+    # ------------------------------------- Background prefetching -----------------------------------------#
+
+    def prefetch(self, filenames, dataset_index, mix=None, harmonic=None, percussive=None):
+        #
+        #   filenames (list)                :   mix tracks to prefetch (replaces the tracks not prefetched yet)
+        #   dataset_index (DatasetIndex)    :   index of the dataset of the tracks (lists their separated files)
+        #   mix, harmonic, percussive (dict):   analysis parameters of the mix canvas and of the harmonic/percussive
+        #                                       canvases, exp: InteractiveSpectrogramCanvas.analysis_parameters()
+        #                                       (None: only the audio of the corresponding files is prefetched)
+        with self.condition:
+            self.dataset_index = dataset_index
+            self.pending = [(filename, mix, harmonic, percussive) for filename in filenames]
+            self.condition.notify()
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="TrackPrefetcher", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                filename, mix, harmonic, percussive = self.pending.pop(0)
+
+            try:
+                with span("prefetch.track"):
+                    self.prefetch_file(filename, mix)
+                    for part, parameters in (("harmonic", harmonic), ("percussive", percussive)):
+                        separated_files = self.dataset_index.separated_files(filename, part)
+                        if separated_files:
+                            self.prefetch_file(separated_files[0], parameters)
+            except Exception as error:        # prefetching is optional, the track is loaded normally
+                print("Could not prefetch %s (%s)" % (filename, error))
+
+    def prefetch_file(self, filename, parameters=None):
+        # decodes filename and calculates its spectrogram and chromagram with the parameters of its canvases
+        if parameters is None:
+            self.waveform_envelope(self.audio(filename))
+            return
+
+        audio = self.audio(filename, parameters["sample_rate"])
+        self.waveform_envelope(audio)
+        stft = parameters["stft"]
+        if stft["frame_size"] <= stft["fft_size"]:
+            self.stft_cache.stft(audio, fftSize=stft["fft_size"], frameSize=stft["frame_size"],
+                                 hopSize=stft["hop_size"], winType=stft["win_type"])
+        chroma = parameters["chromagram"]
+        self.chromagram(audio, chroma["fft_size"], chroma["frame_size"], chroma["hop_size"], chroma["win_type"],
+                        parameters["sample_rate"])
+
+
+default_prefetcher = TrackPrefetcher()          # prefetcher shared by the canvases of the gui
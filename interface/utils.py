@@ -1,4 +1,5 @@
 import numpy as np
+from scipy.signal import get_window
 
 
 def pitch2midi(pitchArray, quantizePitch=False):
@@ -59,3 +60,79 @@ def midi2note (midi_number):
 
     return note
 
+
+# ------------------------------------- Batched spectrograms -------------------------------------------#
+# All the frames of a signal are cut at once (strided view, no copy) and transformed by chunks of frames_per_chunk
+# frames, instead of calling an fft per frame. Used by the spectrogram/chromagram canvases and the transcribers.
+
+def frame_signal(audio, frame_size, hop_size, start_from_zero=True):
+    # frames <Txframe_size> of audio (read-only view), cut as es.FrameGenerator:
+    #       start_from_zero=True    :   the first frame starts at sample 0, only the frames within the signal are cut
+    #       start_from_zero=False   :   the first frame is centered at sample 0 (the signal is zero padded by
+    #                                   frame_size/2 samples at both ends)
+    audio = np.ascontiguousarray(audio)
+    if not start_from_zero:
+        audio = np.pad(audio, (frame_size // 2, frame_size // 2), mode="constant")
+    if len(audio) < frame_size:
+        audio = np.pad(audio, (0, frame_size - len(audio)), mode="constant")
+
+    n_frames = 1 + (len(audio) - frame_size) // hop_size
+    return np.lib.stride_tricks.as_strided(audio, shape=(n_frames, frame_size),
+                                           strides=(audio.strides[0] * hop_size, audio.strides[0]), writeable=False)
+
+
+def essentia_window(win_type, size):
+    # window applied by es.Windowing with its default parameters (symmetric window normalized to an area of 2)
+    window = get_window(win_type, size, fftbins=False)
+    return window * (2.0 / np.sum(window))
+
+
+def spectra(audio, fft_size, frame_size, hop_size, window, start_from_zero=True, zero_phase=False,
+            frames_per_chunk=1024):
+    #
+    #   Generator of the spectra of the frames of audio, by chunks: yields (index of the first frame of the chunk,
+    #   complex spectra of the chunk <tx(fft_size/2+1)>)
+    #
+    #   window (1-D Array)      :   window of frame_size samples
+    #   fft_size (int)          :   frames shorter than fft_size are zero padded, longer frames are truncated
+    #   zero_phase (bool)       :   if True, the frames are centered at sample 0 of the fft (as es.Windowing)
+    frames = frame_signal(audio, frame_size, hop_size, start_from_zero)
+    window = np.asarray(window, dtype=np.float32)
+    for t0 in range(0, len(frames), frames_per_chunk):
+        X = np.fft.rfft(frames[t0:t0 + frames_per_chunk] * window, n=fft_size, axis=1)
+        if zero_phase:
+            X[:, 1::2] *= -1        # circular shift of the frames by fft_size/2 samples
+        yield t0, X
+
+
+def magnitude_spectrogram(audio, fft_size, frame_size, hop_size, window, start_from_zero=True, n_bins=None,
+                          frames_per_chunk=1024):
+    # magnitude spectrogram <Txn_bins> (float32) of audio (default n_bins = fft_size/2+1, see spectra())
+    n_frames = len(frame_signal(audio, frame_size, hop_size, start_from_zero))
+    if n_bins is None:
+        n_bins = fft_size // 2 + 1
+
+    mX = np.empty((n_frames, n_bins), dtype=np.float32)
+    for t0, X in spectra(audio, fft_size, frame_size, hop_size, window, start_from_zero,
+                         frames_per_chunk=frames_per_chunk):
+        np.abs(X[:, :n_bins], out=mX[t0:t0 + len(X)], casting="same_kind")
+    return mX
+
+
+def amplitude_to_db(absX, threshold=None):
+    # 20*log10 of a magnitude spectrogram (in place, values below eps are raised to eps first), the bins below
+    # threshold (dB) are set to -1000
+    np.maximum(absX, np.finfo(float).eps, out=absX)
+    np.log10(absX, out=absX)
+    absX *= 20
+    if threshold:
+        absX[absX < threshold] = -1000
+    return absX
+
+
+def db_spectrogram(audio, fft_size, frame_size, hop_size, window, threshold=None, start_from_zero=True,
+                   frames_per_chunk=1024):
+    # dB magnitude spectrogram <Tx(fft_size/2)> (float32) of the frames of audio starting at multiples of hop_size
+    # (centered at multiples of hop_size if not start_from_zero, see frame_signal)
+    return amplitude_to_db(magnitude_spectrogram(audio, fft_size, frame_size, hop_size, window, start_from_zero,
+                                                 n_bins=fft_size // 2, frames_per_chunk=frames_per_chunk), threshold)